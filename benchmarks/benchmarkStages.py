@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    benchmarkStages.py
+    -------------------
+
+    Date                 : September 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Benchmarks of pipeline stages on reproducible synthetic networks.
+Graph core stages run with any Python 3, stages of CountRoutesMethods need the Python of a QGIS installation.
+
+    python benchmarks/benchmarkStages.py --sizes 1e4 1e5 1e6 1e7 --output results.json
+    python benchmarks/benchmarkStages.py --compare results.json
+
+Sizes are the numbers of graph edges (both directions of each segment).
+The growth of a stage is the slope of log(time) by log(size) between two neighbouring sizes:
+about 1 for linear stages, about 2 for quadratic ones.
+Times are measured in runs without tracing memory, peaks of traced memory are measured
+in a separate run of each stage, so tracing does not slow down the compared times.
+"""
+
+import os
+import sys
+import gc
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from countroutes.CountRoutesGraph import CountRoutesGraph, searchBridges  # noqa: E402
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+class Feedback:
+    """
+    The minimal feedback of QgsProcessingFeedback used by pipeline stages
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def setProgress(self, value):
+        self.value = value
+
+    def progress(self):
+        return self.value
+
+    def isCanceled(self):
+        return False
+
+    def pushInfo(self, info):
+        pass
+
+
+def getGridNetwork(edgeCount, rnd):
+    """
+    A square grid of streets
+    :return: A list of polylines [[(x, y), (x, y)],..]
+    """
+    side = max(2, int(math.sqrt(edgeCount / 4)) + 1)
+    polylines = []
+    for i in range(side):
+        for j in range(side):
+            if i + 1 < side:
+                polylines.append([(i, j), (i + 1, j)])
+            if j + 1 < side:
+                polylines.append([(i, j), (i, j + 1)])
+    return polylines
+
+
+def getTreeNetwork(edgeCount, rnd):
+    """
+    A random spanning tree of a grid, every segment is a bridge of a blind pass branch
+    """
+    side = max(2, int(math.sqrt(edgeCount / 2)) + 1)
+    segments = getGridNetwork(4 * (side - 1) ** 2, rnd)
+    rnd.shuffle(segments)
+    parents = dict()
+
+    def getRoot(point):
+        while parents.get(point, point) != point:
+            point = parents[point]
+        return point
+
+    polylines = []
+    for fromPoint, toPoint in segments:
+        fromRoot = getRoot(fromPoint)
+        toRoot = getRoot(toPoint)
+        if fromRoot != toRoot:
+            parents[fromRoot] = toRoot
+            polylines.append([fromPoint, toPoint])
+    return polylines
+
+
+def getPlanarNetwork(edgeCount, rnd):
+    """
+    A random planar network: a jittered grid with removed streets and diagonals of some blocks
+    """
+    side = max(2, int(math.sqrt(edgeCount / 4)) + 1)
+    points = [[(i + rnd.uniform(-0.3, 0.3), j + rnd.uniform(-0.3, 0.3)) for j in range(side)] for i in range(side)]
+    polylines = []
+    for i in range(side):
+        for j in range(side):
+            if i + 1 < side and rnd.random() < 0.8:
+                polylines.append([points[i][j], points[i + 1][j]])
+            if j + 1 < side and rnd.random() < 0.8:
+                polylines.append([points[i][j], points[i][j + 1]])
+            if i + 1 < side and j + 1 < side and rnd.random() < 0.3:
+                if rnd.random() < 0.5:
+                    polylines.append([points[i][j], points[i + 1][j + 1]])
+                else:
+                    polylines.append([points[i + 1][j], points[i][j + 1]])
+    return polylines
+
+
+def getLadderNetwork(edgeCount, rnd):
+    """
+    A chain of ladder sections joined by single segments, so a large share of segments are bridges
+    """
+    polylines = []
+    x = 0
+    while 2 * len(polylines) < edgeCount:
+        rungs = rnd.randint(1, 4)
+        for idx in range(rungs):
+            polylines.append([(x + idx, 0), (x + idx, 1)])
+            if idx + 1 < rungs:
+                polylines.append([(x + idx, 0), (x + idx + 1, 0)])
+                polylines.append([(x + idx, 1), (x + idx + 1, 1)])
+        x += rungs - 1
+        polylines.append([(x, 0), (x + 1, 0)])  # The bridge to the next section
+        x += 1
+    return polylines
+
+
+def getStarNetwork(edgeCount, rnd, degree=64):
+    """
+    Wheels with high degree junctions in their hubs, hubs are joined in a chain
+    """
+    polylines = []
+    hubId = 0
+    while 2 * len(polylines) < edgeCount:
+        cx = 10 * hubId
+        rim = [
+            (cx + 3 * math.cos(2 * math.pi * idx / degree), 3 * math.sin(2 * math.pi * idx / degree))
+            for idx in range(degree)
+        ]
+        for idx, point in enumerate(rim):
+            polylines.append([(cx, 0), point])
+            polylines.append([point, rim[(idx + 1) % degree]])
+        if hubId:
+            polylines.append([(cx - 10, 0), (cx, 0)])
+        hubId += 1
+    return polylines
+
+
+NETWORKS = {
+    'grid': getGridNetwork,
+    'tree': getTreeNetwork,
+    'planar': getPlanarNetwork,
+    'ladder': getLadderNetwork,
+    'star': getStarNetwork,
+}
+
+
+def getCoreStages(polylines):
+    """
+    Stages of the graph core which do not need QGIS
+    :return: [(stageName, function),..], functions are run in order on the shared state
+    """
+    state = dict()
+
+    def buildNative():
+        state['graph'] = CountRoutesGraph.fromPolylines(polylines, 0)
+
+    def composingTwins():
+        state['graph'].composingTwins()
+
+    def composingSuccessors():
+        state['graph'].composingSuccessors()
+
+    def composingFaces():
+        state['graph'].composingFaces()
+
+    def searchGraphBridges():
+        graph = state['graph']
+        searchBridges(graph.toVertices, graph.twins, graph.outOffsets, graph.outEdges, range(graph.vertexCount()))
+
+    return state, [
+        ('fromPolylines', buildNative),
+        ('composingTwins', composingTwins),
+        ('composingSuccessors', composingSuccessors),
+        ('composingFaces', composingFaces),
+        ('searchBridges', searchGraphBridges),
+    ]
+
+
+def getMethodStages(polylines, methods, layer):
+    """
+    Stages of CountRoutesMethods in the order of the circle model pipeline
+    :param layer: A memory QgsVectorLayer with the polylines or None to skip composingGraph
+    """
+    state = dict()
+    feedback = Feedback()
+
+    def composingGraph():
+        methods.composingGraph(layer, layer.crs(), 0)
+
+    def buildNative():
+        state['graph'] = CountRoutesGraph.fromPolylines(polylines, 0)
+
+    def getEdgePairDict():
+        state['edgePairs'] = methods.getEdgePairDict(state['graph'], feedback)
+
+    def composingOrderModelFromGraph():
+        state['model'] = methods.composingOrderModelFromGraph(state['graph'], state['edgePairs'], feedback, 10)
+
+    def composingFaceModel():
+        methods.composingFaceModel(state['graph'], state['edgePairs'], feedback, 40)
+
+    def getBottlenecksPoints():
+        methods.getBottlenecksPoints(state['graph'], state['edgePairs'], state['graph'].faces, feedback, 20, True)
+
+    def getGraphBranches():
+        methods.getGraphBranches(state['graph'], state['edgePairs'])
+
+    stages = [
+        ('composingGraph', composingGraph),
+        (None, buildNative),  # Not measured, the graph of the native builder is used by other stages
+        ('getEdgePairDict', getEdgePairDict),
+        ('composingOrderModelFromGraph', composingOrderModelFromGraph),
+        ('composingFaceModel', composingFaceModel),
+        ('getBottlenecksPoints', getBottlenecksPoints),
+        ('getGraphBranches', getGraphBranches),
+    ]
+    if layer is None:
+        stages = stages[1:]
+    return state, stages
+
+
+def getQgisMethods():
+    """
+    :return: (CountRoutesMethods, makeLayer function) or (None, None) if QGIS is not available
+    """
+    try:
+        from qgis.core import QgsApplication, QgsVectorLayer, QgsFeature, QgsGeometry, QgsPointXY
+        from countroutes.CountRoutesMethods import CountRoutesMethods
+    except ImportError:
+        return None, None
+    if QgsApplication.instance() is None:
+        application = QgsApplication([], False)
+        application.initQgis()
+        getQgisMethods.application = application  # Keeping the application alive
+
+    def makeLayer(polylines):
+        layer = QgsVectorLayer('LineString?crs=EPSG:3857', 'benchmark', 'memory')
+        features = []
+        for points in polylines:
+            feature = QgsFeature()
+            feature.setGeometry(QgsGeometry.fromPolylineXY([QgsPointXY(x, y) for x, y in points]))
+            features.append(feature)
+        layer.dataProvider().addFeatures(features)
+        return layer
+
+    return CountRoutesMethods(), makeLayer
+
+
+def runStages(stages, isMemory):
+    """
+    Running stages in order, each stage is either timed or traced
+    :param isMemory: Peaks of traced memory are measured instead of times
+    :return: {stageName: seconds or peak bytes}
+    """
+    measures = dict()
+    for name, function in stages:
+        gc.collect()
+        if isMemory:
+            tracemalloc.start()
+            function()
+            measure = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            function()
+            measure = time.perf_counter() - start
+        if name is not None:
+            measures[name] = measure
+    return measures
+
+
+def runBenchmarks(families, sizes, repeat, seed, isMemory, log=sys.stderr):
+    methods, makeLayer = getQgisMethods()
+    if methods is None:
+        print('QGIS is not available, only graph core stages are measured.', file=log)
+    results = []
+    for family in families:
+        for size in sizes:
+            polylines = NETWORKS[family](size, random.Random(seed))
+            layer = makeLayer(polylines) if methods is not None else None
+            best = dict()  # {stageName: seconds}
+            peaks = dict()  # {stageName: peak bytes}
+            for isTraced in [False] * repeat + [True] * isMemory:
+                state, stages = getCoreStages(polylines)
+                if methods is not None:
+                    stages = stages + getMethodStages(polylines, methods, layer)[1]
+                for name, measure in runStages(stages, isTraced).items():
+                    if isTraced:
+                        peaks[name] = measure
+                    elif name not in best or measure < best[name]:
+                        best[name] = measure
+            graph = state['graph']
+            for name, seconds in best.items():
+                results.append({
+                    'network': family,
+                    'size': size,
+                    'edges': graph.edgeCount(),
+                    'vertices': graph.vertexCount(),
+                    'stage': name,
+                    'seconds': seconds,
+                    'peakBytes': peaks.get(name),
+                })
+                print(f'{family:>7} {graph.edgeCount():>10} {name:<30} {seconds:10.4f} s', file=log)
+    addGrowth(results)
+    return results
+
+
+def addGrowth(results):
+    """
+    Adding the slope of log(time) by log(edges) from the previous size of the same network and stage
+    """
+    previous = dict()
+    for result in sorted(results, key=lambda it: (it['network'], it['stage'], it['edges'])):
+        key = (result['network'], result['stage'])
+        result['growth'] = None
+        if key in previous:
+            edges, seconds = previous[key]
+            if result['edges'] > edges and seconds > 0 and result['seconds'] > 0:
+                result['growth'] = math.log(result['seconds'] / seconds) / math.log(result['edges'] / edges)
+        previous[key] = (result['edges'], result['seconds'])
+
+
+def getComparedSettings(report):
+    """
+    :return: {setting: value} which should be the same in compared reports (None of reports of old versions)
+    """
+    return {key: report.get(key) for key in ('timing', 'repeat', 'seed')}
+
+
+def compareResults(results, baseline, threshold, log=sys.stderr):
+    """
+    :return: A list of results slower than the baseline by the threshold ratio
+    """
+    baseTimes = {(it['network'], it['size'], it['stage']): it['seconds'] for it in baseline['results']}
+    regressions = []
+    for result in results:
+        baseSeconds = baseTimes.get((result['network'], result['size'], result['stage']))
+        if baseSeconds and result['seconds'] > threshold * baseSeconds:
+            regressions.append(result)
+            print(f"Regression: {result['network']} {result['size']} {result['stage']} "
+                  f"{baseSeconds:.4f} s -> {result['seconds']:.4f} s", file=log)
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of pipeline stages on synthetic networks.')
+    parser.add_argument('--networks', nargs='+', choices=sorted(NETWORKS), default=sorted(NETWORKS))
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1e4, 1e5, 1e6],
+                        help='Numbers of graph edges from 1e3 to 1e7 (1e4 1e5 1e6 by default, '
+                             'a network of 1e7 edges takes tens of minutes and gigabytes of memory)')
+    parser.add_argument('--repeat', type=int, default=1, help='The best time of several runs is taken')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-memory', dest='isMemory', action='store_false',
+                        help='Do not trace memory in a separate run of stages (times are never traced)')
+    parser.add_argument('--output', help='A JSON file of results (printed if it is not set)')
+    parser.add_argument('--compare', help='A JSON file of baseline results, exits with 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=1.5, help='The slowdown ratio of a regression')
+    options = parser.parse_args(args)
+    results = runBenchmarks(
+        options.networks,
+        [int(size) for size in options.sizes],
+        options.repeat,
+        options.seed,
+        options.isMemory
+    )
+    report = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'timing': 'untraced',
+        'memory': options.isMemory,
+        'repeat': options.repeat,
+        'seed': options.seed,
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(report, file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+    if options.compare:
+        with open(options.compare) as file:
+            baseline = json.load(file)
+        settings = getComparedSettings(report)
+        baseSettings = getComparedSettings(baseline)
+        if settings != baseSettings:
+            # E.g. times of reports of old versions were slowed down by tracing memory
+            print(f'The baseline was measured with other settings ({baseSettings} instead of {settings}), '
+                  'times are not compared.', file=sys.stderr)
+            return 2
+        if compareResults(results, baseline, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
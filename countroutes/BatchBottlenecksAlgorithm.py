@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    BatchBottlenecksAlgorithm.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import re
+from qgis.PyQt.QtGui import QIcon
+from processing.algs.qgis.QgisAlgorithm import QgisAlgorithm
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingContext,
+    QgsProcessingUtils,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterString,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterDefinition,
+    QgsVectorFileWriter,
+)
+from .CountRoutesHeadless import runTasks, writeStats
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+class BatchBottlenecksAlgorithm(QgisAlgorithm):
+
+    INPUT = 'INPUT'
+    IS_BRANCHES = 'IS_BRANCHES'
+    MERGE_BRANCHES = 'MERGE_BRANCHES'
+    CHAIN_SECTIONS = 'CHAIN_SECTIONS'
+    FIELDS = 'FIELDS'
+    TOLERANCE = 'TOLERANCE'
+    PROCESSES = 'PROCESSES'
+    LOAD_OUTPUTS = 'LOAD_OUTPUTS'
+    OUTPUT = 'OUTPUT'
+    REPORT = 'REPORT'
+
+    def __init__(self):
+        super().__init__()
+
+    def icon(self):
+        if self.provider():
+            self.iconPath = self.provider().algIconPath
+        else:
+            self.iconPath = ""
+        return QIcon(self.iconPath)
+
+    def name(self):
+        return 'batchbottlenecks'
+
+    def displayName(self):
+        return 'Bottleneck Quest Batch'
+
+    def shortHelpString(self):
+        return "<b>General:</b><br>" \
+               "This algorithm finds <b>bottlenecks</b> of <b>many network layers at once</b> " \
+               "by the bridge search of Bottleneck Quest.<br>" \
+               "Layers are analysed concurrently on a pool of worker processes, " \
+               "so checking dozens of networks takes about as long as the largest one. " \
+               "The progress is the share of features of finished layers, " \
+               "the result of each layer is shown in the log as soon as it is finished.<br>" \
+               "Layers which are not files (memory layers, databases, filtered layers) " \
+               "are saved to temporary GeoPackages first.<br>" \
+               "<b>Parameters:</b>" \
+               "<ul><li><u>Network layers</u> (the topology of the layers should be clean " \
+               "like for Bottleneck Quest),</li>" \
+               "<li><u>A choice to find branches</u>, <u>to merge branches</u> " \
+               "and <u>to chain sections of the same feature</u> like for Bottleneck Quest,</li>" \
+               "<li><u>Source fields to copy</u> (names separated by commas, missing fields are skipped),</li>" \
+               "<li><u>A topology tolerance</u> (a distance between endpoints combined in a single vertex),</li>" \
+               "<li><u>The number of worker processes</u> (0 means the number of processors).</li></ul>" \
+               "<b>Output:</b><br>" \
+               "A GeoPackage of bottlenecks of each layer in the output folder " \
+               "and a report of all layers with the status, counts of elements, the time, " \
+               "the process peak memory (the high-water mark of the worker, which may have analysed other layers) " \
+               "and stage times of each layer (batch_report.csv of the output folder if it is not set)."
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterMultipleLayers(
+            self.INPUT,
+            'Network Layers',
+            QgsProcessing.TypeVectorLine
+        ))
+        params = list()
+        params.append(QgsProcessingParameterBoolean(
+            self.IS_BRANCHES,
+            'Find branches with leaves',
+            False
+        ))
+        params.append(QgsProcessingParameterBoolean(
+            self.MERGE_BRANCHES,
+            'Merge branch sections into polylines',
+            False
+        ))
+        params.append(QgsProcessingParameterBoolean(
+            self.CHAIN_SECTIONS,
+            'Chain consecutive sections of the same feature',
+            True
+        ))
+        params.append(QgsProcessingParameterString(
+            self.FIELDS,
+            'Source fields to copy (separated by commas)',
+            optional=True
+        ))
+        params.append(QgsProcessingParameterNumber(
+            self.TOLERANCE,
+            'Topology tolerance',
+            QgsProcessingParameterNumber.Double,
+            0.01, False, 0, 100
+        ))
+        params.append(QgsProcessingParameterNumber(
+            self.PROCESSES,
+            'Worker processes',
+            QgsProcessingParameterNumber.Integer,
+            0, False, 0, 256
+        ))
+        params.append(QgsProcessingParameterBoolean(
+            self.LOAD_OUTPUTS,
+            'Open output layers',
+            False
+        ))
+        for p in params:
+            p.setFlags(p.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+            self.addParameter(p)
+
+        self.addParameter(QgsProcessingParameterFolderDestination(
+            self.OUTPUT,
+            'Output folder'
+        ))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.REPORT,
+            'Batch report',
+            'CSV files (*.csv);;JSON files (*.json)',
+            optional=True,
+            createByDefault=False
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        algName = self.displayName()
+        layers = self.parameterAsLayerList(parameters, self.INPUT, context)  # [QgsVectorLayer,..]
+        outputFolder = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+        reportPath = self.parameterAsFileOutput(parameters, self.REPORT, context) \
+            or os.path.join(outputFolder, 'batch_report.csv')
+        fieldNames = [
+            name.strip() for name in self.parameterAsString(parameters, self.FIELDS, context).split(',')
+            if name.strip()
+        ]
+        options = {
+            'tolerance': self.parameterAsDouble(parameters, self.TOLERANCE, context),
+            'isBranches': self.parameterAsBoolean(parameters, self.IS_BRANCHES, context),
+            'isMergedBranches': self.parameterAsBoolean(parameters, self.MERGE_BRANCHES, context),
+            'isChained': self.parameterAsBoolean(parameters, self.CHAIN_SECTIONS, context),
+            'fieldNames': fieldNames,
+        }
+        processes = self.parameterAsInt(parameters, self.PROCESSES, context)
+        isLoaded = self.parameterAsBoolean(parameters, self.LOAD_OUTPUTS, context)
+        os.makedirs(outputFolder, exist_ok=True)
+
+        feedback.pushInfo(f"[{algName}] Preparing {len(layers)} network layers...")
+        tasks = []
+        featureCounts = dict()  # {path: featureCount}
+        names = set()
+        tempFolder = None
+        for layer in layers:
+            if feedback.isCanceled():
+                feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+                return {}
+            name = self.getUniqueName(layer.name(), names)
+            try:
+                if layer.providerType() == 'ogr' and not layer.subsetString():
+                    path = layer.source()
+                else:
+                    if tempFolder is None:
+                        tempFolder = QgsProcessingUtils.tempFolder()
+                    path = self.writeTemporaryFile(layer, os.path.join(tempFolder, f'{name}.gpkg'), context)
+            except:
+                feedback.pushInfo(f"[{algName}] The layer {layer.name()} can not be read and is skipped.")
+                continue
+            if path in featureCounts:
+                continue  # The same layer is selected twice
+            featureCounts[path] = max(layer.featureCount(), 1)
+            tasks.append((path, outputFolder, dict(
+                options, outputPath=os.path.join(outputFolder, f'{name}_bottlenecks.gpkg'), name=layer.name()
+            )))
+        if not tasks:
+            feedback.pushInfo(f"[{algName}] There are no network layers to analyse.")
+            return {}
+
+        feedback.pushInfo(f"[{algName}] Analysing {len(tasks)} network layers concurrently...")
+        totalCount = sum(featureCounts.values())
+        progress = {'count': 0}
+
+        def onRecord(record):
+            progress['count'] += featureCounts[record['file']]
+            feedback.setProgress(progress['count'] / totalCount * 100)
+            info = f"[{algName}] {record['name']}: {record['status']}"
+            if record['status'] == 'ok':
+                info += f", {record['bottlenecks']} bottlenecks of {record['edges']} edges, " \
+                        f"{record['seconds']:.2f} s"
+            elif record['message']:
+                info += f", {record['message']}"
+            feedback.pushInfo(info)
+
+        try:
+            records = runTasks(tasks, processes, onRecord, feedback.isCanceled)
+        except:
+            feedback.pushInfo(f"[{algName}] The batch is stopped. "
+                              "Some internal error occurs. "
+                              "Please, let me know the issues "
+                              "(https://github.com/loopgraph/countroutes/issues).")
+            return {}
+        stats = [records[task[0]] for task in tasks if task[0] in records]
+        if feedback.isCanceled():
+            feedback.pushInfo(f"[{algName}] The Algorithm was canceled, "
+                              f"{len(stats)} of {len(tasks)} layers were analysed")
+        results = {self.OUTPUT: outputFolder}
+        try:
+            writeStats(stats, reportPath)
+            results[self.REPORT] = reportPath
+        except:
+            feedback.pushInfo(f"[{algName}] The batch report can not be written to {reportPath}.")
+        statusCounts = dict()  # {status: count}
+        for record in stats:
+            statusCounts[record['status']] = statusCounts.get(record['status'], 0) + 1
+            if isLoaded and record['status'] == 'ok':
+                context.addLayerToLoadOnCompletion(record['output'], QgsProcessingContext.LayerDetails(
+                    f"{record['name']} bottlenecks", context.project(), self.OUTPUT
+                ))
+        feedback.pushInfo(f"[{algName}] The batch was finished: " +
+                          ', '.join(f'{count} {status}' for status, count in sorted(statusCounts.items())))
+        return results
+
+    @staticmethod
+    def getUniqueName(name, names):
+        """
+        Getting a file name of the layer, not repeated among names of the batch
+        :param names: Names already taken (the result is added)
+        :return: str
+        """
+        baseName = re.sub(r'[^\w\-]+', '_', name).strip('_') or 'network'
+        name = baseName
+        index = 1
+        while name.lower() in names:
+            index += 1
+            name = f'{baseName}_{index}'
+        names.add(name.lower())
+        return name
+
+    @staticmethod
+    def writeTemporaryFile(layer, path, context):
+        """
+        Saving the layer which is not a file (or filtered) to a GeoPackage read by worker processes
+        :return: The path of the GeoPackage
+        """
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = 'GPKG'
+        options.layerName = os.path.splitext(os.path.basename(path))[0]
+        result = QgsVectorFileWriter.writeAsVectorFormatV3(layer, path, context.transformContext(), options)
+        if result[0] != QgsVectorFileWriter.NoError:
+            raise OSError(result[1])
+        return path
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    BottleneckIndex.py
+    -------------------
+
+    Date                 : September 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from threading import RLock
+from .CountRoutesGraph import GridSnapper
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+class BottleneckIndex:
+    """
+    Persistent index of bottlenecks (bridges) of a network which is updated by inserted and deleted features.
+    Vertices are grouped in blocks (2-edge-connected parts), blocks are connected by bridges into a forest.
+    An inserted edge between blocks merges the blocks of the forest path between its ends or becomes a bridge.
+    A deleted bridge is just removed. A deleted edge inside a block leaves the block 2-edge-connected
+    if its ends are still joined by two edge-disjoint routes, which is tested by two augmenting searches
+    spreading from one end and stopped at the other (a few steps around the loops of a street network).
+    Only if the deletion leaves new bridges the bridge search re-runs on that block, so such a deletion
+    costs O(block) and is slow inside the giant block of a city network.
+    Duplicate edges with the same end vertices are counted once like in the edge pair dictionary.
+    The index does not depend on QGIS, features are given as polylines [[(x, y),..],..].
+    """
+
+    def __init__(self, tolerance):
+        self.snapper = GridSnapper(tolerance)
+        self.features = dict()  # {featureId: [(vId, vId),..]}
+        self.edgeCounts = dict()  # {(lowVId, highVId): the number of segments}
+        self.adjacency = dict()  # {vId: set([vId,..])}
+        self.labels = dict()  # {vId: blockId}
+        self.members = dict()  # {blockId: set([vId,..])}
+        self.blockBridges = dict()  # {blockId: set([(lowVId, highVId),..])}
+        self.bridges = set()
+        self.nextBlockId = 0
+        self.lock = RLock()
+
+    def addFeature(self, featureId, polylines):
+        """
+        Inserting edges of a feature, the previous geometry of the same feature is replaced
+        """
+        with self.lock:
+            self.deleteFeature(featureId)
+            segments = []
+            for points in polylines:
+                lastVId = -1
+                for x, y in points:
+                    vId = self.snapper.vertexId(x, y)
+                    if lastVId >= 0 and vId != lastVId:
+                        segments.append((min(lastVId, vId), max(lastVId, vId)))
+                    lastVId = vId
+            self.features[featureId] = segments
+            for key in segments:
+                self.insertEdge(key)
+
+    def deleteFeature(self, featureId):
+        with self.lock:
+            for key in self.features.pop(featureId, ()):
+                self.deleteEdge(key)
+
+    def commitFeatures(self, featurePolylines):
+        """
+        Replacing features with temporary (negative) ids by committed features.
+        Committed edges are inserted before temporary ones are deleted, so the blocks are not split.
+        :param featurePolylines: {featureId: polylines} of committed features
+        """
+        with self.lock:
+            temporaryIds = [featureId for featureId in self.features if featureId < 0]
+            for featureId, polylines in featurePolylines.items():
+                self.addFeature(featureId, polylines)
+            for featureId in temporaryIds:
+                self.deleteFeature(featureId)
+
+    def addBlock(self, vertices):
+        blockId = self.nextBlockId
+        self.nextBlockId += 1
+        self.members[blockId] = vertices
+        self.blockBridges[blockId] = set()
+        for vId in vertices:
+            self.labels[vId] = blockId
+        return blockId
+
+    def getOtherBlock(self, blockId, key):
+        """
+        :return: The block at the other end of the bridge
+        """
+        if self.labels[key[0]] == blockId:
+            return self.labels[key[1]]
+        return self.labels[key[0]]
+
+    def insertEdge(self, key):
+        count = self.edgeCounts.get(key, 0)
+        self.edgeCounts[key] = count + 1
+        if count:
+            return
+        for vId in key:
+            self.adjacency.setdefault(vId, set()).add(key[0] + key[1] - vId)
+            if vId not in self.labels:
+                self.addBlock({vId})
+        fromBlockId = self.labels[key[0]]
+        toBlockId = self.labels[key[1]]
+        if fromBlockId == toBlockId:
+            return
+        path = self.getBlockPath(fromBlockId, toBlockId)
+        if path is None:  # The edge connects separate parts of the network
+            self.bridges.add(key)
+            self.blockBridges[fromBlockId].add(key)
+            self.blockBridges[toBlockId].add(key)
+        else:  # The edge closes a circle through the bridges of the path
+            self.mergeBlocks(path)
+
+    def getBlockPath(self, fromBlockId, toBlockId):
+        """
+        Searching the path of bridges between two blocks in the forest from both ends at once
+        :return: ([blockId,..], [bridge,..]) or None if the blocks are in separate parts of the network
+        """
+        parents = [{fromBlockId: None}, {toBlockId: None}]  # {blockId: (prevBlockId, bridge)}
+        fronts = [[fromBlockId], [toBlockId]]
+        while fronts[0] and fronts[1]:
+            side = 0 if len(fronts[0]) <= len(fronts[1]) else 1
+            nextFront = []
+            for blockId in fronts[side]:
+                for key in self.blockBridges[blockId]:
+                    nextBlockId = self.getOtherBlock(blockId, key)
+                    if nextBlockId in parents[side]:
+                        continue
+                    parents[side][nextBlockId] = (blockId, key)
+                    if nextBlockId in parents[1 - side]:
+                        return self.joinBlockPath(parents, nextBlockId)
+                    nextFront.append(nextBlockId)
+            fronts[side] = nextFront
+        return None
+
+    @staticmethod
+    def joinBlockPath(parents, meetBlockId):
+        blocks = [meetBlockId]
+        bridges = []
+        for side in (0, 1):
+            blockId = meetBlockId
+            while parents[side][blockId] is not None:
+                blockId, key = parents[side][blockId]
+                blocks.append(blockId)
+                bridges.append(key)
+        return blocks, bridges
+
+    def mergeBlocks(self, path):
+        blocks, bridges = path
+        targetId = max(blocks, key=lambda blockId: len(self.members[blockId]))
+        for blockId in blocks:
+            if blockId == targetId:
+                continue
+            for vId in self.members[blockId]:
+                self.labels[vId] = targetId
+            self.members[targetId].update(self.members.pop(blockId))
+            self.blockBridges[targetId].update(self.blockBridges.pop(blockId))
+        for key in bridges:
+            self.bridges.discard(key)
+            self.blockBridges[targetId].discard(key)
+
+    def deleteEdge(self, key):
+        self.edgeCounts[key] -= 1
+        if self.edgeCounts[key]:
+            return
+        del self.edgeCounts[key]
+        self.adjacency[key[0]].discard(key[1])
+        self.adjacency[key[1]].discard(key[0])
+        if key in self.bridges:
+            self.bridges.remove(key)
+            self.blockBridges[self.labels[key[0]]].discard(key)
+            self.blockBridges[self.labels[key[1]]].discard(key)
+        elif not self.isTwoEdgeConnected(key[0], key[1]):
+            self.splitBlock(self.labels[key[0]])
+
+    def isTwoEdgeConnected(self, fromVId, toVId):
+        """
+        Testing two edge-disjoint routes between vertices of the same block by augmenting paths
+        of the unit flow (the second search may pass an edge of the first route backwards only).
+        Routes between vertices of a block do not leave it, so the searches stay in the block.
+        :return: True if no edge separates the vertices
+        """
+        blockId = self.labels[fromVId]
+        flowSteps = set()  # {(vId, nextVId),..} of the first route
+        for _ in range(2):
+            parents = {fromVId: None}
+            front = [fromVId]
+            while front and toVId not in parents:
+                nextFront = []
+                for vId in front:
+                    for nextId in self.adjacency[vId]:
+                        if nextId in parents or (vId, nextId) in flowSteps or self.labels[nextId] != blockId:
+                            continue
+                        parents[nextId] = vId
+                        nextFront.append(nextId)
+                front = nextFront
+            if toVId not in parents:
+                return False
+            vId = toVId
+            while parents[vId] is not None:
+                prevId = parents[vId]
+                if (vId, prevId) in flowSteps:
+                    flowSteps.discard((vId, prevId))  # The routes cancel on the edge
+                else:
+                    flowSteps.add((prevId, vId))
+                vId = prevId
+        return True
+
+    def splitBlock(self, blockId):
+        """
+        Re-running the iterative low-link bridge search on the vertices of a single block
+        and splitting the block by the bridges found
+        """
+        members = self.members[blockId]
+        adjacency = self.adjacency
+        order = dict()
+        low = dict()
+        newBridges = set()
+        counter = 0
+        for rootId in members:
+            if rootId in order:
+                continue
+            counter += 1
+            order[rootId] = low[rootId] = counter
+            vStack = [rootId]
+            iterStack = [iter(adjacency[rootId])]
+            while vStack:
+                vId = vStack[-1]
+                nextId = next(iterStack[-1], None)
+                if nextId is not None:
+                    if nextId not in members or (len(vStack) > 1 and nextId == vStack[-2]):
+                        continue
+                    if nextId in order:
+                        low[vId] = min(low[vId], order[nextId])
+                    else:
+                        counter += 1
+                        order[nextId] = low[nextId] = counter
+                        vStack.append(nextId)
+                        iterStack.append(iter(adjacency[nextId]))
+                else:
+                    vStack.pop()
+                    iterStack.pop()
+                    if vStack:
+                        parentId = vStack[-1]
+                        low[parentId] = min(low[parentId], low[vId])
+                        if low[vId] > order[parentId]:
+                            newBridges.add((min(parentId, vId), max(parentId, vId)))
+        if not newBridges:
+            return
+        # Splitting the block into parts connected without new bridges
+        parts = []
+        passed = set()
+        for rootId in members:
+            if rootId in passed:
+                continue
+            part = {rootId}
+            stack = [rootId]
+            while stack:
+                vId = stack.pop()
+                for nextId in adjacency[vId]:
+                    if (nextId in members and nextId not in part and
+                            (min(vId, nextId), max(vId, nextId)) not in newBridges):
+                        part.add(nextId)
+                        stack.append(nextId)
+            passed.update(part)
+            parts.append(part)
+        parts.sort(key=len, reverse=True)
+        self.members[blockId] = parts[0]
+        oldBridges = self.blockBridges[blockId]
+        self.blockBridges[blockId] = set()
+        for part in parts[1:]:
+            self.addBlock(part)
+        self.bridges.update(newBridges)
+        for key in oldBridges.union(newBridges):
+            self.blockBridges[self.labels[key[0]]].add(key)
+            self.blockBridges[self.labels[key[1]]].add(key)
+
+    def getBranches(self):
+        """
+        Peeling blind pass branches from leaves of the block forest, a branch vertex forms a single block
+        :return: A set of bridges in blind pass branches
+        """
+        degrees = {blockId: len(keys) for blockId, keys in self.blockBridges.items()}
+        leaves = [
+            blockId for blockId, degree in degrees.items()
+            if degree == 1 and len(self.members[blockId]) == 1
+        ]
+        branches = set()
+        while leaves:
+            blockId = leaves.pop()
+            for key in self.blockBridges[blockId]:
+                if key in branches:
+                    continue
+                branches.add(key)
+                degrees[blockId] -= 1
+                nextBlockId = self.getOtherBlock(blockId, key)
+                degrees[nextBlockId] -= 1
+                if degrees[nextBlockId] == 1 and len(self.members[nextBlockId]) == 1:
+                    leaves.append(nextBlockId)
+        return branches
+
+    def getBottlenecksPoints(self, isBranches=False):
+        """
+        :return: A list of bottleneck end points [[(x, y), (x, y)],..]
+        """
+        with self.lock:
+            edges = self.bridges
+            if not isBranches:
+                edges = edges.difference(self.getBranches())
+            xs = self.snapper.xs
+            ys = self.snapper.ys
+            return [[(xs[fromVId], ys[fromVId]), (xs[toVId], ys[toVId])] for fromVId, toVId in edges]
@@ -19,20 +19,29 @@
 """
 
 from qgis.PyQt.QtGui import QIcon
+from qgis.PyQt.QtCore import QVariant
 from processing.algs.qgis.QgisAlgorithm import QgisAlgorithm
 from qgis.core import (
     QgsWkbTypes,
     QgsFeature,
     QgsFeatureSink,
+    QgsFeatureRequest,
     QgsGeometry,
+    QgsPointXY,
+    QgsField,
     QgsFields,
     QgsProcessing,
     QgsProcessingParameterNumber,
     QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterField,
     QgsProcessingParameterFeatureSource,
     QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFileDestination,
     QgsProcessingParameterDefinition,
 )
+from .CountRoutesProfiler import StageProfiler
+from .CountRoutesCache import isFilteredDefinition
 
 __license__ = 'GPL version 3'
 __copyright__ = 'Copyright 2024, Pavel Minin'
@@ -43,12 +52,40 @@ class BottleneckQuestAlgorithm(QgisAlgorithm):
 
     INPUT = 'INPUT'
     IS_BRANCHES = 'IS_BRANCHES'
+    MERGE_BRANCHES = 'MERGE_BRANCHES'
+    CHAIN_SECTIONS = 'CHAIN_SECTIONS'
+    FIELDS = 'FIELDS'
     TOLERANCE = 'TOLERANCE'
+    IS_NODED = 'IS_NODED'
+    ENGINE = 'ENGINE'
+    BUILDER = 'BUILDER'
+    PROCESSES = 'PROCESSES'
+    TILE_SIZE = 'TILE_SIZE'
+    USE_CACHE = 'USE_CACHE'
     # USE_SHORTEST = 'USE_SHORTEST'
     OUTPUT = 'OUTPUT'
+    CUTS = 'CUTS'
+    CUT_VERTICES = 'CUT_VERTICES'
+    FACES = 'FACES'
+    REPORT = 'REPORT'
+
+    ENGINE_CIRCLES = 0
+    ENGINE_BRIDGES = 1
+    ENGINE_INDEX = 2
+    ENGINE_TILES = 3
+    BUILDER_QGIS = 0
+    BUILDER_NATIVE = 1
+    batchSize = 10000  # The number of features added to the sink at once
 
     def __init__(self):
         super().__init__()
+        self.engines = [
+            'Circle model',
+            'Bridge search (linear time)',
+            'Incremental index (edited layers)',
+            'Tiled bridge search (networks larger than memory)'
+        ]
+        self.builders = ['QGIS graph builder', 'Native grid builder']
 
     def icon(self):
         if self.provider():
@@ -74,14 +111,73 @@ class BottleneckQuestAlgorithm(QgisAlgorithm):
                "It is important that <b>the topology of the vector layer should be clean</b>. " \
                "It means that all features should be lines or multi-lines. " \
                "All crossing lines meet at the intersections. " \
-               "Otherwise, it occurs some fatal errors or mistakes.)</li>" \
+               "Otherwise, it occurs some fatal errors or mistakes, " \
+               "unless lines are split at crossings by the noding option.)</li>" \
                "<li><u>A choice to find blind pass branches also</u> " \
                "(Such branches consist of several sections),</li>" \
+               "<li><u>A choice to merge branch sections</u> into single polylines between branch junctions " \
+               "(for the circle model and the bridge search),</li>" \
                "<li><u>A topology tolerance in meters</u> (this is a minimal distance " \
-               "between layer endpoints that will be combined in a single graph vertex).</li></ul>" \
+               "between layer endpoints that will be combined in a single graph vertex),</li>" \
+               "<li><u>A choice to split lines at crossings</u> (noding: a vertex is added where lines cross " \
+               "or an end of a line lies on another line within the tolerance, so dirty data is processed " \
+               "in one pass; the number of fixes is shown in the log. Note that crossings without junctions, " \
+               "such as overpasses, are joined too),</li>" \
+               "<li><u>A search engine</u> (the circle model walks all circles of the network, " \
+               "the bridge search finds the same sections in linear time and suits large networks, " \
+               "the incremental index is kept for the session and follows edits of the layer, " \
+               "so repeated runs on an edited layer update bottlenecks without rebuilding the graph " \
+               "(a deleted section inside a loop is checked by a local search for a second route, " \
+               "only a deletion leaving new bottlenecks searches its whole 2-edge-connected part again, " \
+               "which is slow inside the large part of a city network), " \
+               "the tiled bridge search streams the layer into tiles on disk " \
+               "and suits networks larger than memory. Note that the tiled bridge search merges endpoints " \
+               "lying in the same cell of a grid of the tolerance size only, the index merges them " \
+               "by the native grid builder and other engines by the chosen graph builder, " \
+               "so on an unclean topology with endpoints about the tolerance apart " \
+               "the engines can find different bottlenecks),</li>" \
+               "<li><u>A graph builder</u> (the native grid builder streams layer geometries " \
+               "and merges endpoints within the tolerance faster and with less memory " \
+               "than the QGIS graph builder),</li>" \
+               "<li><u>A number of worker processes</u> (parallelism is per connected part: the bridge search " \
+               "processes separate parts of the network, such as islands or regions, in parallel, " \
+               "while each part is searched by a single process, so a network of one connected part " \
+               "is searched in the current process; 0 or 1 runs in a single process),</li>" \
+               "<li><u>A choice to chain consecutive sections</u> of the same source feature " \
+               "into a single line (for the circle model and the bridge search),</li>" \
+               "<li><u>Source fields</u> copied to the output from the source feature of each line " \
+               "(source features are known with both graph builders, " \
+               "but not with the incremental index and the tiled bridge search),</li>" \
+               "<li><u>A tile size</u> in layer units for the tiled bridge search (the tiled search merges endpoints " \
+               "falling in the same cell of a grid of the tolerance size, so unlike other engines, " \
+               "points closer than the tolerance on both sides of a cell edge are not merged),</li>" \
+               "<li><u>A choice to cache the graph on disk</u> (the built graph and its models are kept " \
+               "in the QGIS profile folder, so repeated runs on an unchanged layer skip building them).</li></ul>" \
+               "Graphs of recently used layers are also kept in memory until the layer data is changed, " \
+               "so repeated runs with other parameters do not rebuild the graph.<br>" \
                "<b>Output:</b><br>" \
                "The output of the algorithm is a created layer with line sections qualifying bottleneck properties " \
-               "<b>if such bottlenecks exist.</b>"
+               "<b>if such bottlenecks exist.</b> The length of each line is kept in the 'length' field, " \
+               "the id of its source feature is kept in the 'source_id' field. " \
+               "The part of the network cut off by closing a bottleneck (the smaller side) is described " \
+               "by its number of vertices 'cut_vertices', edges 'cut_edges' and the length 'cut_length' " \
+               "(for the circle model and the bridge search), so bottlenecks are ranked by their impact. " \
+               "Parts are summed once in the tree of bottlenecks for all of them in linear time.<br>" \
+               "The optional two-edge cut layer keeps pairs of sections whose joint closure splits the network " \
+               "(such as parallel carriageways or two bridges over one river, for the circle model " \
+               "and the bridge search). Closing any two sections with the same 'cut_group' id splits the network, " \
+               "a cut group is found in linear time by random labels of network circles.<br>" \
+               "The optional cut vertex layer keeps junctions whose closure splits the network " \
+               "with the number of split parts in the 'parts' field. They are found in the same pass " \
+               "as bottlenecks by the bridge search (junctions inside blind pass branches are kept " \
+               "if branches are searched).<br>" \
+               "The optional network loop layer keeps polygons of loops bounded by the network " \
+               "(like city blocks) with their 'area', 'perimeter' and the number of bounding 'edges'. " \
+               "Loops are traced one by one from the order model of the network, " \
+               "so they are written without holding all of them in memory.<br>" \
+               "The wall time, CPU time of the stage thread, memory growth and element counts of each stage " \
+               "(measured from the stage start) and the peak memory of the whole process are shown in the log " \
+               "and can be saved to an optional JSON or CSV stage report."
 
     def initAlgorithm(self, config=None):
         self.addParameter(QgsProcessingParameterFeatureSource(
@@ -95,12 +191,63 @@ class BottleneckQuestAlgorithm(QgisAlgorithm):
             'Find branches with leaves',
             False
         ))
+        params.append(QgsProcessingParameterBoolean(
+            self.MERGE_BRANCHES,
+            'Merge branch sections into polylines',
+            False
+        ))
+        params.append(QgsProcessingParameterBoolean(
+            self.CHAIN_SECTIONS,
+            'Chain consecutive sections of the same feature',
+            True
+        ))
+        params.append(QgsProcessingParameterField(
+            self.FIELDS,
+            'Source fields to copy',
+            parentLayerParameterName=self.INPUT,
+            allowMultiple=True,
+            optional=True
+        ))
         params.append(QgsProcessingParameterNumber(
             self.TOLERANCE,
             'Topology tolerance',
             QgsProcessingParameterNumber.Double,
             0.01, False, 0, 100
         ))
+        params.append(QgsProcessingParameterBoolean(
+            self.IS_NODED,
+            'Split lines at crossings (noding)',
+            False
+        ))
+        params.append(QgsProcessingParameterEnum(
+            self.ENGINE,
+            'Search engine',
+            self.engines,
+            defaultValue=self.ENGINE_CIRCLES
+        ))
+        params.append(QgsProcessingParameterEnum(
+            self.BUILDER,
+            'Graph builder',
+            self.builders,
+            defaultValue=self.BUILDER_QGIS
+        ))
+        params.append(QgsProcessingParameterNumber(
+            self.PROCESSES,
+            'Worker processes (per connected part of the network)',
+            QgsProcessingParameterNumber.Integer,
+            0, False, 0, 256
+        ))
+        params.append(QgsProcessingParameterNumber(
+            self.TILE_SIZE,
+            'Tile size',
+            QgsProcessingParameterNumber.Double,
+            10000, False, 0.001
+        ))
+        params.append(QgsProcessingParameterBoolean(
+            self.USE_CACHE,
+            'Cache the graph on disk',
+            False
+        ))
         for p in params:
             p.setFlags(p.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
             self.addParameter(p)
@@ -110,28 +257,197 @@ class BottleneckQuestAlgorithm(QgisAlgorithm):
             'Bottleneck Quest',
             QgsProcessing.TypeVectorPolygon
         ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.CUTS,
+            'Two-edge cuts',
+            QgsProcessing.TypeVectorLine,
+            optional=True,
+            createByDefault=False
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.CUT_VERTICES,
+            'Cut vertices',
+            QgsProcessing.TypeVectorPoint,
+            optional=True,
+            createByDefault=False
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.FACES,
+            'Network loops',
+            QgsProcessing.TypeVectorPolygon,
+            optional=True,
+            createByDefault=False
+        ))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.REPORT,
+            'Stage report',
+            'JSON files (*.json);;CSV files (*.csv)',
+            optional=True,
+            createByDefault=False
+        ))
 
     def processAlgorithm(self, parameters, context, feedback):
+        algName = self.displayName()
+        profiler = StageProfiler(feedback, algName)
+        results = self.runPipeline(parameters, context, feedback, profiler)
+        reportPath = self.parameterAsFileOutput(parameters, self.REPORT, context)
+        if reportPath:
+            try:
+                profiler.writeReport(reportPath)
+                results[self.REPORT] = reportPath
+            except:
+                feedback.pushInfo(f"[{algName}] The stage report can not be written to {reportPath}.")
+        return results
+
+    def runPipeline(self, parameters, context, feedback, profiler):
         algName = self.displayName()
         results = {}
         feedback.pushInfo(f"[{algName}] The Algorithm started.")
         feedback.pushInfo(f'[{algName}] Initializing Variables.')
         network = self.parameterAsSource(parameters, self.INPUT, context)  # QgsProcessingFeatureSource
         isBranches = self.parameterAsBoolean(parameters, self.IS_BRANCHES, context)  # boolean
+        isMergedBranches = self.parameterAsBoolean(parameters, self.MERGE_BRANCHES, context)  # boolean
+        isChained = self.parameterAsBoolean(parameters, self.CHAIN_SECTIONS, context)  # boolean
+        fieldNames = self.parameterAsFields(parameters, self.FIELDS, context)  # [fieldName,..]
         tolerance = self.parameterAsDouble(parameters, self.TOLERANCE, context)  # float
+        isNoded = self.parameterAsBoolean(parameters, self.IS_NODED, context)  # boolean
+        engine = self.parameterAsEnum(parameters, self.ENGINE, context)  # int
+        builder = self.parameterAsEnum(parameters, self.BUILDER, context)  # int
+        processes = self.parameterAsInt(parameters, self.PROCESSES, context)  # int
+        tileSize = self.parameterAsDouble(parameters, self.TILE_SIZE, context)  # float
+        useCache = self.parameterAsBoolean(parameters, self.USE_CACHE, context)  # boolean
+        isCuts = parameters.get(self.CUTS) is not None  # The optional output of 2-edge cuts is set
+        isCutVertices = parameters.get(self.CUT_VERTICES) is not None  # The optional output of cut vertices is set
+        isFaces = parameters.get(self.FACES) is not None  # The optional output of network loops is set
         # isLongerEdges = self.parameterAsBoolean(parameters, self.IS_BRANCHES, context)  # boolean
         crs = network.sourceCrs()
         if feedback.isCanceled():
             feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
             return results
         feedback.setProgress(5)
-        feedback.pushInfo(f"[{algName}] Building the graph model...")
-        try:
-            graph = self.provider().methods.composingGraph(network, crs, tolerance)
-        except:
-            feedback.pushInfo(f"[{algName}] The graph model can not be built. "
-                              "Please, test if the selected vector layer is suited to parameters.")
+        if (isCuts or isCutVertices or isFaces) and engine in (self.ENGINE_INDEX, self.ENGINE_TILES):
+            feedback.pushInfo(f"[{algName}] Two-edge cuts, cut vertices and network loops are found "
+                              "by the circle model and the bridge search only.")
+        if fieldNames and engine in (self.ENGINE_INDEX, self.ENGINE_TILES):
+            feedback.pushInfo(f"[{algName}] Source fields are copied "
+                              "by the circle model and the bridge search only.")
+        if isNoded and engine in (self.ENGINE_INDEX, self.ENGINE_TILES):
+            feedback.pushInfo(f"[{algName}] Lines are split at crossings "
+                              "by the circle model and the bridge search only.")
+        if engine == self.ENGINE_INDEX:
+            layer = self.getCacheableLayer(parameters, context)  # QgsVectorLayer or None
+            if layer is None:
+                feedback.pushInfo(f"[{algName}] The incremental index needs all features of a vector layer "
+                                  "(not only selected, limited or filtered features). "
+                                  "The bridge search is used instead.")
+                engine = self.ENGINE_BRIDGES
+            else:
+                feedback.pushInfo(f"[{algName}] Getting bottlenecks from the incremental index...")
+                try:
+                    with profiler.stage('Incremental index') as counts:
+                        index = self.provider().getBottleneckIndex(layer, tolerance)
+                        bottlenecks = [
+                            [QgsPointXY(x, y) for x, y in endPoints]
+                            for endPoints in index.getBottlenecksPoints(isBranches)
+                        ]
+                        counts['bottlenecks'] = len(bottlenecks)
+                except:
+                    feedback.pushInfo(f"[{algName}] Getting bottlenecks is stopped. Some internal error occurs. "
+                                      "Please, let me know the issues "
+                                      "(https://github.com/loopgraph/countroutes/issues).")
+                    return results
+                feedback.setProgress(90)
+                results = self.writeBottlenecks(bottlenecks, parameters, context, feedback, crs, profiler)
+                feedback.setProgress(100)
+                return results
+        if engine == self.ENGINE_TILES:
+            feedback.pushInfo(f"[{algName}] Searching bridges tile by tile...")
+            try:
+                with profiler.stage('Tiled bridge search') as counts:
+                    bottlenecks = self.provider().methods.getTiledBottlenecksPoints(
+                        network,
+                        tileSize,
+                        tolerance,
+                        feedback,
+                        80,
+                        isBranches
+                    )
+                    counts['bottlenecks'] = len(bottlenecks)
+            except:
+                feedback.pushInfo(f"[{algName}] Getting bottlenecks is stopped. Some internal error occurs. "
+                                  "Please, let me know the issues "
+                                  "(https://github.com/loopgraph/countroutes/issues).")
+                return results
+            if feedback.isCanceled():
+                feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+                return results
+            feedback.setProgress(90)
+            results = self.writeBottlenecks(bottlenecks, parameters, context, feedback, crs, profiler)
+            feedback.setProgress(100)
             return results
+        layer = self.getCacheableLayer(parameters, context)  # QgsVectorLayer or None
+        graphBuilder = f'{builder}-noded' if isNoded else builder  # The builder of cached graphs
+        graph = None
+        if layer is not None:
+            graph = self.provider().getSessionGraph(layer, tolerance, graphBuilder)
+            if graph is not None:
+                feedback.pushInfo(f"[{algName}] The graph model was taken from the session cache.")
+        cacheKey = None
+        if graph is None and useCache:
+            try:
+                with profiler.stage('Disk cache'):
+                    cacheKey = self.provider().methods.getGraphCacheKey(layer, tolerance, graphBuilder)
+                    if cacheKey is not None:
+                        graph = self.provider().getGraphCache().load(cacheKey)
+                if cacheKey is None:
+                    feedback.pushInfo(f"[{algName}] The layer can not be cached (a memory, edited or filtered layer).")
+                elif graph is not None:
+                    feedback.pushInfo(f"[{algName}] The graph model was loaded from the disk cache.")
+            except:
+                feedback.pushInfo(f"[{algName}] The graph cache is not available.")
+                cacheKey = None
+        if graph is not None:
+            cachedStages = set(graph.composed)
+        else:
+            cachedStages = set()
+            featurePolylines = None
+            if isNoded:
+                feedback.pushInfo(f"[{algName}] Splitting lines at crossings...")
+                try:
+                    with profiler.stage('Noding') as counts:
+                        featurePolylines, fixCount = self.provider().methods.getNodedPolylines(
+                            network, tolerance, feedback, 5
+                        )
+                        counts['junctions'] = fixCount
+                except:
+                    feedback.pushInfo(f"[{algName}] Splitting lines is stopped. Some internal error occurs. "
+                                      "Please, let me know the issues "
+                                      "(https://github.com/loopgraph/countroutes/issues).")
+                    return results
+                if feedback.isCanceled():
+                    feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+                    return results
+                feedback.pushInfo(f"[{algName}] {fixCount} unnoded crossings and junctions were fixed.")
+            feedback.pushInfo(f"[{algName}] Building the graph model...")
+            try:
+                with profiler.stage('Graph model') as counts:
+                    if builder == self.BUILDER_NATIVE:
+                        graph = self.provider().methods.composingNativeGraph(
+                            network, tolerance, feedback, 0 if isNoded else 5, featurePolylines
+                        )
+                    elif isNoded:
+                        graph = self.provider().methods.composingGraph(
+                            self.provider().methods.getPolylineLayer(featurePolylines, crs), crs, tolerance, feedback,
+                            0
+                        )
+                    else:
+                        graph = self.provider().methods.composingGraph(network, crs, tolerance, feedback)
+                    counts['vertices'] = graph.vertexCount()
+                    counts['halfEdges'] = graph.edgeCount()
+            except:
+                feedback.pushInfo(f"[{algName}] The graph model can not be built. "
+                                  "Please, test if the selected vector layer is suited to parameters.")
+                return results
         if feedback.isCanceled():
             feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
             return results
@@ -140,105 +456,465 @@ class BottleneckQuestAlgorithm(QgisAlgorithm):
             feedback.pushInfo(f"[{algName}] The graph was built.")
             feedback.pushInfo(f"[{algName}] The number of graph edges = {graph.edgeCount()}, "
                               f"vertices = {graph.vertexCount()}.")
+            deltas = self.getStageDeltas(graph, engine, isCuts, isCutVertices)
             feedback.pushInfo(f"[{algName}] Finding duplicate edges...")
-            edgePairs = self.provider().methods.getEdgePairDict(graph, feedback)
+            with profiler.stage('Edge pairs') as counts:
+                edgePairs = self.provider().methods.getEdgePairDict(graph, feedback, deltas['pairs'])
+                counts['edgePairs'] = len(edgePairs) // 2
             if feedback.isCanceled():
                 feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
                 return results
             feedback.pushInfo(f"[{algName}] The edge pair dictionary was built.")
-            feedback.setProgress(20)
-            feedback.pushInfo(f"[{algName}] Building the order model...")
-            try:
-                orderModel = self.provider().methods.composingOrderModelFromGraph(
-                    graph,
-                    edgePairs,
-                    feedback,
-                    10
-                )
-            except:
-                feedback.pushInfo(f"[{algName}] The order model can not be built. "
-                                  "Some internal error occurs. Please, let me know the issues "
-                                  "(https://github.com/loopgraph/countroutes/issues).")
-                return results
+            cutVertices = dict() if isCutVertices else None  # {vertexId: the number of parts}
+            if engine == self.ENGINE_BRIDGES:
+                feedback.pushInfo(f"[{algName}] Searching bridges of the graph...")
+                try:
+                    with profiler.stage('Bridge search') as counts:
+                        edges = self.provider().methods.getBridgeEdges(
+                            graph,
+                            edgePairs,
+                            feedback,
+                            deltas['bridges'],
+                            processes,
+                            cutVertices
+                        )
+                        counts['bridges'] = len(edges)
+                        if cutVertices is not None:
+                            counts['cutVertices'] = len(cutVertices)
+                except:
+                    feedback.pushInfo(f"[{algName}] Getting bottlenecks is stopped. Some internal error occurs. "
+                                      "Please, let me know the issues "
+                                      "(https://github.com/loopgraph/countroutes/issues).")
+                    return results
+            else:
+                feedback.pushInfo(f"[{algName}] Building the order model...")
+                try:
+                    with profiler.stage('Order model'):
+                        orderModel = self.provider().methods.composingOrderModelFromGraph(
+                            graph,
+                            edgePairs,
+                            feedback,
+                            deltas['order']
+                        )
+                except:
+                    feedback.pushInfo(f"[{algName}] The order model can not be built. "
+                                      "Some internal error occurs. Please, let me know the issues "
+                                      "(https://github.com/loopgraph/countroutes/issues).")
+                    return results
+                if feedback.isCanceled():
+                    feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+                    return results
+                feedback.pushInfo(f"[{algName}] The order model was built.")
+                feedback.pushInfo(f"[{algName}] Building the circle model...")
+                try:
+                    with profiler.stage('Circle model') as counts:
+                        faceCount, componentCount = self.provider().methods.composingFaceModel(
+                            graph,
+                            edgePairs,
+                            feedback,
+                            deltas['circles']
+                        )
+                        counts['faces'] = faceCount
+                        counts['components'] = componentCount
+                except:
+                    feedback.pushInfo(f"[{algName}] The circle model can not be built. "
+                                      "Some internal error occurs. Please, let me know the issues "
+                                      "(https://github.com/loopgraph/countroutes/issues).")
+                    return results
+                if feedback.isCanceled():
+                    feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+                    return results
+                feedback.pushInfo(f"[{algName}] The circle model was built. "
+                                  f"{componentCount} separated parts of the graph was found.")
+                feedback.pushInfo(f"[{algName}] Getting spatial data from the circle model...")
+                try:
+                    with profiler.stage('Bottlenecks') as counts:
+                        edges = self.provider().methods.getBottleneckEdges(
+                            graph,
+                            edgePairs,
+                            graph.faces if faceCount else None,
+                            feedback,
+                            deltas['bottlenecks']
+                        )
+                        counts['bridges'] = len(edges)
+                    if cutVertices is not None:
+                        with profiler.stage('Cut vertices') as counts:
+                            # The circle model has no low links, so cut vertices are found by the bridge search
+                            self.provider().methods.getBridgeEdges(
+                                graph, edgePairs, feedback, deltas['cutVertices'], processes, cutVertices
+                            )
+                            counts['cutVertices'] = len(cutVertices)
+                except:
+                    feedback.pushInfo(f"[{algName}] Getting bottlenecks is stopped. Some internal error occurs. "
+                                      "Please, let me know the issues "
+                                      "(https://github.com/loopgraph/countroutes/issues).")
+                    return results
             if feedback.isCanceled():
                 feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
                 return results
-            feedback.pushInfo(f"[{algName}] The order model was built.")
-            feedback.setProgress(30)
-            feedback.pushInfo(f"[{algName}] Building the circle model...")
             try:
-                circlesList = self.provider().methods.composingCircleModel(
-                    graph,
-                    orderModel,
-                    edgePairs,
-                    feedback,
-                    40
-                )
+                with profiler.stage('Bottleneck chains') as counts:
+                    chains = self.provider().methods.getBottleneckChains(
+                        graph,
+                        edgePairs,
+                        edges,
+                        isBranches,
+                        isMergedBranches,
+                        isChained,
+                        feedback,
+                        deltas['chains']
+                    )
+                    bottlenecks = [self.provider().methods.getChainPointsXY(graph, chain) for chain in chains]
+                    featureIds = [graph.featureIds[chain[0]] for chain in chains]
+                    counts['bottlenecks'] = len(bottlenecks)
             except:
-                feedback.pushInfo(f"[{algName}] The circle model can not be built. "
-                                  "Some internal error occurs. Please, let me know the issues "
+                feedback.pushInfo(f"[{algName}] Getting bottlenecks is stopped. Some internal error occurs. "
+                                  "Please, let me know the issues "
                                   "(https://github.com/loopgraph/countroutes/issues).")
                 return results
+            impacts = None
+            if chains and not feedback.isCanceled():
+                feedback.pushInfo(f"[{algName}] Summing parts of the network cut off by bottlenecks...")
+                try:
+                    with profiler.stage('Bottleneck impact') as counts:
+                        impacts = self.provider().methods.getChainImpacts(
+                            graph, edges, chains, feedback, deltas['impacts']
+                        )
+                        counts['bottlenecks'] = len(impacts)
+                except:
+                    feedback.pushInfo(f"[{algName}] Summing cut off parts is stopped. Some internal error occurs. "
+                                      "Please, let me know the issues "
+                                      "(https://github.com/loopgraph/countroutes/issues).")
+                    impacts = None
+            cutGroups = None
+            if isCuts:
+                feedback.pushInfo(f"[{algName}] Searching two-edge cuts of the graph...")
+                try:
+                    with profiler.stage('Two-edge cuts') as counts:
+                        cutGroups = self.provider().methods.getTwoEdgeCuts(
+                            graph, edgePairs, feedback, deltas['cuts']
+                        )
+                        counts['groups'] = len(cutGroups)
+                        counts['sections'] = sum(len(chains) for chains in cutGroups)
+                except:
+                    feedback.pushInfo(f"[{algName}] Searching two-edge cuts is stopped. Some internal error occurs. "
+                                      "Please, let me know the issues "
+                                      "(https://github.com/loopgraph/countroutes/issues).")
             if feedback.isCanceled():
                 feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
                 return results
-            feedback.pushInfo(f"[{algName}] The circle model was built. "
-                              f"{len(circlesList)} separated parts of the graph was found.")
-            feedback.setProgress(70)
-            feedback.pushInfo(f"[{algName}] Getting spatial data from the circle model...")
+            if cacheKey is not None and graph.composed != cachedStages:
+                if self.provider().getGraphCache().save(cacheKey, graph):
+                    feedback.pushInfo(f"[{algName}] The graph model was saved to the cache.")
+            if layer is not None:
+                self.provider().putSessionGraph(layer, tolerance, graphBuilder, graph)
+            feedback.setProgress(90)
+            results = self.writeBottlenecks(
+                bottlenecks, parameters, context, feedback, crs, profiler, featureIds, network, fieldNames, impacts
+            )
+            if cutGroups is not None and not feedback.isCanceled():
+                results.update(self.writeCuts(cutGroups, graph, parameters, context, feedback, crs, profiler))
+            if cutVertices is not None and not feedback.isCanceled():
+                if not isBranches:
+                    cutVertices = self.provider().methods.getCoreCutVertices(graph, edgePairs, cutVertices)
+                results.update(self.writeCutVertices(
+                    cutVertices, graph, parameters, context, feedback, crs, profiler
+                ))
+            if isFaces and not feedback.isCanceled():
+                results.update(self.writeFaces(graph, parameters, context, feedback, crs, profiler))
+        else:
+            feedback.pushInfo(f"[{algName}] The graph model has no edges. "
+                              "The result layer was not built.")
+        feedback.setProgress(100)
+        return results
+
+    def getStageDeltas(self, graph, engine, isCuts=False, isCutVertices=False):
+        """
+        Splitting the progress from 10 to 90 between graph stages in proportion to their work:
+        the number of half-edges and vertices each stage passes (stages restored from the cache pass nothing)
+        :return: {stageKey: feedbackDelta}
+        """
+        eCount = graph.edgeCount()
+        vCount = graph.vertexCount()
+        works = {
+            'pairs': eCount if 'twins' in graph.composed else 3 * eCount,
+            'chains': 2 * eCount + vCount,
+            'impacts': eCount + vCount,
+            'cuts': 2 * vCount + 3 * eCount if isCuts else 0,
+        }
+        if engine == self.ENGINE_BRIDGES:
+            works['bridges'] = eCount + vCount
+        else:
+            works['order'] = 0 if 'successors' in graph.composed else 2 * eCount
+            works['circles'] = (0 if 'faces' in graph.composed else eCount) + vCount
+            works['bottlenecks'] = eCount
+            works['cutVertices'] = eCount + vCount if isCutVertices else 0
+        total = sum(works.values())
+        return {key: 80 * work / total for key, work in works.items()}
+
+    def getCacheableLayer(self, parameters, context):
+        """
+        Getting the input layer if all its features are used (not only selected, limited or filtered features)
+        :return: QgsVectorLayer or None
+        """
+        if isFilteredDefinition(parameters.get(self.INPUT)):
+            return None
+        return self.parameterAsVectorLayer(parameters, self.INPUT, context)
+
+    def writeBottlenecks(self, bottlenecks, parameters, context, feedback, crs, profiler,
+                         featureIds=None, network=None, fieldNames=(), impacts=None):
+        """
+        Writing bottleneck sections to the output sink in batches of features
+        :param bottlenecks: [[QgsPointXY, QgsPointXY],..] or polylines of chains
+        :param profiler: StageProfiler
+        :param featureIds: Source feature ids of bottlenecks (-1 if unknown) or None
+        :param network: QgsProcessingFeatureSource with source fields
+        :param fieldNames: Names of source fields copied to the output
+        :param impacts: [[vertexCount, edgeCount, length],..] of cut off parts of bottlenecks or None
+        :return: results
+        """
+        algName = self.displayName()
+        results = {}
+        if bottlenecks:
+            feedback.pushInfo(f"[{algName}] Bottlenecks coordinates were built.")
+            fields = QgsFields()
+            fields.append(QgsField('length', QVariant.Double))
+            fields.append(QgsField('source_id', QVariant.LongLong))
+            if impacts is not None:
+                fields.append(QgsField('cut_vertices', QVariant.LongLong))
+                fields.append(QgsField('cut_edges', QVariant.LongLong))
+                fields.append(QgsField('cut_length', QVariant.Double))
+            sourceAttributes = dict()  # {featureId: [value,..]}
+            if featureIds is not None and network is not None and fieldNames:
+                for name in fieldNames:
+                    field = QgsField(network.fields().field(name))
+                    if fields.indexOf(name) >= 0:
+                        field.setName(f'source_{name}')
+                    fields.append(field)
+                request = QgsFeatureRequest() \
+                    .setFilterFids([featureId for featureId in set(featureIds) if featureId >= 0]) \
+                    .setSubsetOfAttributes(fieldNames, network.fields()) \
+                    .setFlags(QgsFeatureRequest.NoGeometry)
+                for feature in network.getFeatures(request):
+                    sourceAttributes[feature.id()] = [feature[name] for name in fieldNames]
+            emptyAttributes = [None] * len(fieldNames)
+            (sink, dest_id) = self.parameterAsSink(
+                parameters,
+                self.OUTPUT,
+                context,
+                fields,
+                QgsWkbTypes.LineString,
+                crs
+            )
+            feedback.pushInfo(f"[{algName}] Creating the output layer...")
             try:
-                bottlenecks = self.provider().methods.getBottlenecksPoints(
-                    graph,
-                    edgePairs,
-                    circlesList,
-                    feedback,
-                    20,
-                    isBranches
-                )
+                with profiler.stage('Output layer') as counts:
+                    batch = []
+                    for idx, endPoints in enumerate(bottlenecks):
+                        if not idx & 0xFF:  # Features are counted by a mask, the feedback is polled once per 256
+                            if feedback.isCanceled():
+                                break
+                            feedback.setProgress(90 + 10 * idx / len(bottlenecks))
+                        featureId = featureIds[idx] if featureIds is not None else -1
+                        feat = QgsFeature(fields)
+                        geometry = QgsGeometry.fromPolylineXY(endPoints)
+                        feat.setGeometry(geometry)
+                        feat.setAttributes(
+                            [geometry.length(), featureId if featureId >= 0 else None] +
+                            (impacts[idx] if impacts is not None else []) +
+                            sourceAttributes.get(featureId, emptyAttributes)
+                        )
+                        batch.append(feat)
+                        if len(batch) >= self.batchSize:
+                            sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                            batch = []
+                    if batch:
+                        sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                    counts['features'] = len(bottlenecks)
             except:
-                feedback.pushInfo(f"[{algName}] Getting bottlenecks is stopped. Some internal error occurs. "
+                feedback.pushInfo(f"[{algName}] Building the result layer is stopped. "
+                                  "Some internal error occurs. "
                                   "Please, let me know the issues "
                                   "(https://github.com/loopgraph/countroutes/issues).")
                 return results
             if feedback.isCanceled():
                 feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
                 return results
-            feedback.setProgress(90)
-            if bottlenecks:
-                feedback.pushInfo(f"[{algName}] Bottlenecks coordinates were built.")
-                (sink, dest_id) = self.parameterAsSink(
-                    parameters,
-                    self.OUTPUT,
-                    context,
-                    QgsFields(),
-                    QgsWkbTypes.LineString,
-                    crs
-                )
-                feedback.pushInfo(f"[{algName}] Creating the output layer...")
-                try:
-                    for endPoints in bottlenecks:
-                        if feedback.isCanceled():
-                            break
-                        feat = QgsFeature()
-                        feat.setGeometry(QgsGeometry.fromPolylineXY(endPoints))
-                        sink.addFeature(feat, QgsFeatureSink.FastInsert)
-                except:
-                    feedback.pushInfo(f"[{algName}] Building the result layer is stopped. "
-                                      "Some internal error occurs. "
-                                      "Please, let me know the issues "
-                                      "(https://github.com/loopgraph/countroutes/issues).")
-                    return results
-                if feedback.isCanceled():
-                    feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
-                    return results
-                feedback.pushInfo(f"[{algName}] The output layer was created.")
-                results[self.OUTPUT] = dest_id
-            else:
-                feedback.pushInfo(f"[{algName}] There are no bottlenecks in the network layer. "
-                                  "The result layer was not built.")
+            feedback.pushInfo(f"[{algName}] The output layer was created.")
+            results[self.OUTPUT] = dest_id
         else:
-            feedback.pushInfo(f"[{algName}] The graph model has no edges. "
+            feedback.pushInfo(f"[{algName}] There are no bottlenecks in the network layer. "
                               "The result layer was not built.")
-        feedback.setProgress(100)
         return results
 
+    def writeCuts(self, cutGroups, graph, parameters, context, feedback, crs, profiler):
+        """
+        Writing sections of 2-edge cuts to the optional output sink with the id of their cut group
+        :param cutGroups: Cut groups of sections [[[edgeId,..],..],..]
+        :param graph: CountRoutesGraph
+        :param profiler: StageProfiler
+        :return: results
+        """
+        algName = self.displayName()
+        results = {}
+        if not cutGroups:
+            feedback.pushInfo(f"[{algName}] There are no two-edge cuts in the network layer. "
+                              "The cut layer was not built.")
+            return results
+        fields = QgsFields()
+        fields.append(QgsField('cut_group', QVariant.LongLong))
+        fields.append(QgsField('length', QVariant.Double))
+        fields.append(QgsField('source_id', QVariant.LongLong))
+        (sink, dest_id) = self.parameterAsSink(
+            parameters,
+            self.CUTS,
+            context,
+            fields,
+            QgsWkbTypes.LineString,
+            crs
+        )
+        feedback.pushInfo(f"[{algName}] Creating the cut layer...")
+        try:
+            with profiler.stage('Cut layer') as counts:
+                batch = []
+                for groupId, chains in enumerate(cutGroups):
+                    if not groupId & 0xFF and feedback.isCanceled():
+                        break
+                    for chain in chains:
+                        featureId = graph.featureIds[chain[0]]
+                        feat = QgsFeature(fields)
+                        geometry = QgsGeometry.fromPolylineXY(self.provider().methods.getChainPointsXY(graph, chain))
+                        feat.setGeometry(geometry)
+                        feat.setAttributes([groupId, geometry.length(), featureId if featureId >= 0 else None])
+                        batch.append(feat)
+                    if len(batch) >= self.batchSize:
+                        sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                        batch = []
+                if batch:
+                    sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                counts['features'] = sum(len(chains) for chains in cutGroups)
+        except:
+            feedback.pushInfo(f"[{algName}] Building the cut layer is stopped. "
+                              "Some internal error occurs. "
+                              "Please, let me know the issues "
+                              "(https://github.com/loopgraph/countroutes/issues).")
+            return results
+        if feedback.isCanceled():
+            feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+            return results
+        feedback.pushInfo(f"[{algName}] The cut layer was created.")
+        results[self.CUTS] = dest_id
+        return results
+
+    def writeCutVertices(self, cutVertices, graph, parameters, context, feedback, crs, profiler):
+        """
+        Writing cut vertices to the optional point output sink
+        :param cutVertices: {vertexId: the number of parts its closure splits the connected part into}
+        :param graph: CountRoutesGraph
+        :param profiler: StageProfiler
+        :return: results
+        """
+        algName = self.displayName()
+        results = {}
+        if not cutVertices:
+            feedback.pushInfo(f"[{algName}] There are no cut vertices in the network layer. "
+                              "The cut vertex layer was not built.")
+            return results
+        fields = QgsFields()
+        fields.append(QgsField('parts', QVariant.Int))
+        fields.append(QgsField('degree', QVariant.Int))
+        (sink, dest_id) = self.parameterAsSink(
+            parameters,
+            self.CUT_VERTICES,
+            context,
+            fields,
+            QgsWkbTypes.Point,
+            crs
+        )
+        feedback.pushInfo(f"[{algName}] Creating the cut vertex layer...")
+        twins = graph.twins
+        try:
+            with profiler.stage('Cut vertex layer') as counts:
+                batch = []
+                for idx, vId in enumerate(sorted(cutVertices)):
+                    if not idx & 0xFF and feedback.isCanceled():
+                        break
+                    feat = QgsFeature(fields)
+                    feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(*graph.point(vId))))
+                    feat.setAttributes([
+                        cutVertices[vId],
+                        sum(1 for eId in graph.outgoingEdges(vId) if twins[eId] >= 0)
+                    ])
+                    batch.append(feat)
+                    if len(batch) >= self.batchSize:
+                        sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                        batch = []
+                if batch:
+                    sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                counts['features'] = len(cutVertices)
+        except:
+            feedback.pushInfo(f"[{algName}] Building the cut vertex layer is stopped. "
+                              "Some internal error occurs. "
+                              "Please, let me know the issues "
+                              "(https://github.com/loopgraph/countroutes/issues).")
+            return results
+        if feedback.isCanceled():
+            feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+            return results
+        feedback.pushInfo(f"[{algName}] The cut vertex layer was created.")
+        results[self.CUT_VERTICES] = dest_id
+        return results
+
+    def writeFaces(self, graph, parameters, context, feedback, crs, profiler):
+        """
+        Streaming polygons of bounded faces (network loops) to the optional output sink
+        :param graph: CountRoutesGraph with composed twins
+        :param profiler: StageProfiler
+        :return: results
+        """
+        algName = self.displayName()
+        results = {}
+        fields = QgsFields()
+        fields.append(QgsField('area', QVariant.Double))
+        fields.append(QgsField('perimeter', QVariant.Double))
+        fields.append(QgsField('edges', QVariant.Int))
+        (sink, dest_id) = self.parameterAsSink(
+            parameters,
+            self.FACES,
+            context,
+            fields,
+            QgsWkbTypes.Polygon,
+            crs
+        )
+        feedback.pushInfo(f"[{algName}] Creating the network loop layer...")
+        try:
+            with profiler.stage('Network loops') as counts:
+                batch = []
+                faceCount = 0
+                for ring, area, perimeter, edgeCount in self.provider().methods.getFacePolygons(graph, feedback, 0):
+                    feat = QgsFeature(fields)
+                    geometry = QgsGeometry.fromPolygonXY([ring])
+                    if edgeCount < len(ring) - 1:  # Edges inside the loop are walked there and back
+                        geometry = geometry.makeValid()
+                    feat.setGeometry(geometry)
+                    feat.setAttributes([area, perimeter, edgeCount])
+                    batch.append(feat)
+                    faceCount += 1
+                    if len(batch) >= self.batchSize:
+                        sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                        batch = []
+                if batch and not feedback.isCanceled():
+                    sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                counts['features'] = faceCount
+        except:
+            feedback.pushInfo(f"[{algName}] Building the network loop layer is stopped. "
+                              "Some internal error occurs. "
+                              "Please, let me know the issues "
+                              "(https://github.com/loopgraph/countroutes/issues).")
+            return results
+        if feedback.isCanceled():
+            feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+            return results
+        feedback.pushInfo(f"[{algName}] The network loop layer was created. {faceCount} loops were found.")
+        results[self.FACES] = dest_id
+        return results
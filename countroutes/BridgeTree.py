@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    BridgeTree.py
+    -------------------
+
+    Date                 : September 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from array import array
+from .CountRoutesGraph import VertexLocator, FeedbackMeter
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+class BridgeTree:
+    """
+    The bridge tree of the network: 2-edge-connected parts of the graph are condensed into nodes,
+    bridges join the nodes into a forest (a tree for each connected part).
+    Every route between two vertices passes exactly the bridges of the tree path between their nodes,
+    so bottlenecks of a route are found by the lowest common ancestor of the nodes.
+    The ancestor is found by binary lifting in O(log n), the bridges of the path are collected in their number.
+    Sums of the network in subtrees give both sides of every bridge in linear time.
+    The tree does not depend on QGIS.
+    """
+
+    def __init__(self, graph, bridges, isLifted=True, feedback=None, feedbackDelta=0):
+        """
+        :param graph: CountRoutesGraph with composed twins
+        :param bridges: Bridge edge ids (one edge id of each pair of opposite edges)
+        :param isLifted: Ancestor tables of route queries are built (side sums do not need them)
+        :param feedback: QgsProcessingFeedback or None, the tree is empty if the run is canceled
+        """
+        self.graph = graph
+        self.locator = None
+        self.sums = None
+        # Vertices are labeled, then nodes (not more than vertices) are rooted
+        meter = FeedbackMeter(feedback, feedbackDelta, 2 * graph.vertexCount())
+        mask = meter.mask
+        self.nodes = self.composingNodes(graph, bridges, meter)  # {vertexId: nodeId}
+        if meter.isCanceled:
+            self.nodes = array('q')  # The tree is left empty
+            bridges = ()
+        nodeCount = max(self.nodes) + 1 if len(self.nodes) else 0
+        adjacency = [[] for _ in range(nodeCount)]  # {nodeId: [(nextNodeId, edgeId),..]}
+        for eId in bridges:
+            fromNodeId = self.nodes[graph.fromVertices[eId]]
+            toNodeId = self.nodes[graph.toVertices[eId]]
+            adjacency[fromNodeId].append((toNodeId, eId))
+            adjacency[toNodeId].append((fromNodeId, graph.twins[eId]))
+        # Rooting trees of the forest by the breadth-first search
+        self.roots = array('q', [-1]) * nodeCount  # {nodeId: rootNodeId}
+        self.depths = array('q', [0]) * nodeCount
+        self.parentEdges = array('q', [-1]) * nodeCount  # {nodeId: edgeId from the parent to the node}
+        self.order = array('q')  # Node ids in breadth-first order of trees
+        parents = array('q', range(nodeCount))
+        rootedCount = 0
+        for rootId in range(nodeCount):
+            if self.roots[rootId] >= 0:
+                continue
+            self.roots[rootId] = rootId
+            front = [rootId]
+            while front:
+                self.order.extend(front)
+                nextFront = []
+                for nodeId in front:
+                    rootedCount += 1
+                    if not rootedCount & mask and meter.step(graph.vertexCount() + rootedCount):
+                        self.nodes = array('q')
+                        self.roots = self.depths = self.parentEdges = self.order = array('q')
+                        self.ancestors = [array('q')]
+                        return
+                    for nextNodeId, eId in adjacency[nodeId]:
+                        if self.roots[nextNodeId] < 0:
+                            self.roots[nextNodeId] = rootId
+                            self.depths[nextNodeId] = self.depths[nodeId] + 1
+                            self.parentEdges[nextNodeId] = eId
+                            parents[nextNodeId] = nodeId
+                            nextFront.append(nextNodeId)
+                front = nextFront
+        # Binary lifting: ancestors[k][nodeId] is the ancestor 2^k levels up (a root is its own ancestor)
+        self.ancestors = [parents]
+        for _ in range(1, max(1, max(self.depths, default=0).bit_length()) if isLifted else 1):
+            lastAncestors = self.ancestors[-1]
+            self.ancestors.append(array('q', (lastAncestors[ancestorId] for ancestorId in lastAncestors)))
+        meter.finish()
+
+    @staticmethod
+    def composingNodes(graph, bridges, meter=None):
+        """
+        Labeling 2-edge-connected parts of the graph by the search over paired edges except bridges
+        :param meter: FeedbackMeter of labeled vertices or None
+        :return: The node array {vertexId: nodeId} (incomplete if the run is canceled)
+        """
+        if meter is None:
+            meter = FeedbackMeter()
+        mask = meter.mask
+        twins = graph.twins
+        toVertices = graph.toVertices
+        isBridge = bytearray(graph.edgeCount())
+        for eId in bridges:
+            isBridge[eId] = isBridge[twins[eId]] = 1
+        nodes = array('q', [-1]) * graph.vertexCount()
+        nodeId = 0
+        labeledCount = 0
+        for rootId in range(graph.vertexCount()):
+            if nodes[rootId] >= 0:
+                continue
+            nodes[rootId] = nodeId
+            stack = [rootId]
+            while stack:
+                vId = stack.pop()
+                labeledCount += 1
+                if not labeledCount & mask and meter.step(labeledCount):
+                    return nodes
+                for eId in graph.outgoingEdges(vId):
+                    nextId = toVertices[eId]
+                    if twins[eId] >= 0 and not isBridge[eId] and nodes[nextId] < 0:
+                        nodes[nextId] = nodeId
+                        stack.append(nextId)
+            nodeId += 1
+        return nodes
+
+    def composingSubtreeSums(self, feedback=None, feedbackDelta=0):
+        """
+        Summing vertices, edges and the length of the network in subtrees of the bridge tree:
+        vertices and inner edges of 2-edge-connected parts are summed in their nodes,
+        then each node is added with the bridge above it to its parent in reverse breadth-first order,
+        so a node is summed after all its children. Sums of a root cover its whole part of the network.
+        :return: Sums {nodeId: [vertexCount, edgeCount, length]} (incomplete and not kept if the run is canceled)
+        """
+        graph = self.graph
+        xs = graph.xs
+        ys = graph.ys
+        fromVertices = graph.fromVertices
+        toVertices = graph.toVertices
+        twins = graph.twins
+        nodes = self.nodes
+        parents = self.ancestors[0]
+        sums = [[0, 0, 0.0] for _ in range(len(self.roots))]
+        vertexCount = graph.vertexCount()
+        edgeCount = graph.edgeCount()
+        meter = FeedbackMeter(feedback, feedbackDelta, vertexCount + edgeCount + len(self.order))
+        mask = meter.mask
+        for vId in range(vertexCount):
+            if not vId & mask and meter.step(vId):
+                return sums
+            sums[nodes[vId]][0] += 1
+        for eId in range(edgeCount):
+            if not eId & mask and meter.step(vertexCount + eId):
+                return sums
+            if twins[eId] > eId:  # Each pair of opposite edges once, duplicate edges have no twins
+                fromVId = fromVertices[eId]
+                toVId = toVertices[eId]
+                fromNodeId = nodes[fromVId]
+                if fromNodeId == nodes[toVId]:
+                    nodeSums = sums[fromNodeId]
+                    nodeSums[1] += 1
+                    nodeSums[2] += ((xs[toVId] - xs[fromVId]) ** 2 + (ys[toVId] - ys[fromVId]) ** 2) ** 0.5
+        for idx, nodeId in enumerate(reversed(self.order)):
+            if not idx & mask and meter.step(vertexCount + edgeCount + idx):
+                return sums
+            parentId = parents[nodeId]
+            if parentId != nodeId:
+                nodeSums = sums[nodeId]
+                parentSums = sums[parentId]
+                parentSums[0] += nodeSums[0]
+                parentSums[1] += nodeSums[1] + 1
+                parentSums[2] += nodeSums[2] + self.getEdgeLength(self.parentEdges[nodeId])
+        meter.finish()
+        self.sums = sums
+        return sums
+
+    def getEdgeLength(self, eId):
+        graph = self.graph
+        fromVId = graph.fromVertices[eId]
+        toVId = graph.toVertices[eId]
+        return ((graph.xs[toVId] - graph.xs[fromVId]) ** 2 + (graph.ys[toVId] - graph.ys[fromVId]) ** 2) ** 0.5
+
+    def getSideSums(self, eId):
+        """
+        Getting the part of the network cut off on the end side of a bridge when the bridge is closed
+        :param eId: A bridge edge id in any direction
+        :return: [vertexCount, edgeCount, length] of the part containing the end vertex of the edge
+        """
+        if self.sums is None:
+            self.composingSubtreeSums()
+        toNodeId = self.nodes[self.graph.toVertices[eId]]
+        parentEdgeId = self.parentEdges[toNodeId]
+        if parentEdgeId >= 0 and (parentEdgeId == eId or parentEdgeId == self.graph.twins[eId]):
+            return list(self.sums[toNodeId])  # The end is below the bridge
+        fromSums = self.sums[self.nodes[self.graph.fromVertices[eId]]]
+        rootSums = self.sums[self.roots[toNodeId]]
+        return [
+            rootSums[0] - fromSums[0],
+            rootSums[1] - fromSums[1] - 1,
+            max(rootSums[2] - fromSums[2] - self.getEdgeLength(eId), 0.0)
+        ]
+
+    def locateVertex(self, x, y, maxDistance=0):
+        """
+        Snapping a point to the nearest vertex of the graph
+        :param maxDistance: The search radius, 0 means no limit
+        :return: The vertex id or -1 if there is no vertex within the radius
+        """
+        if self.locator is None:
+            self.locator = VertexLocator(self.graph.xs, self.graph.ys)
+        return self.locator.nearestVertex(x, y, maxDistance)
+
+    def getAncestor(self, nodeId, levels):
+        k = 0
+        while levels:
+            if levels & 1:
+                nodeId = self.ancestors[k][nodeId]
+            levels >>= 1
+            k += 1
+        return nodeId
+
+    def getCommonAncestor(self, fromNodeId, toNodeId):
+        """
+        :return: The lowest common ancestor of two nodes of the same tree
+        """
+        depths = self.depths
+        if depths[fromNodeId] > depths[toNodeId]:
+            fromNodeId = self.getAncestor(fromNodeId, depths[fromNodeId] - depths[toNodeId])
+        else:
+            toNodeId = self.getAncestor(toNodeId, depths[toNodeId] - depths[fromNodeId])
+        if fromNodeId == toNodeId:
+            return fromNodeId
+        for ancestors in reversed(self.ancestors):
+            if ancestors[fromNodeId] != ancestors[toNodeId]:
+                fromNodeId = ancestors[fromNodeId]
+                toNodeId = ancestors[toNodeId]
+        return self.ancestors[0][fromNodeId]
+
+    def queryBridges(self, fromVId, toVId):
+        """
+        Getting bottlenecks of every route between two vertices
+        :return: Bridge edge ids in order along the route from the first vertex (directed towards the second one)
+            or None if the vertices are in separate parts of the network
+        """
+        fromNodeId = self.nodes[fromVId]
+        toNodeId = self.nodes[toVId]
+        if self.roots[fromNodeId] != self.roots[toNodeId]:
+            return None
+        commonNodeId = self.getCommonAncestor(fromNodeId, toNodeId)
+        twins = self.graph.twins
+        parents = self.ancestors[0]
+        upEdges = []
+        while fromNodeId != commonNodeId:
+            upEdges.append(twins[self.parentEdges[fromNodeId]])
+            fromNodeId = parents[fromNodeId]
+        downEdges = []
+        while toNodeId != commonNodeId:
+            downEdges.append(self.parentEdges[toNodeId])
+            toNodeId = parents[toNodeId]
+        downEdges.reverse()
+        return upEdges + downEdges
+
+    def queryBatch(self, vertexPairs):
+        """
+        :param vertexPairs: An iterable of (fromVertexId, toVertexId)
+        :return: A generator of bridge lists (or None) in order of the pairs
+        """
+        for fromVId, toVId in vertexPairs:
+            yield self.queryBridges(fromVId, toVId)
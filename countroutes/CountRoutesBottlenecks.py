@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    CountRoutesBottlenecks.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Passes over bottlenecks of the compact graph (blind pass branches, chains, cuts and their impacts).
+They do not depend on QGIS, CountRoutesMethods keeps them as its static methods.
+"""
+
+from array import array
+from .CountRoutesGraph import FeedbackMeter
+from .BridgeTree import BridgeTree
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def getGraphBranches(graph, edgePairs, feedback=None, feedbackDelta=0):
+    """
+    Peeling blind pass branches from leaves by the degree array of paired edges (like the 2-core decomposition).
+    Each vertex is peeled once and its edges are scanned once, so the pass takes O(V + E).
+    :param graph: CountRoutesGraph with composed twins
+    :return: (A set of branch edge ids with their opposite edges, a set of peeled vertex ids),
+        incomplete if the run is canceled
+    """
+    twins = graph.twins
+    toVertices = graph.toVertices
+    outOffsets = graph.outOffsets
+    outEdges = graph.outEdges
+    degrees = array('q', [0]) * graph.vertexCount()
+    meter = FeedbackMeter(feedback, feedbackDelta, graph.edgeCount() + graph.vertexCount())
+    mask = meter.mask
+    for eId in range(graph.edgeCount()):
+        if not eId & mask and meter.step(eId):
+            return set(), set()
+        if twins[eId] >= 0:
+            degrees[graph.fromVertices[eId]] += 1
+    isPeeled = bytearray(graph.edgeCount())
+    leaves = [vId for vId in range(graph.vertexCount()) if degrees[vId] == 1]
+    branches = set()
+    branchVertices = set()
+    while leaves:
+        vId = leaves.pop()
+        if degrees[vId] != 1:  # The last edge of a tree is peeled from its other end
+            continue
+        if not len(branchVertices) & mask and meter.step(graph.edgeCount() + len(branchVertices)):
+            return branches, branchVertices
+        branchVertices.add(vId)
+        for idx in range(outOffsets[vId], outOffsets[vId + 1]):
+            eId = outEdges[idx]
+            if twins[eId] >= 0 and not isPeeled[eId]:
+                break
+        isPeeled[eId] = isPeeled[twins[eId]] = 1
+        branches.add(eId)
+        branches.add(twins[eId])
+        degrees[vId] -= 1
+        nextVertexId = toVertices[eId]
+        degrees[nextVertexId] -= 1
+        if degrees[nextVertexId] == 1:
+            leaves.append(nextVertexId)
+        elif not degrees[nextVertexId]:  # The last vertex of a separate tree
+            branchVertices.add(nextVertexId)
+    meter.finish()
+    return branches, branchVertices
+
+
+def getCoreCutVertices(graph, edgePairs, cutVertices):
+    """
+    Skipping cut vertices inside blind pass branches (all paired edges of the vertex are branch edges)
+    :param cutVertices: {vertexId: the number of parts}
+    :return: {vertexId: the number of parts} of other cut vertices
+    """
+    branches, branchVertices = getGraphBranches(graph, edgePairs)
+    twins = graph.twins
+    return {
+        vId: partCount for vId, partCount in cutVertices.items()
+        if any(twins[eId] >= 0 and eId not in branches for eId in graph.outgoingEdges(vId))
+    }
+
+
+def getEdgeChains(graph, edges, isSameFeature=False, feedback=None, feedbackDelta=0):
+    """
+    Chaining edges through vertices with exactly two paired edges, both of them in the edge set
+    :param edges: Edge ids, opposite edges are added to the set
+    :param isSameFeature: Chains are split where the source feature of edges changes
+    :return: Directed chains of edge ids [[edgeId,..],..] (incomplete if the run is canceled)
+    """
+    twins = graph.twins
+    featureIds = graph.featureIds
+    outOffsets = graph.outOffsets
+    outEdges = graph.outEdges
+    meter = FeedbackMeter(feedback, feedbackDelta, 2 * graph.edgeCount())
+    mask = meter.mask
+    isMarked = bytearray(graph.edgeCount())
+    for idx, eId in enumerate(edges):
+        if not idx & mask and meter.step(0):
+            return []
+        isMarked[eId] = isMarked[twins[eId]] = 1
+    passed = bytearray(graph.edgeCount())
+
+    def getNextEdge(vId, inEdgeId):
+        """
+        :return: The next edge of the chain after the edge coming to the vertex or -1 if the chain ends
+        """
+        nextId = -1
+        for idx in range(outOffsets[vId], outOffsets[vId + 1]):
+            eId = outEdges[idx]
+            if twins[eId] < 0 or eId == twins[inEdgeId]:
+                continue
+            if nextId >= 0:  # A junction of more than two paired edges
+                return -1
+            nextId = eId
+        if nextId < 0 or not isMarked[nextId] or passed[nextId]:
+            return -1
+        if isSameFeature and featureIds[nextId] != featureIds[inEdgeId]:
+            return -1
+        return nextId
+
+    def getChain(eId):
+        chain = [eId]
+        passed[eId] = passed[twins[eId]] = 1
+        eId = getNextEdge(graph.toVertices[eId], eId)
+        while eId >= 0:
+            chain.append(eId)
+            passed[eId] = passed[twins[eId]] = 1
+            eId = getNextEdge(graph.toVertices[eId], eId)
+        return chain
+
+    chains = []
+    for eId in range(graph.edgeCount()):
+        if not eId & mask and meter.step(eId):
+            return chains
+        # Chains start from edges which do not continue a chain coming to their start vertex
+        if isMarked[eId] and not passed[eId] and getNextEdge(graph.fromVertices[eId], twins[eId]) < 0:
+            chains.append(getChain(eId))
+    for eId in range(graph.edgeCount()):  # Closed chains without start edges
+        if not eId & mask and meter.step(graph.edgeCount() + eId):
+            return chains
+        if isMarked[eId] and not passed[eId]:
+            chains.append(getChain(eId))
+    meter.finish()
+    return chains
+
+
+def getBottleneckChains(graph, edgePairs, edges, isBranches=False, isMergedBranches=False, isChained=False,
+                        feedback=None, feedbackDelta=0):
+    """
+    Getting chains of bottleneck edges: blind pass branches are excluded,
+    kept as separate edges or merged into chains through vertices joining two edges
+    :param edges: Bottleneck edge ids (one edge id of each pair of opposite edges)
+    :param isChained: Consecutive bottleneck edges of the same source feature are merged into chains
+    :return: Directed chains of edge ids [[edgeId,..],..] (incomplete if the run is canceled)
+    """
+    branches = set()
+    if not isBranches or isMergedBranches:
+        branches, branchVertices = getGraphBranches(graph, edgePairs, feedback, feedbackDelta / 3)
+        edges = [eId for eId in edges if eId not in branches]
+    if isChained:
+        chains = getEdgeChains(graph, edges, True, feedback, feedbackDelta / 3)
+    else:
+        chains = [[eId] for eId in edges]
+    if isBranches and isMergedBranches:
+        chains.extend(getEdgeChains(graph, branches, False, feedback, feedbackDelta / 3))
+    return chains
+
+
+def getTwoEdgeCuts(graph, edgePairs, feedback=None, feedbackDelta=0):
+    """
+    Finding 2-edge cuts (pairs of sections whose joint closure splits the network) by cycle space labels.
+    Edges with the same label form a cut group: closing any two sections of a group splits the network.
+    Edges of a chain through vertices joining two edges share a label, so they are merged into sections,
+    groups of a single section (cutting off only the inner vertices of the chain) are skipped.
+    :param graph: CountRoutesGraph
+    :return: Cut groups of sections [[[edgeId,..],..],..] (empty if the run is canceled)
+    """
+    twinsDelta = 0
+    if 'twins' not in graph.composed:
+        twinsDelta = feedbackDelta / 4
+        graph.composingTwins(feedback, twinsDelta)
+    stageDelta = (feedbackDelta - twinsDelta) / 2
+    meter = FeedbackMeter(feedback)  # Polls the cancellation between stages
+    if meter.step(0):
+        return []
+    labels = graph.composingCycleLabels(feedback=feedback, feedbackDelta=stageDelta)
+    if meter.step(0):
+        return []
+    twins = graph.twins
+    mask = meter.mask
+    edges = []
+    for eId in range(graph.edgeCount()):
+        if not eId & mask and meter.step(eId):
+            return []
+        if labels[eId] and twins[eId] > eId:
+            edges.append(eId)
+    chains = getEdgeChains(graph, edges, feedback=feedback, feedbackDelta=stageDelta)
+    groups = dict()  # {label: [[edgeId,..],..]}
+    for idx, chain in enumerate(chains):
+        if not idx & mask and meter.step(idx):
+            return []
+        groups.setdefault(labels[chain[0]], []).append(chain)
+    return sorted(
+        (chains for chains in groups.values() if len(chains) > 1),
+        key=lambda chains: min(min(chain) for chain in chains)
+    )
+
+
+def getChainImpacts(graph, edges, chains, feedback=None, feedbackDelta=0):
+    """
+    Getting the part of the network cut off by each bottleneck chain in linear time by subtree sums
+    of the bridge tree instead of a search per bridge. Closing a chain leaves the part at its start
+    and the part at its end, the smaller part (by vertices, then edges and length) is the impact of the chain.
+    :param edges: Bottleneck edge ids (one edge id of each pair of opposite edges)
+    :param chains: Directed chains of bottleneck edge ids
+    :return: [[vertexCount, edgeCount, length],..] in order of chains (incomplete if the run is canceled)
+    """
+    stageDelta = feedbackDelta / 3
+    tree = BridgeTree(graph, edges, False, feedback, stageDelta)
+    if feedback is not None and feedback.isCanceled():
+        return []
+    tree.composingSubtreeSums(feedback, stageDelta)
+    if feedback is not None and feedback.isCanceled():
+        return []
+    twins = graph.twins
+    meter = FeedbackMeter(feedback, feedbackDelta - 2 * stageDelta, len(chains))
+    mask = meter.mask
+    impacts = []
+    for idx, chain in enumerate(chains):
+        if not idx & mask and meter.step(idx):
+            return impacts
+        impacts.append(min(tree.getSideSums(twins[chain[0]]), tree.getSideSums(chain[-1])))
+    meter.finish()
+    return impacts
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    CountRoutesCache.py
+    -------------------
+
+    Date                 : September 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+from threading import RLock
+from collections import OrderedDict
+from .CountRoutesGraph import CountRoutesGraph
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def isFilteredDefinition(definition):
+    """
+    Testing if a feature source parameter reads a part of the layer: selected features only,
+    a feature limit or a filter expression (of QgsProcessingFeatureSourceDefinition since QGIS 3.32).
+    Graphs and indexes of the whole layer do not suit such a source.
+    :param definition: The parameter value (a layer id, a path, QgsProcessingFeatureSourceDefinition,..)
+    :return: True if the source is filtered
+    """
+    return bool(
+        getattr(definition, 'selectedFeaturesOnly', False) or
+        getattr(definition, 'featureLimit', -1) >= 0 or
+        getattr(definition, 'filterExpression', '')
+    )
+
+
+class GraphCache:
+    """
+    On-disk cache of compact graphs with composed stages (twins, the order model and faces).
+    An entry is a single file named by the hash of its key: a JSON header and aligned raw arrays.
+    Entries are loaded by memory mapping without copying arrays. Keys should include a fingerprint
+    of the source layer, so a changed source gets a new entry. The entry of the old source is not deleted:
+    like any entry, it stays until the least recently used entries are evicted when the total size
+    exceeds the budget.
+    """
+
+    magic = b'CRGRAPH2'
+    suffix = '.crg'
+    baseArrays = (
+        'xs', 'ys', 'fromVertices', 'toVertices', 'featureIds', 'outOffsets', 'outEdges', 'inOffsets', 'inEdges'
+    )
+    stageArrays = {'twins': ('twins',), 'successors': ('successors',), 'faces': ('faces', 'faceStarts')}
+
+    def __init__(self, folder, maxBytes):
+        self.folder = folder
+        self.maxBytes = maxBytes
+        os.makedirs(folder, exist_ok=True)
+
+    def getPath(self, key):
+        return os.path.join(self.folder, hashlib.sha1(key.encode('utf-8')).hexdigest() + self.suffix)
+
+    def load(self, key):
+        """
+        :return: CountRoutesGraph with memory-mapped arrays or None if there is no valid entry
+            (a truncated or corrupted entry is removed)
+        """
+        path = self.getPath(key)
+        if not os.path.isfile(path):
+            return None
+        mapped = None
+        arrays = dict()  # {arrayName: memoryview}
+        try:
+            with open(path, 'rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if mapped[:len(self.magic)] != self.magic:
+                raise ValueError('Not a graph cache entry')
+            headerSize, = struct.unpack_from('<q', mapped, len(self.magic))
+            header = json.loads(mapped[len(self.magic) + 8:len(self.magic) + 8 + headerSize].decode('utf-8'))
+            if header['key'] != key or header['byteorder'] != sys.byteorder:
+                raise ValueError('The entry of another key or byte order')
+            dataStart = len(self.magic) + 8 + headerSize
+            for name, (typecode, offset, length) in header['arrays'].items():
+                start = dataStart + offset
+                end = start + length * struct.calcsize(typecode)
+                if end > len(mapped):
+                    raise ValueError(f'The array {name} is truncated')
+                arrays[name] = memoryview(mapped)[start:end].cast(typecode)
+            graph = CountRoutesGraph.fromArrays(arrays, header['composed'])
+        except (OSError, ValueError, KeyError, TypeError, struct.error):
+            for values in arrays.values():
+                values.release()  # A map with exported views can not be closed
+            if mapped is not None:
+                mapped.close()
+            try:
+                os.remove(path)
+            except OSError:  # E.g. the entry is mapped by a live graph on Windows
+                pass
+            return None
+        graph.mapped = mapped  # Keeping the map open while the graph is alive
+        os.utime(path)  # Marking the entry as recently used
+        return graph
+
+    def save(self, key, graph):
+        """
+        Writing the graph with its composed stages, the entry is replaced atomically
+        :return: True if the entry was written
+        """
+        names = list(self.baseArrays)
+        for stage in sorted(graph.composed):
+            names.extend(self.stageArrays[stage])
+        arrays = dict()  # {arrayName: (typecode, offset from the data start, length)}
+        offset = 0
+        for name in names:
+            values = getattr(graph, name)
+            typecode = values.typecode if hasattr(values, 'typecode') else values.format
+            arrays[name] = (typecode, offset, len(values))
+            offset += (len(values) * struct.calcsize(typecode) + 7) // 8 * 8
+        header = json.dumps({
+            'key': key,
+            'byteorder': sys.byteorder,
+            'composed': sorted(graph.composed),
+            'arrays': arrays,
+        }).encode('utf-8')
+        header += b' ' * (-len(header) % 8)  # Aligning arrays by 8 bytes
+        path = self.getPath(key)
+        tmpPath = path + '.tmp'
+        try:
+            with open(tmpPath, 'wb') as file:
+                file.write(self.magic)
+                file.write(struct.pack('<q', len(header)))
+                file.write(header)
+                for name in names:
+                    data = memoryview(getattr(graph, name)).cast('B')
+                    file.write(data)
+                    file.write(b'\0' * (-len(data) % 8))
+            os.replace(tmpPath, path)
+            self.evict(path)
+        except OSError:  # E.g. the entry is mapped by a live graph on Windows
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            return False
+        return True
+
+    def evict(self, keepPath=None):
+        """
+        Removing the least recently used entries until the cache fits the size budget
+        """
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.folder, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        totalSize = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if totalSize <= self.maxBytes:
+                break
+            if path == keepPath:
+                continue
+            try:
+                os.remove(path)
+                totalSize -= size
+            except OSError:
+                pass
+
+
+class GraphMemoryCache:
+    """
+    In-memory LRU cache of graphs with composed stages for the QGIS session.
+    Keys start with the layer id, so all graphs of a changed layer are dropped at once.
+    Sizes of graph arrays are counted against the budget, the least recently used graphs are dropped first.
+    """
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.graphs = OrderedDict()  # {(layerId, ..): (graph, size)}
+        self.totalBytes = 0
+        self.lock = RLock()
+
+    @staticmethod
+    def getGraphSize(graph):
+        return sum(
+            values.nbytes if isinstance(values, memoryview) else len(values) * values.itemsize
+            for values in vars(graph).values()
+            if hasattr(values, 'itemsize')
+        )
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.graphs:
+                return None
+            self.graphs.move_to_end(key)
+            return self.graphs[key][0]
+
+    def put(self, key, graph):
+        """
+        Storing the graph or updating the size of a stored graph with new composed stages
+        """
+        with self.lock:
+            self.drop(key)
+            size = self.getGraphSize(graph)
+            if size > self.maxBytes:
+                return
+            self.graphs[key] = (graph, size)
+            self.totalBytes += size
+            while self.totalBytes > self.maxBytes:
+                self.drop(next(iter(self.graphs)))
+
+    def drop(self, key):
+        with self.lock:
+            if key in self.graphs:
+                self.totalBytes -= self.graphs.pop(key)[1]
+
+    def dropLayer(self, layerId):
+        with self.lock:
+            for key in [key for key in self.graphs if key[0] == layerId]:
+                self.drop(key)
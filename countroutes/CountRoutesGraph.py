@@ -0,0 +1,671 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    CountRoutesGraph.py
+    -------------------
+
+    Date                 : September 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import random
+from array import array
+from math import atan2
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+class FeedbackMeter:
+    """
+    Cooperative cancellation checkpoints and work-proportional progress of hot loops.
+    Loops test their counter of processed half-edges by the bit mask and call step() once per 16384 of them,
+    so the feedback is polled every few milliseconds at any scale and the cost of a check is amortized
+    to a single bit test per iteration. The progress advances within the stage delta by the processed work.
+        mask = meter.mask
+        for eId in range(edgeCount):
+            if not eId & mask and meter.step(eId):
+                break  # The run is canceled, the caller tests feedback.isCanceled()
+    """
+
+    mask = 0x3FFF
+
+    def __init__(self, feedback=None, feedbackDelta=0, total=0):
+        """
+        :param feedback: QgsProcessingFeedback or None
+        :param feedbackDelta: The progress of the whole loop
+        :param total: The number of work units of the loop
+        """
+        self.feedback = feedback
+        self.feedbackDelta = feedbackDelta if feedback is not None else 0
+        self.total = max(total, 1)
+        self.start = feedback.progress() if self.feedbackDelta else 0
+        self.isCanceled = False
+
+    def step(self, done):
+        """
+        :param done: The number of processed work units
+        :return: True if the run is canceled
+        """
+        if self.feedback is None:
+            return False
+        if self.feedbackDelta:
+            self.feedback.setProgress(self.start + self.feedbackDelta * min(done, self.total) / self.total)
+        self.isCanceled = self.feedback.isCanceled()
+        return self.isCanceled
+
+    def finish(self):
+        """
+        Setting the progress of the whole loop
+        :return: True if the run is canceled
+        """
+        return self.step(self.total)
+
+
+def searchBridges(toVertices, twins, outOffsets, outEdges, roots, order=None, low=None,
+                  feedback=None, feedbackDelta=0, cutVertices=None):
+    """
+    Finding bridges of the undirected graph by the iterative (non-recursive) low-link search.
+    Only paired edges (twin >= 0) are walked. Arrays may be any int sequences, e.g. shared memory views.
+    :param roots: Start vertex ids, the search covers connected parts of the graph containing them
+    :param order: A reusable array of the vertex discovery order (0 means a vertex is not visited yet)
+    :param low: A reusable array of low links
+    :param cutVertices: A dictionary filled with cut vertices (articulation points) by the same low links
+        {vertexId: the number of parts its closure splits the connected part into}
+    :return: A list of bridge edge ids (one edge id of each pair of opposite edges),
+        found bridges so far if the run is canceled
+    """
+    vCount = len(outOffsets) - 1
+    if order is None:
+        order = array('q', [0]) * vCount
+    if low is None:
+        low = array('q', [0]) * vCount
+    bridges = []
+    counter = 0
+    meter = FeedbackMeter(feedback, feedbackDelta, vCount)
+    mask = meter.mask
+    for rootId in roots:
+        if order[rootId]:
+            continue
+        counter += 1
+        order[rootId] = low[rootId] = counter
+        rootChildCount = 0
+        vStack = [rootId]
+        inEdgeStack = [-1]  # Tree edges the vertices of vStack were reached by
+        idxStack = [outOffsets[rootId]]  # Positions of the next edges in the adjacency array
+        while vStack:
+            vId = vStack[-1]
+            idx = idxStack[-1]
+            if idx < outOffsets[vId + 1]:
+                idxStack[-1] = idx + 1
+                if not idx & mask and meter.step(counter):  # Each adjacency position is passed once
+                    return bridges
+                eId = outEdges[idx]
+                if twins[eId] < 0 or (inEdgeStack[-1] >= 0 and eId == twins[inEdgeStack[-1]]):
+                    continue  # A duplicate edge or going back by the same tree edge
+                nextId = toVertices[eId]
+                if order[nextId]:
+                    if order[nextId] < low[vId]:
+                        low[vId] = order[nextId]
+                else:
+                    counter += 1
+                    order[nextId] = low[nextId] = counter
+                    vStack.append(nextId)
+                    inEdgeStack.append(eId)
+                    idxStack.append(outOffsets[nextId])
+            else:
+                vStack.pop()
+                idxStack.pop()
+                inEdgeId = inEdgeStack.pop()
+                if vStack:
+                    parentId = vStack[-1]
+                    if low[vId] < low[parentId]:
+                        low[parentId] = low[vId]
+                    if low[vId] > order[parentId]:  # There are no other routes to the subtree
+                        bridges.append(inEdgeId)
+                    if cutVertices is not None:
+                        if parentId == rootId:
+                            rootChildCount += 1
+                        elif low[vId] >= order[parentId]:  # The subtree is reached through the parent only
+                            cutVertices[parentId] = cutVertices.get(parentId, 1) + 1
+        if cutVertices is not None and rootChildCount > 1:  # Subtrees of the root are joined by the root only
+            cutVertices[rootId] = rootChildCount
+    meter.finish()
+    return bridges
+
+
+class GridSnapper:
+    """
+    Merging points closer than the tolerance in single vertices by a grid spatial hash
+    with the cell size equal to the tolerance, so only 3x3 neighbour cells are compared.
+    Vertex coordinates are kept in the arrays xs, ys.
+    """
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.sqTolerance = tolerance * tolerance
+        self.xs = array('d')
+        self.ys = array('d')
+        self.cells = dict()  # {(cellX, cellY): [vertexId,..]} or {(x, y): vertexId} for zero tolerance
+
+    def vertexId(self, x, y):
+        """
+        :return: The id of the nearest vertex within the tolerance, a new vertex is added if there is no one
+        """
+        xs = self.xs
+        ys = self.ys
+        if self.tolerance > 0:
+            cellX = int(x // self.tolerance)
+            cellY = int(y // self.tolerance)
+            vId = -1
+            sqDistance = self.sqTolerance
+            for neighbourX in (cellX - 1, cellX, cellX + 1):
+                for neighbourY in (cellY - 1, cellY, cellY + 1):
+                    for nextVId in self.cells.get((neighbourX, neighbourY), ()):
+                        curSqDistance = (xs[nextVId] - x) ** 2 + (ys[nextVId] - y) ** 2
+                        if curSqDistance <= sqDistance:
+                            vId = nextVId
+                            sqDistance = curSqDistance
+            if vId < 0:
+                vId = len(xs)
+                xs.append(x)
+                ys.append(y)
+                self.cells.setdefault((cellX, cellY), []).append(vId)
+        else:
+            vId = self.cells.get((x, y), -1)
+            if vId < 0:
+                vId = len(xs)
+                xs.append(x)
+                ys.append(y)
+                self.cells[(x, y)] = vId
+        return vId
+
+
+class VertexLocator:
+    """
+    Finding the nearest vertex of given vertex coordinates by a grid spatial hash.
+    The cell size is chosen for about one vertex per cell, rings of cells around a point are searched
+    until no cell of the next ring can be closer than the nearest vertex found.
+    """
+
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+        self.cells = dict()  # {(cellX, cellY): [vertexId,..]}
+        if not len(xs):
+            return
+        self.minX, self.maxX = min(xs), max(xs)
+        self.minY, self.maxY = min(ys), max(ys)
+        area = max(self.maxX - self.minX, 1e-9) * max(self.maxY - self.minY, 1e-9)
+        self.cellSize = max((area / len(xs)) ** 0.5, 1e-9)
+        for vId in range(len(xs)):
+            self.cells.setdefault(self.getCell(xs[vId], ys[vId]), []).append(vId)
+
+    def getCell(self, x, y):
+        return int((x - self.minX) // self.cellSize), int((y - self.minY) // self.cellSize)
+
+    def nearestVertex(self, x, y, maxDistance=0):
+        """
+        :param maxDistance: The search radius, 0 means no limit
+        :return: The id of the nearest vertex or -1 if there is no vertex within the radius
+        """
+        if not self.cells:
+            return -1
+        xs = self.xs
+        ys = self.ys
+        cellX, cellY = self.getCell(x, y)
+        lastX, lastY = self.getCell(self.maxX, self.maxY)
+        maxRing = max(abs(cellX), abs(cellY), abs(cellX - lastX), abs(cellY - lastY))
+        if maxDistance > 0:
+            maxRing = min(maxRing, int(maxDistance // self.cellSize) + 1)
+        vId = -1
+        sqDistance = maxDistance * maxDistance if maxDistance > 0 else float('inf')
+        for ring in range(maxRing + 1):
+            if vId >= 0 and sqDistance <= ((ring - 1) * self.cellSize) ** 2:
+                break  # Cells of this ring are farther than the nearest vertex
+            for neighbourX in range(cellX - ring, cellX + ring + 1):
+                isSide = neighbourX in (cellX - ring, cellX + ring)
+                for neighbourY in (range(cellY - ring, cellY + ring + 1) if isSide else (cellY - ring, cellY + ring)):
+                    for nextVId in self.cells.get((neighbourX, neighbourY), ()):
+                        curSqDistance = (xs[nextVId] - x) ** 2 + (ys[nextVId] - y) ** 2
+                        if curSqDistance <= sqDistance:
+                            vId = nextVId
+                            sqDistance = curSqDistance
+        return vId
+
+
+class CountRoutesGraph:
+    """
+    Compact array-backed graph of directed edges (half-edges).
+    Vertex ids and edge ids are numbered from 0 like in QgsGraph.
+    The structure does not depend on QGIS, so it can be built and tested without it.
+    Arrays:
+        xs, ys - vertex coordinates,
+        fromVertices, toVertices - end vertices of edges,
+        twins - opposite edge ids (-1 if an edge has no opposite or duplicates another edge),
+        successors - next edge ids of circles walked in clockwise order (the rotation system),
+        faces - circle (face) ids of edges, faceStarts - the first edge id of each circle,
+        outOffsets, outEdges - CSR adjacency of outgoing edges,
+        inOffsets, inEdges - CSR adjacency of incoming edges.
+    """
+
+    def __init__(self, xs, ys, fromVertices, toVertices, featureIds=None):
+        """
+        :param featureIds: Source feature ids of edges, -1 if the source feature is unknown
+        """
+        self.xs = array('d', xs)
+        self.ys = array('d', ys)
+        self.fromVertices = array('q', fromVertices)
+        self.toVertices = array('q', toVertices)
+        if featureIds is None:
+            self.featureIds = array('q', [-1]) * len(self.fromVertices)
+        else:
+            self.featureIds = array('q', featureIds)
+        self.twins = array('q', [-1]) * len(self.fromVertices)
+        self.successors = array('q', [-1]) * len(self.fromVertices)
+        self.faces = array('q', [-1]) * len(self.fromVertices)
+        self.faceStarts = array('q')
+        self.outOffsets, self.outEdges = self.composingAdjacency(self.fromVertices, len(self.xs))
+        self.inOffsets, self.inEdges = self.composingAdjacency(self.toVertices, len(self.xs))
+        self.composed = set()  # Names of composed stages: 'twins', 'successors', 'faces'
+
+    @classmethod
+    def fromArrays(cls, arrays, composed):
+        """
+        Restoring the graph from ready arrays without copying them, e.g. from memory-mapped views
+        :param arrays: {arrayName: int or float sequence} with all arrays of the graph
+        :param composed: Names of composed stages
+        """
+        graph = cls.__new__(cls)
+        graph.__dict__.update(arrays)
+        graph.composed = set(composed)
+        return graph
+
+    @staticmethod
+    def composingAdjacency(vertices, vertexCount):
+        """
+        Composing CSR adjacency by a counting sort of edges
+        :param vertices: An array of edge end vertices {edgeId: vertexId}
+        :return: offsets, edges where edges of the vertex vId are edges[offsets[vId]:offsets[vId + 1]]
+        """
+        offsets = array('q', [0]) * (vertexCount + 1)
+        for vId in vertices:
+            offsets[vId + 1] += 1
+        for vId in range(vertexCount):
+            offsets[vId + 1] += offsets[vId]
+        positions = array('q', offsets)
+        edges = array('q', [0]) * len(vertices)
+        for eId, vId in enumerate(vertices):
+            edges[positions[vId]] = eId
+            positions[vId] += 1
+        return offsets, edges
+
+    @classmethod
+    def fromQgsGraph(cls, graph, feedback=None, feedbackDelta=0, featureIdStrategy=-1):
+        """
+        Building the compact graph from QgsGraph. QgsGraph accessors are called once per vertex and edge.
+        :param featureIdStrategy: The index of the edge cost of source feature ids (-1 if ids are unknown)
+        :return: CountRoutesGraph (incomplete if the run is canceled)
+        """
+        xs = array('d')
+        ys = array('d')
+        meter = FeedbackMeter(feedback, feedbackDelta, graph.vertexCount() + graph.edgeCount())
+        mask = meter.mask
+        for vId in range(graph.vertexCount()):
+            if not vId & mask and meter.step(vId):
+                return cls([], [], [], [])
+            point = graph.vertex(vId).point()   # QgsPointXY
+            xs.append(point.x())
+            ys.append(point.y())
+        fromVertices = array('q')
+        toVertices = array('q')
+        featureIds = array('q')
+        for eId in range(graph.edgeCount()):
+            if not eId & mask and meter.step(graph.vertexCount() + eId):
+                return cls([], [], [], [])
+            edge = graph.edge(eId)
+            fromVertices.append(edge.fromVertex())
+            toVertices.append(edge.toVertex())
+            if featureIdStrategy >= 0:
+                featureId = edge.cost(featureIdStrategy)
+                featureIds.append(int(featureId) if isinstance(featureId, (int, float)) else -1)  # Not NULL
+        meter.finish()
+        return cls(xs, ys, fromVertices, toVertices, featureIds if featureIdStrategy >= 0 else None)
+
+    @classmethod
+    def fromPolylines(cls, polylines, tolerance):
+        """
+        Building the compact graph from streamed polylines like QgsGraphBuilder does in both directions.
+        Points closer than the tolerance are merged in a single vertex by GridSnapper.
+        :param polylines: An iterable of point sequences [(x, y),..]
+        :param tolerance: A topology tolerance in layer units
+        """
+        return cls.fromFeaturePolylines(((-1, points) for points in polylines), tolerance)
+
+    @classmethod
+    def fromFeaturePolylines(cls, featurePolylines, tolerance):
+        """
+        Building the compact graph like fromPolylines does and keeping source feature ids of edges
+        :param featurePolylines: An iterable of (featureId, [(x, y),..])
+        """
+        snapper = GridSnapper(tolerance)
+        fromVertices = array('q')
+        toVertices = array('q')
+        featureIds = array('q')
+        for featureId, points in featurePolylines:
+            lastVId = -1
+            for x, y in points:
+                vId = snapper.vertexId(x, y)
+                if lastVId >= 0 and vId != lastVId:
+                    fromVertices.append(lastVId)
+                    toVertices.append(vId)
+                    fromVertices.append(vId)
+                    toVertices.append(lastVId)
+                    featureIds.append(featureId)
+                    featureIds.append(featureId)
+                lastVId = vId
+        return cls(snapper.xs, snapper.ys, fromVertices, toVertices, featureIds)
+
+    def vertexCount(self):
+        return len(self.xs)
+
+    def edgeCount(self):
+        return len(self.fromVertices)
+
+    def outgoingEdges(self, vId):
+        return self.outEdges[self.outOffsets[vId]:self.outOffsets[vId + 1]]
+
+    def incomingEdges(self, vId):
+        return self.inEdges[self.inOffsets[vId]:self.inOffsets[vId + 1]]
+
+    def point(self, vId):
+        return self.xs[vId], self.ys[vId]
+
+    def edgePoints(self, eId):
+        """
+        :return: [(xFrom, yFrom), (xTo, yTo)]
+        """
+        return [self.point(self.fromVertices[eId]), self.point(self.toVertices[eId])]
+
+    def composingTwins(self, feedback=None, feedbackDelta=0):
+        """
+        Pairing opposite edges and removing duplicate edges vertex by vertex in O(E):
+        the opposite edge of an outgoing edge (v, w) is the incoming edge (w, v) of the same vertex,
+        so only incoming edges of the vertex are kept in a dictionary by their start vertices.
+        The edge with the lowest id represents duplicate edges with the same end vertices
+        (CSR adjacency keeps edges of a vertex in order of ids), other duplicates get -1
+        like edges without an opposite edge.
+        :return: The twin array {edgeId: oppositeEdgeId} (incomplete and not composed if the run is canceled)
+        """
+        fromVertices = self.fromVertices
+        toVertices = self.toVertices
+        outOffsets = self.outOffsets
+        outEdges = self.outEdges
+        inOffsets = self.inOffsets
+        inEdges = self.inEdges
+        twins = array('q', [-1]) * self.edgeCount()
+        meter = FeedbackMeter(feedback, feedbackDelta, self.vertexCount())
+        mask = meter.mask
+        for vId in range(self.vertexCount()):
+            if not vId & mask and meter.step(vId):
+                return twins
+            incoming = dict()  # {fromVertexId: the lowest id of edges coming from the vertex}
+            for idx in range(inOffsets[vId], inOffsets[vId + 1]):
+                eId = inEdges[idx]
+                if fromVertices[eId] not in incoming:
+                    incoming[fromVertices[eId]] = eId
+            passed = set()  # End vertices of passed outgoing edges, next edges to them are duplicates
+            for idx in range(outOffsets[vId], outOffsets[vId + 1]):
+                eId = outEdges[idx]
+                toVId = toVertices[eId]
+                if toVId not in passed:
+                    passed.add(toVId)
+                    twins[eId] = incoming.get(toVId, -1)
+        self.twins = twins
+        self.composed.add('twins')
+        meter.finish()
+        return twins
+
+    def composingSuccessors(self, feedback=None, feedbackDelta=0):
+        """
+        Composing the rotation system as the flat successor array {inEdgeId: nextOutEdgeId}.
+        Incoming edges of each vertex are sorted by the azimuth, the azimuth is clockwise
+        from north like QgsPointXY.azimuth. The successor of an incoming edge is the opposite edge
+        of the next incoming edge of the same vertex, the successor of a branch end is the opposite edge.
+        Edges without an opposite edge get -1. The twin array should be composed before.
+        :return: The successor array (incomplete and not composed if the run is canceled)
+        """
+        xs = self.xs
+        ys = self.ys
+        fromVertices = self.fromVertices
+        twins = self.twins
+        inOffsets = self.inOffsets
+        inEdges = self.inEdges
+        successors = array('q', [-1]) * self.edgeCount()
+        meter = FeedbackMeter(feedback, feedbackDelta, self.vertexCount())
+        mask = meter.mask
+        for vId in range(self.vertexCount()):
+            if not vId & mask and meter.step(vId):
+                return successors
+            edges = [eId for eId in inEdges[inOffsets[vId]:inOffsets[vId + 1]] if twins[eId] >= 0]
+            if not edges:
+                continue
+            x = xs[vId]
+            y = ys[vId]
+            edges.sort(key=lambda eId: atan2(xs[fromVertices[eId]] - x, ys[fromVertices[eId]] - y))
+            # Incoming edges of the vertex in clockwise order
+            for pos in range(len(edges) - 1):
+                successors[edges[pos]] = twins[edges[pos + 1]]
+            successors[edges[-1]] = twins[edges[0]]
+        self.successors = successors
+        self.composed.add('successors')
+        meter.finish()
+        return successors
+
+    def composingFaces(self, feedback=None, feedbackDelta=0):
+        """
+        Tracing circles (faces) of the rotation system, each edge is walked exactly once.
+        The face array is filled in place and serves as the visited mark of edges.
+        The successor array should be composed before.
+        :return: faces, faceStarts (incomplete and not composed if the run is canceled)
+        """
+        successors = self.successors
+        faces = array('q', [-1]) * self.edgeCount()
+        faceStarts = array('q')
+        passedCount = 0
+        meter = FeedbackMeter(feedback, feedbackDelta, self.edgeCount())
+        mask = meter.mask
+        for startId in range(self.edgeCount()):
+            if faces[startId] >= 0 or successors[startId] < 0:
+                continue
+            faceId = len(faceStarts)
+            faceStarts.append(startId)
+            eId = startId
+            while faces[eId] < 0:
+                faces[eId] = faceId
+                eId = successors[eId]
+                passedCount += 1
+                if not passedCount & mask and meter.step(passedCount):
+                    return faces, faceStarts
+        self.faces = faces
+        self.faceStarts = faceStarts
+        self.composed.add('faces')
+        meter.finish()
+        return faces, faceStarts
+
+    def iterFaces(self, feedback=None, feedbackDelta=0):
+        """
+        Iterating circles (faces) of the rotation system one by one without materializing all of them:
+        only edges of the current face are kept, passed edges are marked by a byte
+        (the face starts are walked without marks if faces are composed already).
+        The successor array should be composed before.
+        :return: A generator of edge id lists of faces in order of face ids
+        """
+        successors = self.successors
+        meter = FeedbackMeter(feedback, feedbackDelta, self.edgeCount())
+        mask = meter.mask
+        if 'faces' in self.composed:
+            starts = self.faceStarts
+            isPassed = None
+        else:
+            starts = range(self.edgeCount())
+            isPassed = bytearray(self.edgeCount())
+        passedCount = 0
+        for startId in starts:
+            if isPassed is not None:
+                if isPassed[startId] or successors[startId] < 0:
+                    continue
+            face = [startId]
+            eId = successors[startId]
+            while eId != startId:
+                face.append(eId)
+                eId = successors[eId]
+                passedCount += 1
+                if not passedCount & mask and meter.step(passedCount):
+                    return
+            if isPassed is not None:
+                for eId in face:
+                    isPassed[eId] = 1
+            yield face
+        meter.finish()
+
+    def iterBoundedFaces(self, feedback=None, feedbackDelta=0):
+        """
+        Iterating bounded faces (loops of the network like city blocks) with their measures.
+        Bounded faces are walked counterclockwise and have a positive signed area,
+        outer faces of connected parts are walked clockwise and are skipped.
+        Edges walked in both directions (blind branches and bridges inside a face) do not bound the face:
+        they add nothing to the area and are not counted in the perimeter and the edge count.
+        The successor array should be composed before.
+        :return: A generator of (edge ids of the face, area, perimeter, the number of bounding edges)
+        """
+        xs = self.xs
+        ys = self.ys
+        twins = self.twins
+        fromVertices = self.fromVertices
+        toVertices = self.toVertices
+        for face in self.iterFaces(feedback, feedbackDelta):
+            originId = fromVertices[face[0]]  # Coordinates are taken from the first vertex for the accuracy
+            originX = xs[originId]
+            originY = ys[originId]
+            faceEdges = set(face)
+            doubledArea = 0.0
+            perimeter = 0.0
+            edgeCount = 0
+            for eId in face:
+                fromX = xs[fromVertices[eId]] - originX
+                fromY = ys[fromVertices[eId]] - originY
+                toX = xs[toVertices[eId]] - originX
+                toY = ys[toVertices[eId]] - originY
+                doubledArea += fromX * toY - toX * fromY
+                if twins[eId] not in faceEdges:
+                    perimeter += ((toX - fromX) ** 2 + (toY - fromY) ** 2) ** 0.5
+                    edgeCount += 1
+            if doubledArea > 0:
+                yield face, doubledArea / 2, perimeter, edgeCount
+
+    def composingComponents(self, feedback=None, feedbackDelta=0):
+        """
+        Labeling connected parts of the graph by the search over paired edges
+        :return: The component array {vertexId: componentId} (incomplete if the run is canceled)
+        """
+        twins = self.twins
+        toVertices = self.toVertices
+        components = array('q', [-1]) * self.vertexCount()
+        componentId = 0
+        meter = FeedbackMeter(feedback, feedbackDelta, self.vertexCount())
+        mask = meter.mask
+        passedCount = 0
+        for rootId in range(self.vertexCount()):
+            if components[rootId] >= 0:
+                continue
+            components[rootId] = componentId
+            stack = [rootId]
+            while stack:
+                vId = stack.pop()
+                passedCount += 1
+                if not passedCount & mask and meter.step(passedCount):
+                    return components
+                for eId in self.outgoingEdges(vId):
+                    nextId = toVertices[eId]
+                    if twins[eId] >= 0 and components[nextId] < 0:
+                        components[nextId] = componentId
+                        stack.append(nextId)
+            componentId += 1
+        meter.finish()
+        return components
+
+    def composingCycleLabels(self, seed=None, feedback=None, feedbackDelta=0):
+        """
+        Labeling paired edges by random vectors of the cycle space: each edge out of a spanning forest
+        gets a random 64-bit label, each forest edge gets the XOR of labels of edges whose fundamental cycles
+        pass it (the XOR of labels at vertices of its subtree). Bridges get 0, two other edges get the same label
+        if and only if removing both of them splits their part of the graph (a 2-edge cut),
+        a false match has the probability 2^-64 per pair. The search is linear.
+        :param seed: The seed of random labels
+        :return: The label array {edgeId: label} (opposite edges share a label, edges without twins get 0),
+            incomplete if the run is canceled
+        """
+        twins = self.twins
+        fromVertices = self.fromVertices
+        toVertices = self.toVertices
+        outOffsets = self.outOffsets
+        outEdges = self.outEdges
+        vCount = self.vertexCount()
+        parentEdges = array('q', [-1]) * vCount  # {vertexId: edgeId from the parent to the vertex} (-2 for roots)
+        isForest = bytearray(self.edgeCount())
+        order = array('q')  # Vertices after their parents
+        labels = array('Q', [0]) * self.edgeCount()
+        meter = FeedbackMeter(feedback, feedbackDelta, 2 * vCount + self.edgeCount())
+        mask = meter.mask
+        passedCount = 0
+        for rootId in range(vCount):
+            if parentEdges[rootId] != -1:
+                continue
+            order.append(rootId)
+            parentEdges[rootId] = -2  # A root is visited without a parent edge
+            stack = [rootId]
+            while stack:
+                vId = stack.pop()
+                passedCount += 1
+                if not passedCount & mask and meter.step(passedCount):
+                    return labels
+                for idx in range(outOffsets[vId], outOffsets[vId + 1]):
+                    eId = outEdges[idx]
+                    nextId = toVertices[eId]
+                    if twins[eId] >= 0 and parentEdges[nextId] == -1:
+                        parentEdges[nextId] = eId
+                        isForest[eId] = isForest[twins[eId]] = 1
+                        order.append(nextId)
+                        stack.append(nextId)
+        rnd = random.Random(seed)
+        sums = array('Q', [0]) * vCount  # XOR of labels at vertices of subtrees
+        for eId in range(self.edgeCount()):
+            if not eId & mask and meter.step(vCount + eId):
+                return labels
+            oppositeId = twins[eId]
+            if oppositeId > eId and not isForest[eId]:
+                label = rnd.getrandbits(64)
+                labels[eId] = labels[oppositeId] = label
+                sums[fromVertices[eId]] ^= label
+                sums[toVertices[eId]] ^= label
+        for pos, vId in enumerate(reversed(order)):
+            if not pos & mask and meter.step(vCount + self.edgeCount() + pos):
+                return labels
+            eId = parentEdges[vId]
+            if eId >= 0:
+                labels[eId] = labels[twins[eId]] = sums[vId]
+                sums[fromVertices[eId]] ^= sums[vId]
+        meter.finish()
+        return labels
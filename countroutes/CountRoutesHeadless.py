@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    CountRoutesHeadless.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+The headless batch engine of the bottleneck pipeline: line layer files of a folder are analysed
+on a pool of worker processes without the QGIS GUI, bottlenecks of each file are written to a GeoPackage
+and statistics of all files are written to a single report.
+
+    from countroutes.CountRoutesHeadless import runBatch
+    stats = runBatch('networks', 'bottlenecks', processes=8)
+
+Only the standard library is imported with the module, QGIS is started in each worker when the first file
+is read (QGIS_PREFIX_PATH should point to the QGIS installation if it is not found by default).
+"""
+
+import os
+import csv
+import json
+import time
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+NETWORK_SUFFIXES = ('.shp', '.gpkg', '.geojson', '.json', '.fgb', '.gml', '.kml', '.tab', '.sqlite')
+STATS_FIELDS = ('file', 'name', 'status', 'message', 'features', 'vertices', 'edges', 'bottlenecks',
+                'seconds', 'processPeakBytes', 'output')
+workerState = dict()  # The QGIS application started once in each process
+
+
+class HeadlessFeedback:
+    """
+    The feedback of pipeline stages without QgsProcessingFeedback, messages are collected in a list
+    """
+
+    def __init__(self):
+        self.value = 0
+        self.messages = []
+
+    def setProgress(self, value):
+        self.value = value
+
+    def progress(self):
+        return self.value
+
+    def isCanceled(self):
+        return False
+
+    def pushInfo(self, info):
+        self.messages.append(info)
+
+
+def initQgis():
+    """
+    Starting QGIS without the GUI once in the process
+    """
+    if 'application' in workerState:
+        return
+    from qgis.core import QgsApplication
+    application = QgsApplication.instance()
+    isOwned = application is None
+    if isOwned:
+        application = QgsApplication([], False)
+        application.initQgis()
+    workerState['application'] = application
+    workerState['isOwned'] = isOwned
+
+
+def initWorker():
+    """
+    The pool initializer: a worker failing in the initializer breaks the whole pool,
+    so errors are left to analyseNetworkFile which reports them in statistics of each file
+    """
+    try:
+        initQgis()
+    except Exception:
+        pass
+
+
+def exitQgis():
+    application = workerState.pop('application', None)
+    if workerState.pop('isOwned', False):
+        application.exitQgis()
+
+
+def getNetworkFiles(folder, suffixes=NETWORK_SUFFIXES):
+    """
+    :return: Sorted paths of vector files of the folder (not recursive)
+    """
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(suffixes) and os.path.isfile(os.path.join(folder, name))
+    )
+
+
+def getOutputPath(path, outputFolder):
+    path = path.split('|')[0]  # Options of an OGR data source
+    return os.path.join(outputFolder, f'{os.path.splitext(os.path.basename(path))[0]}_bottlenecks.gpkg')
+
+
+def getStatsRecord(path, name=None, status='ok', message=''):
+    """
+    :return: The statistics record {field: value} of STATS_FIELDS of the file without counts
+    """
+    stats = dict.fromkeys(STATS_FIELDS)
+    stats.update(file=path, name=name or os.path.splitext(os.path.basename(path.split('|')[0]))[0],
+                 status=status, message=message)
+    return stats
+
+
+def analyseNetworkFile(path, outputFolder, tolerance=0.01, isBranches=False, isMergedBranches=False,
+                       isChained=True, fieldNames=(), outputPath=None, name=None):
+    """
+    Running the bottleneck pipeline on a line layer file by the bridge search
+    and writing bottleneck sections to a GeoPackage of the output folder
+    :param path: A vector file path (the first layer of the file is read) or an OGR data source
+        like 'roads.gpkg|layername=roads'
+    :param fieldNames: Names of source fields copied to the output
+    :param outputPath: The output GeoPackage (<file name>_bottlenecks.gpkg of the output folder if it is None)
+    :param name: The layer name of the file in the report (the file name if it is None)
+    :return: The statistics record {field: value} of STATS_FIELDS and stage records of the profiler
+    """
+    startTime = time.perf_counter()
+    stats = getStatsRecord(path, name)
+    try:
+        initQgis()
+        from qgis.core import (
+            QgsWkbTypes,
+            QgsVectorLayer,
+            QgsFeatureRequest,
+        )
+        from .CountRoutesGraph import CountRoutesGraph
+        from .CountRoutesMethods import CountRoutesMethods
+        from .CountRoutesProfiler import StageProfiler
+        profiler = StageProfiler()
+        feedback = HeadlessFeedback()
+        layer = QgsVectorLayer(path, stats['name'], 'ogr')
+        if not layer.isValid() or layer.geometryType() != QgsWkbTypes.LineGeometry:
+            stats.update(status='skipped', message='The file has no valid line layer.')
+            return stats
+        fieldNames = [name for name in fieldNames if layer.fields().indexOf(name) >= 0]
+        with profiler.stage('Graph model') as counts:
+            request = QgsFeatureRequest().setNoAttributes()
+            graph = CountRoutesGraph.fromFeaturePolylines((
+                (feature.id(), polyline)
+                for feature in layer.getFeatures(request)
+                for polyline in CountRoutesMethods.getPolylines(feature.geometry())
+            ), tolerance)
+            counts['vertices'] = graph.vertexCount()
+            counts['edges'] = graph.edgeCount()
+        stats.update(features=layer.featureCount(), vertices=graph.vertexCount(), edges=graph.edgeCount())
+        chains = []
+        impacts = []
+        if graph.edgeCount():
+            with profiler.stage('Edge pairs') as counts:
+                edgePairs = CountRoutesMethods.getEdgePairDict(graph, feedback)
+                counts['pairs'] = len(edgePairs)
+            with profiler.stage('Bridge search') as counts:
+                edges = CountRoutesMethods.getBridgeEdges(graph, edgePairs, feedback, 0)
+                counts['bridges'] = len(edges)
+            with profiler.stage('Bottleneck chains') as counts:
+                chains = CountRoutesMethods.getBottleneckChains(
+                    graph, edgePairs, edges, isBranches, isMergedBranches, isChained
+                )
+                counts['chains'] = len(chains)
+            with profiler.stage('Bottleneck impact') as counts:
+                impacts = CountRoutesMethods.getChainImpacts(graph, edges, chains) if chains else []
+                counts['bottlenecks'] = len(impacts)
+        stats['bottlenecks'] = len(chains)
+        with profiler.stage('Output layer') as counts:
+            stats['output'] = writeBottleneckFile(
+                outputPath or getOutputPath(path, outputFolder), graph, chains, layer, fieldNames, impacts
+            )
+            counts['features'] = len(chains)
+        stats['stages'] = profiler.records
+        stats['processPeakBytes'] = profiler.records[-1]['processPeakBytes']  # Of the worker lifetime, not the file
+    except Exception as error:
+        stats.update(status='failed', message=f'{type(error).__name__}: {error}')
+    finally:
+        stats['seconds'] = time.perf_counter() - startTime
+    return stats
+
+
+def writeBottleneckFile(outputPath, graph, chains, layer, fieldNames=(), impacts=None, batchSize=10000):
+    """
+    Writing bottleneck chains to a GeoPackage with the length, the source feature id, the cut off part
+    of the network and source fields
+    (an empty layer is written if there are no bottlenecks, so runs are compared file by file)
+    :param layer: The source QgsVectorLayer
+    :param impacts: [[vertexCount, edgeCount, length],..] of cut off parts of chains or None
+    :return: The output path
+    """
+    from qgis.PyQt.QtCore import QVariant
+    from qgis.core import (
+        QgsWkbTypes,
+        QgsFeature,
+        QgsFeatureRequest,
+        QgsGeometry,
+        QgsField,
+        QgsFields,
+        QgsVectorFileWriter,
+        QgsCoordinateTransformContext,
+    )
+    from .CountRoutesMethods import CountRoutesMethods
+    fields = QgsFields()
+    fields.append(QgsField('length', QVariant.Double))
+    fields.append(QgsField('source_id', QVariant.LongLong))
+    if impacts is not None:
+        fields.append(QgsField('cut_vertices', QVariant.LongLong))
+        fields.append(QgsField('cut_edges', QVariant.LongLong))
+        fields.append(QgsField('cut_length', QVariant.Double))
+    for name in fieldNames:
+        field = QgsField(layer.fields().field(name))
+        if fields.indexOf(name) >= 0:
+            field.setName(f'source_{name}')
+        fields.append(field)
+    featureIds = [graph.featureIds[chain[0]] for chain in chains]
+    sourceAttributes = dict()  # {featureId: [value,..]}
+    if fieldNames and chains:
+        request = QgsFeatureRequest() \
+            .setFilterFids([featureId for featureId in set(featureIds) if featureId >= 0]) \
+            .setSubsetOfAttributes(fieldNames, layer.fields()) \
+            .setFlags(QgsFeatureRequest.NoGeometry)
+        for feature in layer.getFeatures(request):
+            sourceAttributes[feature.id()] = [feature[name] for name in fieldNames]
+    emptyAttributes = [None] * len(fieldNames)
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = os.path.splitext(os.path.basename(outputPath))[0]
+    writer = QgsVectorFileWriter.create(
+        outputPath, fields, QgsWkbTypes.LineString, layer.crs(), QgsCoordinateTransformContext(), options
+    )
+    try:
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            raise OSError(writer.errorMessage())
+        batch = []
+        for idx, (chain, featureId) in enumerate(zip(chains, featureIds)):
+            feat = QgsFeature(fields)
+            geometry = QgsGeometry.fromPolylineXY(CountRoutesMethods.getChainPointsXY(graph, chain))
+            feat.setGeometry(geometry)
+            feat.setAttributes(
+                [geometry.length(), featureId if featureId >= 0 else None] +
+                (impacts[idx] if impacts is not None else []) +
+                sourceAttributes.get(featureId, emptyAttributes)
+            )
+            batch.append(feat)
+            if len(batch) >= batchSize:
+                writer.addFeatures(batch)
+                batch = []
+        if batch:
+            writer.addFeatures(batch)
+    finally:
+        del writer  # Flushing and closing the file
+    return outputPath
+
+
+def analyseNetworkTask(task):
+    path, outputFolder, options = task
+    return analyseNetworkFile(path, outputFolder, **options)
+
+
+def runTasks(tasks, processes=0, callback=None, isCanceled=None, pollSeconds=0.5):
+    """
+    Analysing network files of tasks concurrently on a bounded pool of worker processes
+    (threads would share the interpreter lock, so files are analysed in processes)
+    :param tasks: [(path, outputFolder, options),..] where options are keyword parameters of analyseNetworkFile
+    :param processes: The number of worker processes (the CPU count if 0), files are analysed
+        in the current process if it is 1
+    :param callback: A function called with the statistics record of each file as soon as it is analysed
+    :param isCanceled: A function polled while files are analysed, the pool is stopped if it returns True
+    :return: {path: record} of analysed files (files of a worker process which died, for example
+        killed for lack of memory, are reported as failed, as the pool is broken, and its other files too)
+    """
+    processes = min(processes or os.cpu_count() or 1, len(tasks))
+    records = dict()  # {path: record}
+    if processes > 1:
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        from concurrent.futures.process import BrokenProcessPool
+        from .CountRoutesParallel import getProcessContext
+        executor = ProcessPoolExecutor(processes, getProcessContext(), initWorker)
+        try:
+            futures = {executor.submit(analyseNetworkTask, task): task for task in tasks}  # {future: task}
+            pending = set(futures)
+            while pending:
+                if isCanceled is not None and isCanceled():
+                    break
+                done, pending = wait(pending, pollSeconds, FIRST_COMPLETED)
+                for future in done:
+                    path, _, options = futures[future]
+                    try:
+                        record = future.result()
+                    except BrokenProcessPool:
+                        record = getStatsRecord(path, options.get('name'), 'failed',
+                                                'A worker process stopped unexpectedly')
+                    records[record['file']] = record
+                    if callback is not None:
+                        callback(record)
+        finally:
+            stopExecutor(executor)
+    else:
+        try:
+            for task in tasks:
+                if isCanceled is not None and isCanceled():
+                    break
+                record = analyseNetworkTask(task)
+                records[record['file']] = record
+                if callback is not None:
+                    callback(record)
+        finally:
+            exitQgis()
+    return records
+
+
+def stopExecutor(executor):
+    """
+    Stopping the process pool without waiting for files being analysed (a canceled batch returns at once)
+    """
+    for process in list((getattr(executor, '_processes', None) or dict()).values()):
+        process.terminate()
+    executor.shutdown(wait=False)
+
+
+def runBatch(inputFolder, outputFolder, processes=0, statsPath=None, callback=None, **options):
+    """
+    Analysing line layer files of the folder on a pool of worker processes
+    :param processes: The number of worker processes (the CPU count if 0), files are analysed
+        in the current process if it is 1
+    :param statsPath: The report of statistics, CSV if the path ends with .csv or JSON otherwise
+        (stats.json of the output folder if it is None)
+    :param callback: A function called with the statistics record of each file as soon as it is analysed
+    :param options: Keyword parameters of analyseNetworkFile
+    :return: Statistics records in order of files
+    """
+    os.makedirs(outputFolder, exist_ok=True)
+    paths = getNetworkFiles(inputFolder)
+    records = runTasks([(path, outputFolder, options) for path in paths], processes, callback)
+    stats = [records[path] for path in paths]
+    writeStats(stats, statsPath or os.path.join(outputFolder, 'stats.json'))
+    return stats
+
+
+def writeStats(stats, path):
+    """
+    Writing statistics records to a CSV file (stage times in columns) if the path ends with .csv
+    or to a JSON file with stage records otherwise
+    """
+    if path.lower().endswith('.csv'):
+        stageNames = []
+        for record in stats:
+            stageNames.extend(
+                stage['stage'] for stage in record.get('stages', ()) if stage['stage'] not in stageNames
+            )
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(STATS_FIELDS + tuple(f'{name} seconds' for name in stageNames))
+            for record in stats:
+                stageSeconds = {stage['stage']: stage['wallSeconds'] for stage in record.get('stages', ())}
+                writer.writerow(
+                    [record[field] for field in STATS_FIELDS] +
+                    [stageSeconds.get(name, '') for name in stageNames]
+                )
+    else:
+        with open(path, 'w') as file:
+            json.dump({'files': stats}, file, indent=1)
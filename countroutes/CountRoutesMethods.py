@@ -20,240 +20,460 @@
 
 from PyQt5.QtCore import (
     QObject,
+    QVariant,
+)
+from qgis.core import (
+    QgsPointXY,
+    QgsFeature,
+    QgsField,
+    QgsGeometry,
+    QgsVectorLayer,
+    QgsFeatureRequest,
+    QgsProviderRegistry,
 )
 from qgis.analysis import (
     QgsVectorLayerDirector,
+    QgsNetworkStrategy,
     QgsNetworkDistanceStrategy,
     QgsGraphBuilder,
 )
 from collections import deque
+import os
+from .CountRoutesGraph import CountRoutesGraph, FeedbackMeter, searchBridges
+from .CountRoutesParallel import getBridgeEdgesParallel
+from .CountRoutesTiles import TiledBridgeSearch
+from .CountRoutesNoding import nodePolylines
+from .BridgeTree import BridgeTree
+from .CountRoutesBottlenecks import (
+    getGraphBranches,
+    getCoreCutVertices,
+    getEdgeChains,
+    getBottleneckChains,
+    getTwoEdgeCuts,
+    getChainImpacts,
+)
 
 __license__ = 'GPL version 3'
 __copyright__ = 'Copyright 2024, Pavel Minin'
 __email__ = 'countroutes@gmail.com'
 
 
+class FeatureIdStrategy(QgsNetworkStrategy):
+    """
+    The edge "cost" of the source feature id, so edges of QgsGraphBuilder keep their source features
+    (the id is taken from a field if the layer is a copy of the source, e.g. of noded lines)
+    """
+
+    def __init__(self, fieldIndex=-1):
+        super().__init__()
+        self.fieldIndex = fieldIndex
+
+    def requiredAttributes(self):
+        return {self.fieldIndex} if self.fieldIndex >= 0 else set()
+
+    def cost(self, distance, feature):
+        return feature.attribute(self.fieldIndex) if self.fieldIndex >= 0 else feature.id()
+
+
 class CountRoutesMethods(QObject):
 
     def __init__(self):
         super().__init__()
 
+    @staticmethod
+    def composingFaceModel(graph, edgePairDict, feedback, feedbackDelta):
+        """
+        Composing the circle model as the face array of the graph without holding circles in memory:
+        each edge is labeled by its circle (face) in a single walk by the successor array.
+        Circles are walked one by one by graph.iterFaces when they are needed.
+        :param graph: CountRoutesGraph with the composed successor array
+        :param edgePairDict: {edgeId: oppositeEdgeId}
+        :return: (the number of circles, the number of connected parts of the graph with circles)
+            (incomplete if the run is canceled)
+        """
+        if not edgePairDict:
+            return 0, 0
+        if 'faces' not in graph.composed:  # Faces are composed already if the graph is restored from the cache
+            graph.composingFaces(feedback, feedbackDelta * 2 / 3)
+            if feedback.isCanceled():
+                return 0, 0
+        else:
+            feedback.setProgress(feedback.progress() + feedbackDelta * 2 / 3)
+        components = graph.composingComponents(feedback, feedbackDelta / 3)
+        fromVertices = graph.fromVertices
+        componentIds = {components[fromVertices[startId]] for startId in graph.faceStarts}
+        return len(graph.faceStarts), len(componentIds)
+
     @staticmethod
     def composingCircleModel(graph, model, edgePairDict, feedback, feedbackDelta):
         """
-        Composinng circle models of isolated subgraphs
-        :param model: Ordered model {inEdgeId: deque(sorted([outEdgeId]))}
+        Composing circle models of isolated subgraphs (kept for compatibility, it holds every circle in memory,
+        the pipeline uses composingFaceModel).
+        :param graph: CountRoutesGraph
+        :param model: Ordered model {inEdgeId: nextOutEdgeId}
         :param edgePairDict: {edgeId: oppositeEdgeId}
         :return: A stack list of stacks with circles of edges. [deque([deque([edgeId,..]),..]),..]
+            (incomplete if the run is canceled)
         """
-        if len(model) == 0:
+        CountRoutesMethods.composingFaceModel(graph, edgePairDict, feedback, feedbackDelta / 2)
+        if not edgePairDict or feedback.isCanceled():
             return []
-        ePassedSet = set()
-        eTotalSet = set(edgePairDict)
-        resCirclesList = []    # A list of circles. The item of the list is a separate part of the graph.
-        circles = deque()  # This is a stack of stacks with circles of edges
-        vTotalSet = set(range(graph.vertexCount()))
-        workStack = [[]]
-        # Selecting start edges from non-duplicate dictionary edgePairDict
-        while len(workStack[-1]) == 0:
-            vId = vTotalSet.pop()
-            workStack = deque([deque(
-                [
-                    outEdgeId for outEdgeId in graph.vertex(vId).outgoingEdges()
-                    if outEdgeId in edgePairDict
-                ]
-            )])
-        restEdgesSet = eTotalSet
-        lastFlashCount = len(eTotalSet)
-        flashRate = int(lastFlashCount / feedbackDelta)
-        while restEdgesSet and workStack:
-            startKey = workStack[-1].popleft()  # outEdgeId
-            if not any([eIds.count(startKey) > 0 for eIds in circles]):
-                isFound = False
-                circles.append(deque([startKey]))  # Appending a new set of circle with initial startKey
-                ePassedSet.add(startKey)
-                workStack.append(model[startKey].copy())
-                while not isFound:
-                    curKey = workStack[-1].popleft()  # outEdgeId
-                    if curKey == startKey:  # The circle is closed
-                        isFound = True
-                    else:
-                        circles[-1].append(curKey)
-                        ePassedSet.add(curKey)
-                        workStack.append(model[curKey].copy())
-            # Clearing the last empty stack
-            while workStack and not workStack[-1]:
-                workStack.pop()
-            restEdgesSet = eTotalSet.difference(ePassedSet)
-            if flashRate:
-                flashCount = int((lastFlashCount - len(restEdgesSet)) / flashRate)
-                if flashCount:
-                    lastFlashCount = len(restEdgesSet)
-                    feedback.setProgress(feedback.progress() + flashCount)
-            if not workStack or not restEdgesSet:
-                resCirclesList.append(circles)
-                if restEdgesSet:  # Separate parts of the graph exist
-                    restEdgesList = list(restEdgesSet)
-                    circles = deque()
-                    idx = 0
-                    workStack = [[]]
-                    # Selecting next start edges
-                    while len(workStack[-1]) == 0 and len(restEdgesSet) > idx:
-                        startList = [
-                                edgeId
-                                for edgeId in graph.vertex(
-                                    graph.edge(
-                                        # Taking any edge from separate parts of the graph
-                                        restEdgesList[idx]
-                                    ).toVertex()
-                                ).outgoingEdges()
-                            ]
-                        workStack[-1] = deque([
-                            edgeId for edgeId in startList
-                            if edgeId in edgePairDict
-                        ])
-                        idx += 1
-        return resCirclesList
+        components = graph.composingComponents()
+        circlesDict = dict()    # {componentId: deque([deque([edgeId,..]),..])} in order of discovery
+        meter = FeedbackMeter(feedback, feedbackDelta / 2, len(edgePairDict))
+        mask = meter.mask
+        passedCount = 0
+        for startId in graph.faceStarts:
+            circle = deque([startId])
+            eId = model[startId]
+            while eId != startId:
+                circle.append(eId)
+                eId = model[eId]
+                passedCount += 1
+                if not passedCount & mask and meter.step(passedCount):
+                    return list(circlesDict.values())
+            circlesDict.setdefault(components[graph.fromVertices[startId]], deque()).append(circle)
+        meter.finish()
+        return list(circlesDict.values())
 
     @staticmethod
-    def composingGraph(networkSource, crs, topologyTolerance):
-        # Building a graph based on a network layer
+    def composingGraph(networkSource, crs, topologyTolerance, feedback=None, featureIdField=-1):
+        """
+        Building a graph based on a network layer by QgsGraphBuilder.
+        Source feature ids of edges are kept in graph.featureIds by the second strategy of the director.
+        :param featureIdField: The index of a field of source feature ids (-1 if the layer is the source)
+        :return: CountRoutesGraph (of read features if the run is canceled)
+        """
         director = QgsVectorLayerDirector(networkSource, -1, "", "", "",
                                           QgsVectorLayerDirector.DirectionBoth)
         strategy = QgsNetworkDistanceStrategy()
         director.addStrategy(strategy)
+        director.addStrategy(FeatureIdStrategy(featureIdField))
         builder = QgsGraphBuilder(
             crs,
             topologyTolerance=topologyTolerance
         )
-        director.makeGraph(builder, [])
-        return builder.graph()
+        director.makeGraph(builder, [], feedback)  # The director stops reading features if the run is canceled
+        return CountRoutesGraph.fromQgsGraph(builder.graph(), feedback, featureIdStrategy=1)
+
+    @staticmethod
+    def composingNativeGraph(networkSource, topologyTolerance, feedback=None, feedbackDelta=0,
+                             featurePolylines=None):
+        """
+        Building a graph by streaming feature geometries of a network layer without QgsGraphBuilder.
+        Edge costs are not computed, endpoints are snapped by the grid spatial hash of CountRoutesGraph.
+        Source feature ids of edges are kept in graph.featureIds.
+        :param featurePolylines: Noded polylines [(featureId, [(x, y),..]),..] used instead of the layer features
+        :return: CountRoutesGraph (of read features if the run is canceled)
+        """
+        if featurePolylines is None:
+            featurePolylines = CountRoutesMethods.getFeaturePolylines(networkSource, feedback, feedbackDelta)
+        return CountRoutesGraph.fromFeaturePolylines(featurePolylines, topologyTolerance)
+
+    @staticmethod
+    def getFeaturePolylines(networkSource, feedback=None, feedbackDelta=0):
+        """
+        Streaming polylines of features of a network layer
+        :return: A generator of (featureId, [(x, y),..]) (stopped if the run is canceled)
+        """
+        request = QgsFeatureRequest().setNoAttributes()
+        meter = FeedbackMeter(feedback, feedbackDelta, networkSource.featureCount())
+        # Features are counted by a mask of 255, a feature has many segments
+        for idx, feature in enumerate(networkSource.getFeatures(request)):
+            if not idx & 0xFF and meter.step(idx):
+                return
+            for polyline in CountRoutesMethods.getPolylines(feature.geometry()):
+                yield feature.id(), polyline
+        meter.finish()
+
+    @staticmethod
+    def getNodedPolylines(networkSource, topologyTolerance, feedback, feedbackDelta):
+        """
+        Reading polylines of a network layer and adding vertices where lines cross or an end of a line
+        lies on another line, so unnoded crossings are joined by any graph builder
+        :return: ([(featureId, [(x, y),..]),..], the number of added junction points)
+        """
+        return nodePolylines(
+            CountRoutesMethods.getFeaturePolylines(networkSource, feedback, feedbackDelta / 3),
+            topologyTolerance,
+            feedback,
+            feedbackDelta - feedbackDelta / 3
+        )
+
+    @staticmethod
+    def getPolylineLayer(featurePolylines, crs):
+        """
+        Keeping noded polylines in a memory layer read by QgsVectorLayerDirector
+        :return: QgsVectorLayer with source feature ids in the first field 'source_id'
+        """
+        layer = QgsVectorLayer('LineString', 'noded', 'memory')
+        layer.setCrs(crs)
+        layer.dataProvider().addAttributes([QgsField('source_id', QVariant.LongLong)])
+        layer.updateFields()
+        features = []
+        for featureId, points in featurePolylines:
+            feature = QgsFeature(layer.fields())
+            feature.setGeometry(QgsGeometry.fromPolylineXY([QgsPointXY(x, y) for x, y in points]))
+            feature.setAttributes([featureId])
+            features.append(feature)
+        layer.dataProvider().addFeatures(features)
+        return layer
 
     @staticmethod
     def composingOrderModelFromGraph(graph, edgePairs, feedback, feedbackDelta):
         """
-        Composing orderModel with structure:
-        {inEdgeId: deque(sorted([outEdgeId]))}
-        where the list is sorted by clock wise order of outEdgeId according to inEdgeId
+        Composing orderModel as the flat successor array of the graph:
+        {inEdgeId: nextOutEdgeId}
+        where nextOutEdgeId is the first outgoing edge after inEdgeId in clock wise order
+        :param graph: CountRoutesGraph with composed twins
         :return: orderModel
         """
-        orderModel = dict()
-        lastFlashCount = 0
-        flashRate = int(graph.vertexCount() / feedbackDelta)
-        if graph.edgeCount() > 0:
-            for vId in range(graph.vertexCount()):
-                point = graph.vertex(vId).point()   # QgsPointXY
-                pointsDict = dict()
-                incomingEdges = [eId for eId in graph.vertex(vId).incomingEdges() if eId in edgePairs]
-                if len(incomingEdges) > 1:
-                    for inEdgeId in incomingEdges:
-                        nextPoint = graph.vertex(graph.edge(inEdgeId).fromVertex()).point()   # QgsPointXY
-                        # double (clockwise in degree, starting from north)
-                        pointsDict[inEdgeId] = point.azimuth(nextPoint)
-                    keyList = list(sorted(pointsDict.keys(), key=lambda it: pointsDict[it]))
-                    for idx, inEdgeId in enumerate(keyList):
-                        curList = [(idx + i) % len(keyList) for i in range(len(keyList))]
-                        orderModel[inEdgeId] = deque(
-                            [edgePairs[keyList[curList[i]]] for i in range(1, len(keyList))]
-                        )
-                elif len(incomingEdges) == 1:   # The end of a branch
-                    orderModel[incomingEdges[0]] = deque([edgePairs[incomingEdges[0]]])
-                if flashRate:
-                    flashCount = int((vId - lastFlashCount) / flashRate)
-                    if flashCount:
-                        lastFlashCount = vId
-                        feedback.setProgress(feedback.progress() + flashCount)
-        return orderModel
+        if 'successors' in graph.composed:
+            feedback.setProgress(feedback.progress() + feedbackDelta)
+            return graph.successors
+        return graph.composingSuccessors(feedback, feedbackDelta)
 
     @staticmethod
-    def getBottlenecksPoints(graph, edgePairs, circlesList, feedback, feedbackDelta, isBranches=False):
-        flashDelta = int(feedbackDelta / 3)
-        edges_full = deque([   # This is bottlenecks id edges (a pair of in- and out- orders)
-            eId for circles in circlesList for eIds in circles for eId in eIds
-            if eIds.count(edgePairs[eId]) > 0
-        ])
-        feedback.setProgress(feedback.progress() + flashDelta)
+    def getBottleneckEdges(graph, edgePairs, faces, feedback, feedbackDelta):
+        """
+        Getting bottlenecks as edges lying on the same circle as their opposite edges
+        :param faces: The face array of the graph {edgeId: faceId} composed by composingFaceModel or None
+        :return: A set of bottleneck edge ids (one edge id of each pair of opposite edges)
+        """
+        if faces is None or not len(faces):
+            return set()
+        twins = graph.twins
+        passed = bytearray(graph.edgeCount())   # Opposite edges of found bottlenecks
         edges = set()
-        while edges_full:
-            eId = edges_full.pop()
-            if edgePairs[eId] in edges_full:
-                edges_full.remove(edgePairs[eId])
-            edges.add(eId)
-        feedback.setProgress(feedback.progress() + flashDelta)
-        if not isBranches:
-            branches, branchVertices = CountRoutesMethods.getGraphBranches(graph, edgePairs)
-            edges = edges.difference(branches)
+        meter = FeedbackMeter(feedback, feedbackDelta, graph.edgeCount())
+        mask = meter.mask
+        for eId in range(graph.edgeCount()):
+            if not eId & mask and meter.step(eId):
+                return edges
+            oppositeId = twins[eId]
+            if oppositeId >= 0 and not passed[eId] and faces[eId] == faces[oppositeId]:
+                edges.add(eId)
+                passed[oppositeId] = 1
+        meter.finish()
+        return edges
+
+    @staticmethod
+    def getBottlenecksPoints(graph, edgePairs, faces, feedback, feedbackDelta, isBranches=False,
+                             isMergedBranches=False, isChained=False):
+        """
+        Getting bottlenecks by the circle model
+        :param faces: The face array of the graph {edgeId: faceId} composed by composingFaceModel or None
+        :param isMergedBranches: Blind pass branches are merged into polylines if isBranches is set
+        :param isChained: Consecutive bottleneck edges of the same source feature are merged into polylines
+        :return: A list of bottleneck end points [[QgsPointXY, QgsPointXY],..] (or polylines of chains)
+        """
+        flashDelta = int(feedbackDelta / 3)
+        edges = CountRoutesMethods.getBottleneckEdges(graph, edgePairs, faces, feedback, 2 * flashDelta)
+        chains = CountRoutesMethods.getBottleneckChains(
+            graph, edgePairs, edges, isBranches, isMergedBranches, isChained
+        )
         feedback.setProgress(feedback.progress() + flashDelta)
-        return [
-            [graph.vertex(graph.edge(eId).fromVertex()).point(),
-             graph.vertex(graph.edge(eId).toVertex()).point()] for eId in edges
-        ]
+        return [CountRoutesMethods.getChainPointsXY(graph, chain) for chain in chains]
+
+    @staticmethod
+    def getBridgeEdges(graph, edgePairs, feedback, feedbackDelta, processes=0, cutVertices=None):
+        """
+        Finding bridges of the undirected graph by the iterative (non-recursive) low-link search
+        :param graph: CountRoutesGraph with composed twins
+        :param edgePairs: {edgeId: oppositeEdgeId}
+        :param processes: The number of worker processes searching bridges in connected parts of the graph,
+            the search runs in the current process if it is less than 2
+        :param cutVertices: A dictionary filled with cut vertices found by the same low links
+            {vertexId: the number of parts its closure splits the connected part into}
+        :return: A set of bridge edge ids (one edge id of each pair of opposite edges)
+        """
+        if processes > 1:
+            return getBridgeEdgesParallel(graph, processes, feedback, feedbackDelta, cutVertices)
+        return set(searchBridges(
+            graph.toVertices,
+            graph.twins,
+            graph.outOffsets,
+            graph.outEdges,
+            range(graph.vertexCount()),
+            feedback=feedback,
+            feedbackDelta=feedbackDelta,
+            cutVertices=cutVertices
+        ))
+
+    getTwoEdgeCuts = staticmethod(getTwoEdgeCuts)
 
     @staticmethod
-    def getEdgePairDict(graph, feedback):
+    def getFacePolygons(graph, feedback, feedbackDelta):
+        """
+        Getting bounded faces (loops of the network like city blocks) one by one from the face iterator,
+        so polygons are streamed without holding all circles in memory (see CountRoutesGraph.iterBoundedFaces)
+        :param graph: CountRoutesGraph with composed twins
+        :return: A generator of (ring [QgsPointXY,..], area, perimeter, the number of bounding edges)
+        """
+        if 'successors' not in graph.composed:
+            graph.composingSuccessors()
+        for face, area, perimeter, edgeCount in graph.iterBoundedFaces(feedback, feedbackDelta):
+            ring = [QgsPointXY(*graph.point(graph.fromVertices[eId])) for eId in face]
+            ring.append(ring[0])
+            yield ring, area, perimeter, edgeCount
+
+    @staticmethod
+    def getBridgesPoints(graph, edgePairs, feedback, feedbackDelta, isBranches=False, processes=0,
+                         isMergedBranches=False, isChained=False):
+        """
+        Getting bottlenecks by the bridge search instead of the circle model
+        :return: The same list of bottleneck end points (or polylines) as getBottlenecksPoints returns
+        """
+        edges = CountRoutesMethods.getBridgeEdges(graph, edgePairs, feedback, feedbackDelta, processes)
+        chains = CountRoutesMethods.getBottleneckChains(
+            graph, edgePairs, edges, isBranches, isMergedBranches, isChained
+        )
+        return [CountRoutesMethods.getChainPointsXY(graph, chain) for chain in chains]
+
+    @staticmethod
+    def composingBridgeTree(graph, feedback, feedbackDelta):
+        """
+        Condensing 2-edge-connected parts of the graph into the bridge tree for route queries
+        :param graph: CountRoutesGraph
+        :return: BridgeTree
+        """
+        twinsDelta = 0
+        if 'twins' not in graph.composed:
+            twinsDelta = feedbackDelta / 4
+            graph.composingTwins(feedback, twinsDelta)
+            if feedback.isCanceled():
+                return BridgeTree(graph, [], False)
+        stageDelta = (feedbackDelta - twinsDelta) / 3
+        bridges = CountRoutesMethods.getBridgeEdges(graph, None, feedback, 2 * stageDelta)
+        if feedback.isCanceled():
+            return BridgeTree(graph, [], False)
+        return BridgeTree(graph, bridges, True, feedback, stageDelta)
+
+    @staticmethod
+    def getTiledBottlenecksPoints(networkSource, tileSize, topologyTolerance, feedback, feedbackDelta,
+                                  isBranches=False):
+        """
+        Getting bottlenecks by the out-of-core bridge search over tiles of the network layer.
+        Features are streamed into memory-mapped tile files without building the whole graph.
+        The progress advances by read features in the first half of the delta and by searched tiles in the second.
+        :return: The same list of bottleneck end points as getBottlenecksPoints returns
+        """
+        request = QgsFeatureRequest().setNoAttributes()
+        meter = FeedbackMeter(feedback, feedbackDelta / 2, networkSource.featureCount())
+        with TiledBridgeSearch(tileSize, topologyTolerance) as tiles:
+            # Features are counted by a mask of 255 like getFeaturePolylines does, a feature has many segments
+            for idx, feature in enumerate(networkSource.getFeatures(request)):
+                if not idx & 0xFF and meter.step(idx):
+                    return []
+                tiles.addPolylines(CountRoutesMethods.getPolylines(feature.geometry()))
+            meter.finish()
+            return [
+                [QgsPointXY(x, y) for x, y in endPoints]
+                for endPoints in tiles.getBottlenecksPoints(isBranches, feedback, feedbackDelta / 2)
+            ]
+
+    @staticmethod
+    def getEdgePairDict(graph, feedback, feedbackDelta=0):
+        """
+        Pairing opposite edges without duplicates by the twin array of the graph
+        :param graph: CountRoutesGraph
+        :return: {edgeId: oppositeEdgeId} (incomplete if the run is canceled)
+        """
         if graph.edgeCount() == 0:
             return 0
+        if 'twins' in graph.composed:
+            twins = graph.twins
+        else:
+            twins = graph.composingTwins(feedback, feedbackDelta * 3 / 4)
+            if feedback.isCanceled():
+                return dict()
+        meter = FeedbackMeter(feedback, feedbackDelta / 4, len(twins))
+        mask = meter.mask
         edgePairs = dict()
-        curDict = dict()
-        # Finding duplicate edges in the graph with the same vertices
-        for vId in range(graph.vertexCount()):
-            curInES = set(graph.vertex(vId).incomingEdges())
-            sngES = set()
-            while curInES:
-                curEId = curInES.pop()
-                sngES.add(curEId)
-                dblE = set(
-                    filter(
-                        lambda eId: (graph.edge(eId).toVertex() == graph.edge(curEId).toVertex() and
-                                     graph.edge(eId).fromVertex() == graph.edge(curEId).fromVertex()),
-                        curInES
-                    )
-                )
-                curInES = curInES.difference(dblE)
-            curDict[vId] = sngES
-        # Composing edge pairs
-        for vId in curDict:
-            for eId in curDict[vId]:
-                fromVId = graph.edge(eId).fromVertex()
-                oppositeL = list(
-                    filter(
-                        lambda e: graph.edge(e).fromVertex() == vId,
-                        curDict[fromVId]
-                    )
-                )
-                if oppositeL:
-                    edgePairs[eId] = oppositeL[0]
+        for eId, oppositeId in enumerate(twins):
+            if not eId & mask and meter.step(eId):
+                break
+            if oppositeId >= 0:
+                edgePairs[eId] = oppositeId
+        meter.finish()
         return edgePairs
 
     @staticmethod
-    def getGraphBranches(graph, edgePairs):
-        leaves = deque(
-            filter(
-                lambda vertexId: len(
-                    [eId for eId in graph.vertex(vertexId).outgoingEdges() if eId in edgePairs]
-                ) == 1,
-                range(graph.vertexCount())  # Vertex Id's
-            )
-        )
-        branches = set()
-        branchVertices = set()
-        while leaves:
-            vId = leaves.pop()
-            branchVertices.add(vId)
-            curEdges = [
-                it for it in graph.vertex(vId).outgoingEdges()
-                if it not in branches and it in edgePairs
-            ]
-            if curEdges:
-                singleEdgeId = curEdges[0]
-                branches = branches.union({singleEdgeId, edgePairs[singleEdgeId]})
-                nextVertexId = graph.edge(singleEdgeId).toVertex()
-                if nextVertexId not in branchVertices:
-                    edges = [
-                        eId for eId in graph.vertex(nextVertexId).outgoingEdges()
-                        if eId not in branches and eId in edgePairs
-                    ]
-                    if len(edges) == 1:
-                        leaves.append(nextVertexId)
-        return branches, branchVertices
+    def getGraphCacheKey(layer, tolerance, builder):
+        """
+        Composing the cache key of the graph by the fingerprint of the layer source:
+        the source, the subset filter, the feature count, the extent and the file size and time,
+        so any change of the source data gives a new key.
+        :param layer: QgsVectorLayer or None
+        :return: A key string or None if the layer can not be fingerprinted (memory or edited layers)
+        """
+        if layer is None or layer.providerType() == 'memory' or layer.isModified():
+            return None
+        key = [
+            layer.providerType(),
+            layer.source(),
+            layer.subsetString(),
+            str(layer.featureCount()),
+            layer.extent().toString(12),
+            repr(tolerance),
+            str(builder),
+            'featureIds',  # Older entries of the QGIS builder without source feature ids are not loaded
+        ]
+        path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get('path')
+        if path and os.path.isfile(path):
+            stat = os.stat(path)
+            key.extend((str(stat.st_size), str(stat.st_mtime_ns)))
+        return '|'.join(key)
+
+    @staticmethod
+    def getPolylines(geometry):
+        """
+        :param geometry: QgsGeometry of a line or a multi-line
+        :return: A list of polylines [[(x, y),..],..]
+        """
+        if geometry.isNull() or geometry.isEmpty():
+            return []
+        if geometry.isMultipart():
+            lines = geometry.asMultiPolyline()
+        else:
+            lines = [geometry.asPolyline()]
+        return [[(point.x(), point.y()) for point in line] for line in lines]
+
+    @staticmethod
+    def getEdgePointsXY(graph, eId):
+        """
+        :return: [QgsPointXY, QgsPointXY] of the edge end points
+        """
+        return [QgsPointXY(x, y) for x, y in graph.edgePoints(eId)]
+
+    # Passes over bottlenecks without QGIS (CountRoutesBottlenecks)
+    getGraphBranches = staticmethod(getGraphBranches)
+
+    getCoreCutVertices = staticmethod(getCoreCutVertices)
 
+    getEdgeChains = staticmethod(getEdgeChains)
+
+    @staticmethod
+    def getBranchPolylines(graph, branches):
+        """
+        Merging branch edges into polylines chained through vertices joining exactly two edges
+        :param branches: A set of branch edge ids with their opposite edges
+        :return: [[QgsPointXY,..],..]
+        """
+        return [
+            CountRoutesMethods.getChainPointsXY(graph, chain)
+            for chain in CountRoutesMethods.getEdgeChains(graph, branches)
+        ]
+
+    getBottleneckChains = staticmethod(getBottleneckChains)
+
+    getChainImpacts = staticmethod(getChainImpacts)
+
+    @staticmethod
+    def getChainPointsXY(graph, chain):
+        """
+        :return: [QgsPointXY,..] of the chain vertices
+        """
+        points = [QgsPointXY(*graph.point(graph.fromVertices[chain[0]]))]
+        points.extend(QgsPointXY(*graph.point(graph.toVertices[eId])) for eId in chain)
+        return points
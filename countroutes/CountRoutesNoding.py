@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    CountRoutesNoding.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from array import array
+from .CountRoutesGraph import FeedbackMeter
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def getSegmentJunctions(px1, py1, px2, py2, qx1, qy1, qx2, qy2, sqTolerance):
+    """
+    Finding points where two segments meet without a common vertex:
+    an end of one segment lying on the other one (a T-junction or an overlap)
+    or a crossing of the interiors of both segments.
+    Ends closer than the tolerance to an end of the other segment are already joined by the graph builder.
+    :return: A list of junctions [(x, y, tP, tQ),..] where tP and tQ are positions of the split point
+        along the segments (None if the segment is not split)
+    """
+    junctions = []
+    isTouched = False
+    rx = px2 - px1
+    ry = py2 - py1
+    sx = qx2 - qx1
+    sy = qy2 - qy1
+    sqP = rx * rx + ry * ry
+    sqQ = sx * sx + sy * sy
+    # Ends of the segment P on the segment Q
+    for x, y in ((px1, py1), (px2, py2)):
+        t = ((x - qx1) * sx + (y - qy1) * sy) / sqQ if sqQ else 0
+        t = min(max(t, 0), 1)
+        if (qx1 + t * sx - x) ** 2 + (qy1 + t * sy - y) ** 2 <= sqTolerance:
+            isTouched = True
+            if (x - qx1) ** 2 + (y - qy1) ** 2 > sqTolerance and (x - qx2) ** 2 + (y - qy2) ** 2 > sqTolerance:
+                junctions.append((x, y, None, t))
+    # Ends of the segment Q on the segment P
+    for x, y in ((qx1, qy1), (qx2, qy2)):
+        t = ((x - px1) * rx + (y - py1) * ry) / sqP if sqP else 0
+        t = min(max(t, 0), 1)
+        if (px1 + t * rx - x) ** 2 + (py1 + t * ry - y) ** 2 <= sqTolerance:
+            isTouched = True
+            if (x - px1) ** 2 + (y - py1) ** 2 > sqTolerance and (x - px2) ** 2 + (y - py2) ** 2 > sqTolerance:
+                junctions.append((x, y, t, None))
+    if isTouched:
+        return junctions  # Straight segments meeting at an end have no other common point
+    # A crossing of interiors
+    denominator = rx * sy - ry * sx
+    if denominator:
+        t = ((qx1 - px1) * sy - (qy1 - py1) * sx) / denominator
+        u = ((qx1 - px1) * ry - (qy1 - py1) * rx) / denominator
+        if 0 < t < 1 and 0 < u < 1:
+            junctions.append((px1 + t * rx, py1 + t * ry, t, u))
+    return junctions
+
+
+def nodePolylines(featurePolylines, tolerance, feedback=None, feedbackDelta=0):
+    """
+    Noding polylines before the graph is built: a vertex is added to both lines where they cross
+    and to a line where an end or a vertex of another line lies on it, so the graph builder joins them.
+    Segments are put in a grid spatial hash with the cell size of the mean segment extent,
+    only segments of the same cell are tested. A junction is recorded by the cell of its point,
+    so it is found once although the pair of segments shares many cells.
+    :param featurePolylines: An iterable of (featureId, [(x, y),..])
+    :param tolerance: The topology tolerance (ends closer than it are joined without noding),
+        a billionth of the cell size is used if it is 0
+    :return: ([(featureId, [(x, y),..]),..], the number of added junction points)
+        (polylines are not noded if the run is canceled)
+    """
+    polylines = []  # [(featureId, [(x, y),..]),..]
+    coords = array('d')  # [x1, y1, x2, y2,..] of segments in order of polylines
+    extentSum = 0
+    for featureId, points in featurePolylines:
+        polylines.append((featureId, points))
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            coords.extend((x1, y1, x2, y2))
+            extentSum += max(abs(x2 - x1), abs(y2 - y1))
+    segmentCount = len(coords) // 4
+    if segmentCount < 2 or not extentSum:
+        return polylines, 0
+    cellSize = max(extentSum / segmentCount, 2 * tolerance)
+    snapDistance = tolerance or cellSize * 1e-9
+    sqTolerance = snapDistance * snapDistance
+    meter = FeedbackMeter(feedback, feedbackDelta / 2, segmentCount)
+    mask = meter.mask
+    cells = dict()  # {(cellX, cellY): [segmentId,..]}
+    boxes = array('d')  # [minX, minY, maxX, maxY,..] of segments extended by the tolerance
+    for sId in range(segmentCount):
+        if not sId & mask and meter.step(sId):
+            return polylines, 0
+        x1, y1, x2, y2 = coords[4 * sId:4 * sId + 4]
+        minX = min(x1, x2) - snapDistance
+        minY = min(y1, y2) - snapDistance
+        maxX = max(x1, x2) + snapDistance
+        maxY = max(y1, y2) + snapDistance
+        boxes.extend((minX, minY, maxX, maxY))
+        if x1 == x2 and y1 == y2:
+            continue
+        # Cells along the segment column by column, a long diagonal segment does not fill its whole box
+        lowX = min(x1, x2)
+        highX = max(x1, x2)
+        slope = (y2 - y1) / (x2 - x1) if x1 != x2 else 0
+        for cellX in range(int(minX // cellSize), int(maxX // cellSize) + 1):
+            if x1 != x2:
+                columnY1 = y1 + (min(max(cellX * cellSize - snapDistance, lowX), highX) - x1) * slope
+                columnY2 = y1 + (max(min((cellX + 1) * cellSize + snapDistance, highX), lowX) - x1) * slope
+                columnMinY = min(columnY1, columnY2) - snapDistance
+                columnMaxY = max(columnY1, columnY2) + snapDistance
+            else:
+                columnMinY = minY
+                columnMaxY = maxY
+            for cellY in range(int(columnMinY // cellSize), int(columnMaxY // cellSize) + 1):
+                cells.setdefault((cellX, cellY), []).append(sId)
+    meter.finish()
+    meter = FeedbackMeter(feedback, feedbackDelta - feedbackDelta / 2, len(cells))
+    splits = dict()  # {segmentId: {(x, y): position along the segment}}
+    tests = 0
+    for cellIdx, ((cellX, cellY), sIds) in enumerate(cells.items()):
+        for i in range(len(sIds) - 1):
+            pId = sIds[i]
+            pMinX, pMinY, pMaxX, pMaxY = boxes[4 * pId:4 * pId + 4]
+            px1, py1, px2, py2 = coords[4 * pId:4 * pId + 4]
+            for qId in sIds[i + 1:]:
+                tests += 1
+                if not tests & mask and meter.step(cellIdx):
+                    return polylines, 0
+                qMinX, qMinY, qMaxX, qMaxY = boxes[4 * qId:4 * qId + 4]
+                if qMinX > pMaxX or qMaxX < pMinX or qMinY > pMaxY or qMaxY < pMinY:
+                    continue
+                junctions = getSegmentJunctions(px1, py1, px2, py2, *coords[4 * qId:4 * qId + 4], sqTolerance)
+                for x, y, tP, tQ in junctions:
+                    if int(x // cellSize) != cellX or int(y // cellSize) != cellY:
+                        continue  # The junction is recorded in the cell of its point
+                    if tP is not None:
+                        splits.setdefault(pId, dict())[(x, y)] = tP
+                    if tQ is not None:
+                        splits.setdefault(qId, dict())[(x, y)] = tQ
+    meter.finish()
+    if not splits:
+        return polylines, 0
+    junctionPoints = set()
+    nodedPolylines = []
+    sId = 0
+    for featureId, points in polylines:
+        nodedPoints = list(points[:1])
+        for point in points[1:]:
+            segmentSplits = splits.get(sId)
+            if segmentSplits:
+                junctionPoints.update(segmentSplits)
+                nodedPoints.extend(sorted(segmentSplits, key=segmentSplits.get))
+            nodedPoints.append(point)
+            sId += 1
+        nodedPolylines.append((featureId, nodedPoints))
+    return nodedPolylines, len(junctionPoints)
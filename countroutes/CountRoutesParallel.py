@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    CountRoutesParallel.py
+    -------------------
+
+    Date                 : September 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import multiprocessing
+from multiprocessing import shared_memory, TimeoutError
+from array import array
+from .CountRoutesGraph import searchBridges
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+SHARED_ARRAYS = ('toVertices', 'twins', 'outOffsets', 'outEdges')
+workerState = dict()  # Shared arrays and search buffers attached once in each worker process
+
+
+def getProcessContext():
+    """
+    Getting the spawn context of worker processes. Inside QGIS sys.executable is the QGIS application,
+    so the Python interpreter of the same installation is set to start workers.
+    """
+    context = multiprocessing.get_context('spawn')
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        for name in ('python3', 'python', 'python3.exe', 'python.exe'):
+            for folder in (sys.exec_prefix, os.path.join(sys.exec_prefix, 'bin')):
+                executable = os.path.join(folder, name)
+                if os.path.isfile(executable):
+                    context.set_executable(executable)
+                    return context
+    return context
+
+
+def attachSharedArrays(names, lengths, isCutVertices=False):
+    workerState['isCutVertices'] = isCutVertices
+    for key in SHARED_ARRAYS:
+        memory = shared_memory.SharedMemory(name=names[key])
+        workerState[key] = (memory, memory.buf[:lengths[key] * 8].cast('q'))
+    vCount = lengths['outOffsets'] - 1
+    workerState['order'] = array('q', [0]) * vCount
+    workerState['low'] = array('q', [0]) * vCount
+
+
+def searchBridgesWorker(roots):
+    """
+    :return: (Bridge edge ids, {cutVertexId: the number of parts} or None)
+    """
+    cutVertices = dict() if workerState['isCutVertices'] else None
+    bridges = searchBridges(
+        *[workerState[key][1] for key in SHARED_ARRAYS],
+        roots,
+        order=workerState['order'],
+        low=workerState['low'],
+        cutVertices=cutVertices
+    )
+    return bridges, cutVertices
+
+
+def getComponentChunks(graph, chunkCount):
+    """
+    Splitting connected parts of the graph into chunks of similar size (the largest parts go first)
+    :return: [[rootVertexId,..],..]
+    """
+    components = graph.composingComponents()
+    roots = dict()  # {componentId: [rootVertexId, the number of edges]}
+    for vId, componentId in enumerate(components):
+        degree = graph.outOffsets[vId + 1] - graph.outOffsets[vId]
+        if componentId not in roots:
+            roots[componentId] = [vId, degree]
+        else:
+            roots[componentId][1] += degree
+    chunks = [[] for _ in range(chunkCount)]
+    sizes = [0] * chunkCount
+    for rootId, size in sorted(roots.values(), key=lambda it: it[1], reverse=True):
+        if size == 0:
+            continue
+        idx = sizes.index(min(sizes))
+        chunks[idx].append(rootId)
+        sizes[idx] += size
+    return [chunk for chunk in chunks if chunk]
+
+
+def getBridgeEdgesParallel(graph, processes, feedback, feedbackDelta, cutVertices=None, pollSeconds=0.2):
+    """
+    Finding bridges in connected parts of the graph on a pool of worker processes.
+    Graph arrays are copied once into shared memory, workers read them without pickled copies.
+    A connected part is searched by a single worker, so a network of one part is searched
+    in the current process without paying the start of the pool.
+    :param graph: CountRoutesGraph with composed twins
+    :param cutVertices: A dictionary filled with cut vertices like searchBridges does
+    :param pollSeconds: The interval of polling the cancellation while workers search their chunks
+    :return: A set of bridge edge ids (one edge id of each pair of opposite edges)
+    """
+    chunks = getComponentChunks(graph, processes * 4)
+    if len(chunks) < 2:
+        return set(searchBridges(
+            graph.toVertices,
+            graph.twins,
+            graph.outOffsets,
+            graph.outEdges,
+            range(graph.vertexCount()),
+            feedback=feedback,
+            feedbackDelta=feedbackDelta,
+            cutVertices=cutVertices
+        ))
+    memories = []
+    try:
+        names = dict()
+        lengths = dict()
+        for key in SHARED_ARRAYS:
+            values = getattr(graph, key)
+            memory = shared_memory.SharedMemory(create=True, size=max(len(values), 1) * 8)
+            memories.append(memory)
+            memory.buf[:len(values) * 8] = memoryview(values).cast('B')
+            names[key] = memory.name
+            lengths[key] = len(values)
+        bridges = set()
+        context = getProcessContext()
+        initArgs = (names, lengths, cutVertices is not None)
+        with context.Pool(min(processes, len(chunks)), attachSharedArrays, initArgs) as pool:  # Terminated on exit
+            iterator = pool.imap_unordered(searchBridgesWorker, chunks)
+            for _ in range(len(chunks)):
+                while not feedback.isCanceled():
+                    try:
+                        chunkBridges, chunkCutVertices = iterator.next(pollSeconds)
+                        break
+                    except TimeoutError:
+                        continue
+                else:
+                    break
+                bridges.update(chunkBridges)
+                if chunkCutVertices:
+                    cutVertices.update(chunkCutVertices)
+                feedback.setProgress(feedback.progress() + feedbackDelta / len(chunks))
+        return bridges
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
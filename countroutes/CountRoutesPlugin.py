@@ -26,6 +26,8 @@ from qgis import processing
 from .CountRoutesMethods import CountRoutesMethods
 from .CountRoutesProvider import CountRoutesProvider
 from .BottleneckQuestAlgorithm import BottleneckQuestAlgorithm
+from .RouteBottlenecksAlgorithm import RouteBottlenecksAlgorithm
+from .BatchBottlenecksAlgorithm import BatchBottlenecksAlgorithm
 import os.path
 
 __license__ = 'GPL version 3'
@@ -68,6 +70,8 @@ class CountRoutesPlugin:
         self.first_start = None
         self.provider = None
         self.alg = None
+        self.batchAlg = None
+        self.batchDialog = None
 
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
@@ -161,6 +165,12 @@ class CountRoutesPlugin:
             text=self.tr(u'Bottleneck Quest'),
             callback=self.run,
             parent=self.iface.mainWindow())
+        self.add_action(
+            bqIconPath,
+            text=self.tr(u'Bottleneck Quest Batch'),
+            callback=self.runBatch,
+            add_to_toolbar=False,
+            parent=self.iface.mainWindow())
         # Will be set False in run()
         self.first_start = True
         # Init processing
@@ -168,7 +178,7 @@ class CountRoutesPlugin:
             providerIconPath, 
             bqIconPath, 
             CountRoutesMethods(), 
-            BottleneckQuestAlgorithm
+            [BottleneckQuestAlgorithm, RouteBottlenecksAlgorithm, BatchBottlenecksAlgorithm]
         )
         QgsApplication.instance().processingRegistry().addProvider(self.provider)
 
@@ -194,3 +204,14 @@ class CountRoutesPlugin:
         except:
             pass
 
+    def runBatch(self):
+        """Opening the batch algorithm of many network layers in a non-modal dialog (QGIS is not blocked)"""
+        if self.batchAlg is None:
+            self.batchAlg = BatchBottlenecksAlgorithm()
+            self.batchAlg.setProvider(self.provider)
+        try:
+            # The reference keeps the dialog open after the method returns
+            self.batchDialog = processing.createAlgorithmDialog(self.batchAlg)
+            self.batchDialog.show()
+        except:
+            pass
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    CountRoutesProfiler.py
+    -------------------
+
+    Date                 : September 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def getWindowsMemoryCounters():
+    """
+    :return: PROCESS_MEMORY_COUNTERS of the current process or None if they are not available
+    """
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters
+    except (ImportError, AttributeError, OSError):
+        pass
+    return None
+
+
+def getPeakMemory():
+    """
+    Getting the peak resident memory of the process from the OS by a single system call.
+    It is the high-water mark of the whole process lifetime, not of a stage.
+    :return: Bytes or None if it is not available
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # Kilobytes on Linux
+    if sys.platform == 'win32':
+        counters = getWindowsMemoryCounters()
+        if counters is not None:
+            return counters.PeakWorkingSetSize
+    return None
+
+
+def getCurrentMemory():
+    """
+    Getting the current resident memory of the process
+    :return: Bytes or None if it is not available (macOS)
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/statm') as file:
+                return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+    if sys.platform == 'win32':
+        counters = getWindowsMemoryCounters()
+        if counters is not None:
+            return counters.WorkingSetSize
+    return None
+
+
+class StageProfiler:
+    """
+    Instrumentation of pipeline stages: wall time, CPU time and memory of each stage and element counts.
+    Each stage costs a few clock reads and two memory system calls, so the profiler is always on.
+    Measures of a stage are deltas from a baseline taken at its start:
+    the CPU time is of the thread running the stage (other threads and worker processes are not included),
+    the traced peak is the peak of Python allocations above the start when tracemalloc is tracing,
+    the resident growth is the change of the resident memory of the process from the start to the end.
+    The process peak is the high-water mark of the whole process lifetime and is reported as such.
+    """
+
+    fields = ('stage', 'wallSeconds', 'cpuSeconds', 'tracedPeakBytes', 'residentGrowthBytes', 'processPeakBytes',
+              'counts')
+
+    def __init__(self, feedback=None, algName=''):
+        self.feedback = feedback
+        self.algName = algName
+        self.records = []  # [{field: value},..] in order of stages
+        self.tracedPeaks = []  # Traced peaks of open (nested) stages, a nested stage resets the peak of tracemalloc
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measuring a stage, element counts are set by the caller in the yielded dictionary:
+            with profiler.stage('Circle model') as counts:
+                counts['faces'] = ...
+        """
+        counts = dict()
+        isTraced = tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak')  # reset_peak of Python 3.9
+        startTraced = None
+        if isTraced:
+            startTraced, peakTraced = tracemalloc.get_traced_memory()
+            self.tracedPeaks = [max(peak, peakTraced) for peak in self.tracedPeaks]
+            tracemalloc.reset_peak()
+        self.tracedPeaks.append(startTraced or 0)
+        startResident = getCurrentMemory()
+        startWall = time.perf_counter()
+        startCpu = time.thread_time()
+        try:
+            yield counts
+        finally:
+            wallSeconds = time.perf_counter() - startWall
+            cpuSeconds = time.thread_time() - startCpu
+            tracedPeak = self.tracedPeaks.pop()
+            if isTraced and tracemalloc.is_tracing():
+                tracedPeak = max(tracedPeak, tracemalloc.get_traced_memory()[1])
+                self.tracedPeaks = [max(peak, tracedPeak) for peak in self.tracedPeaks]
+            resident = getCurrentMemory()
+            record = {
+                'stage': name,
+                'wallSeconds': wallSeconds,
+                'cpuSeconds': cpuSeconds,
+                'tracedPeakBytes': tracedPeak - startTraced if startTraced is not None else None,
+                'residentGrowthBytes': resident - startResident if None not in (resident, startResident) else None,
+                'processPeakBytes': getPeakMemory(),
+                'counts': counts,
+            }
+            self.records.append(record)
+            if self.feedback is not None:
+                self.feedback.pushInfo(f"[{self.algName}] {self.formatRecord(record)}")
+
+    @staticmethod
+    def formatRecord(record):
+        info = f"Stage '{record['stage']}': {record['wallSeconds']:.3f} s, CPU {record['cpuSeconds']:.3f} s"
+        if record['tracedPeakBytes'] is not None:
+            info += f", traced peak {record['tracedPeakBytes'] / 1048576:.1f} Mb"
+        if record['residentGrowthBytes'] is not None:
+            info += f", memory growth {record['residentGrowthBytes'] / 1048576:+.1f} Mb"
+        if record['processPeakBytes'] is not None:
+            info += f", process peak {record['processPeakBytes'] / 1048576:.1f} Mb"
+        if record['counts']:
+            info += ', ' + ', '.join(f'{key} = {value}' for key, value in record['counts'].items())
+        return info
+
+    def writeReport(self, path):
+        """
+        Writing records to a CSV file if the path ends with .csv or to a JSON file otherwise
+        """
+        if path.lower().endswith('.csv'):
+            countKeys = []
+            for record in self.records:
+                countKeys.extend(key for key in record['counts'] if key not in countKeys)
+            with open(path, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(self.fields[:-1] + tuple(countKeys))
+                for record in self.records:
+                    writer.writerow(
+                        [record[field] for field in self.fields[:-1]] +
+                        [record['counts'].get(key, '') for key in countKeys]
+                    )
+        else:
+            with open(path, 'w') as file:
+                json.dump({'stages': self.records}, file, indent=1)
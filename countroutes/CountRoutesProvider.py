@@ -18,8 +18,11 @@
  ***************************************************************************/
 """
 
-from qgis.core import QgsProcessingProvider
+from qgis.core import QgsProcessingProvider, QgsFeatureRequest, QgsApplication, QgsSettings
 from qgis.PyQt.QtGui import QIcon
+from .BottleneckIndex import BottleneckIndex
+from .CountRoutesCache import GraphCache, GraphMemoryCache
+import os
 
 __license__ = 'GPL version 3'
 __copyright__ = 'Copyright 2024, Pavel Minin'
@@ -28,12 +31,17 @@ __email__ = 'mininpa@gmail.com'
 
 class CountRoutesProvider(QgsProcessingProvider):
 
-    def __init__(self, providerIconPath, algIconPath, methods, alg):
+    def __init__(self, providerIconPath, algIconPath, methods, algs):
         QgsProcessingProvider.__init__(self)
         self.methods = methods
         self.iconPath = providerIconPath
         self.algIconPath = algIconPath
-        self.alg = alg
+        self.algs = algs  # Algorithm classes
+        self.bottleneckIndexes = dict()  # {(layerId, tolerance): BottleneckIndex}
+        self.indexConnections = dict()  # {(layerId, tolerance): [(signal, slot),..]}
+        self.graphCache = None
+        self.sessionCache = None
+        self.sessionConnections = dict()  # {layerId: [(signal, slot),..]}
 
     def id(self):
         return 'countroutes'
@@ -47,11 +55,120 @@ class CountRoutesProvider(QgsProcessingProvider):
     def svgIconPath(self):
         return self.iconPath
 
+    def unload(self):
+        for key in list(self.bottleneckIndexes):
+            self.dropBottleneckIndex(key)
+        for layerId in list(self.sessionConnections):
+            self.dropSessionGraphs(layerId)
+
+    def getGraphCache(self):
+        """
+        Getting the on-disk graph cache in the QGIS profile folder.
+        The size budget is set by the 'countroutes/cacheSizeMb' setting (2048 Mb by default).
+        :return: GraphCache
+        """
+        if self.graphCache is None:
+            maxBytes = QgsSettings().value('countroutes/cacheSizeMb', 2048, type=int) * 1024 * 1024
+            folder = os.path.join(QgsApplication.qgisSettingsDirPath(), 'countroutes', 'graphs')
+            self.graphCache = GraphCache(folder, maxBytes)
+        return self.graphCache
+
+    def getSessionGraph(self, layer, tolerance, builder):
+        """
+        Getting the graph of the layer with its composed stages kept from previous runs in the session
+        :return: CountRoutesGraph or None
+        """
+        if self.sessionCache is None:
+            return None
+        return self.sessionCache.get((layer.id(), tolerance, builder))
+
+    def putSessionGraph(self, layer, tolerance, builder, graph):
+        """
+        Keeping the graph of the layer in memory until the layer data is changed.
+        The memory budget is set by the 'countroutes/sessionCacheMb' setting (512 Mb by default).
+        """
+        if self.sessionCache is None:
+            maxBytes = QgsSettings().value('countroutes/sessionCacheMb', 512, type=int) * 1024 * 1024
+            self.sessionCache = GraphMemoryCache(maxBytes)
+        layerId = layer.id()
+        if layerId not in self.sessionConnections:
+            dropGraphs = lambda *args: self.dropSessionGraphs(layerId)
+            connections = [
+                (signal, dropGraphs) for signal in (
+                    layer.featureAdded,
+                    layer.featureDeleted,
+                    layer.geometryChanged,
+                    layer.dataChanged,
+                    layer.subsetStringChanged,
+                    layer.willBeDeleted,
+                )
+            ]
+            for signal, slot in connections:
+                signal.connect(slot)
+            self.sessionConnections[layerId] = connections
+        self.sessionCache.put((layerId, tolerance, builder), graph)
+
+    def dropSessionGraphs(self, layerId):
+        for signal, slot in self.sessionConnections.pop(layerId, []):
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass
+        if self.sessionCache is not None:
+            self.sessionCache.dropLayer(layerId)
+
+    def getBottleneckIndex(self, layer, tolerance):
+        """
+        Getting the persistent bottleneck index of the layer.
+        The index is built once and then updated by added, deleted and changed features of the layer.
+        :param layer: QgsVectorLayer
+        :return: BottleneckIndex
+        """
+        key = (layer.id(), tolerance)
+        if key not in self.bottleneckIndexes:
+            index = BottleneckIndex(tolerance)
+            request = QgsFeatureRequest().setNoAttributes()
+            for feature in layer.getFeatures(request):
+                index.addFeature(feature.id(), self.methods.getPolylines(feature.geometry()))
+            self.bottleneckIndexes[key] = index
+            self.connectBottleneckIndex(layer, key, index)
+        return self.bottleneckIndexes[key]
+
+    def connectBottleneckIndex(self, layer, key, index):
+        getPolylines = self.methods.getPolylines
+        connections = [
+            (layer.featureAdded,
+             lambda fid: index.addFeature(fid, getPolylines(layer.getFeature(fid).geometry()))),
+            (layer.featureDeleted, index.deleteFeature),
+            (layer.geometryChanged,
+             lambda fid, geometry: index.addFeature(fid, getPolylines(geometry))),
+            (layer.committedFeaturesAdded,
+             lambda layerId, features: index.commitFeatures(
+                 {feature.id(): getPolylines(feature.geometry()) for feature in features}
+             )),
+            # Data reloaded or changed outside of the edit session, edits are followed by the signals above
+            (layer.dataChanged, lambda: None if layer.isEditable() else self.dropBottleneckIndex(key)),
+            (layer.subsetStringChanged, lambda: self.dropBottleneckIndex(key)),
+            (layer.willBeDeleted, lambda: self.dropBottleneckIndex(key)),
+        ]
+        for signal, slot in connections:
+            signal.connect(slot)
+        self.indexConnections[key] = connections
+
+    def dropBottleneckIndex(self, key):
+        for signal, slot in self.indexConnections.pop(key, []):
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass
+        self.bottleneckIndexes.pop(key, None)
+
     def loadAlgorithms(self):
         try:
-            alg = self.alg()
-            alg.setProvider(self)
-            self.addAlgorithm(alg)
+            for algClass in self.algs:
+                alg = algClass()
+                alg.setProvider(self)
+                self.addAlgorithm(alg)
         except Exception as e:
             print("Error. Unable to load the algorithm:", e)
             raise e
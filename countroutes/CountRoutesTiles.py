@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    CountRoutesTiles.py
+    -------------------
+
+    Date                 : September 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import mmap
+import shutil
+import tempfile
+from array import array
+from contextlib import contextmanager
+from .CountRoutesGraph import CountRoutesGraph, searchBridges
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+class SpilledArray:
+    """
+    An append-only array of doubles flushed to a file by blocks and read back by a memory map
+    """
+
+    def __init__(self, path, blockSize):
+        self.path = path
+        self.blockSize = blockSize
+        self.block = array('d')
+        self.flushedCount = 0
+
+    def __len__(self):
+        return self.flushedCount + len(self.block)
+
+    def extend(self, values):
+        self.block.extend(values)
+        if len(self.block) >= self.blockSize:
+            self.flush()
+
+    def flush(self):
+        if self.block:
+            with open(self.path, 'ab') as file:
+                self.block.tofile(file)
+            self.flushedCount += len(self.block)
+            self.block = array('d')
+
+    @contextmanager
+    def view(self):
+        """
+        :return: A memoryview of all values (the file is mapped while the view is used)
+        """
+        self.flush()
+        if not self.flushedCount:
+            yield memoryview(array('d'))
+            return
+        with open(self.path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            values = memoryview(mapped).cast('d')
+            try:
+                yield values
+            finally:
+                values.release()
+
+
+class TiledBridgeSearch:
+    """
+    Out-of-core bridge search for networks larger than memory.
+    Segments are streamed into memory-mapped files of square tiles, segments crossing tiles are spilled aside.
+    Bridges are searched inside each tile, then 2-edge-connected parts of the tile are contracted into nodes.
+    Contracting 2-edge-connected parts keeps bridges of the whole network, so global bridges are found
+    in the small boundary graph of contracted nodes, local bridges and cross-tile segments.
+    Buffered coordinates of all tiles are limited by a global budget, the largest buffers are flushed
+    when it is exceeded. Only vertex keys of tile boundaries and nodes of the boundary graph stay in memory.
+    Endpoints are merged by cells of a grid of the tolerance size, so vertices of different tiles are matched
+    without a global vertex index. Unlike the distance snapping of other engines, points closer than
+    the tolerance on both sides of a cell edge are not merged (and points of a cell up to the tolerance
+    multiplied by the square root of 2 are merged).
+    """
+
+    bufferLimit = 1 << 16  # The number of buffered coordinates of a tile before they are flushed to the file
+    maxBufferedCount = 1 << 22  # The budget of buffered coordinates of all tiles (32 Mb)
+
+    def __init__(self, tileSize, tolerance, folder=None):
+        self.tileSize = tileSize
+        self.tolerance = tolerance
+        self.folder = tempfile.mkdtemp(prefix='countroutes_tiles_', dir=folder)
+        self.buffers = dict()  # {tileKey: array('d', [x1, y1, x2, y2,..])}
+        self.bufferedCount = 0  # The number of buffered coordinates of all tiles
+        self.tileFiles = dict()  # {tileKey: path}
+        self.boundaryKeys = dict()  # {tileKey: set([vertexKey,..])} ends of cross-tile segments
+        self.crossSegments = SpilledArray(os.path.join(self.folder, 'cross.bin'), self.bufferLimit)
+        # The boundary graph of contracted nodes
+        self.nodeCount = 0
+        self.singleNodes = bytearray()  # 1 if a contracted node consists of a single vertex
+        self.boundaryNodes = dict()  # {vertexKey: nodeId}
+        self.edgeNodes = array('q')  # [fromNodeId, toNodeId,..] of local bridges and cross-tile segments
+        self.edgeCoords = SpilledArray(os.path.join(self.folder, 'edges.bin'), self.bufferLimit)  # [x1, y1,..]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def getVertexKey(self, x, y):
+        if self.tolerance > 0:
+            return int(x // self.tolerance), int(y // self.tolerance)
+        return x, y
+
+    def getTileKey(self, vertexKey):
+        """
+        Getting the tile by the vertex key, so points merged in a single vertex are in the same tile
+        """
+        x, y = vertexKey
+        if self.tolerance > 0:
+            x, y = x * self.tolerance, y * self.tolerance
+        return int(x // self.tileSize), int(y // self.tileSize)
+
+    def addPolylines(self, polylines):
+        """
+        Streaming segments of polylines [[(x, y),..],..] into tiles
+        """
+        for points in polylines:
+            for (x1, y1), (x2, y2) in zip(points, points[1:]):
+                fromKey = self.getVertexKey(x1, y1)
+                toKey = self.getVertexKey(x2, y2)
+                fromTileKey = self.getTileKey(fromKey)
+                toTileKey = self.getTileKey(toKey)
+                if fromTileKey == toTileKey:
+                    buffer = self.buffers.setdefault(fromTileKey, array('d'))
+                    buffer.extend((x1, y1, x2, y2))
+                    self.bufferedCount += 4
+                    if len(buffer) >= self.bufferLimit:
+                        self.flush(fromTileKey)
+                    elif self.bufferedCount > self.maxBufferedCount:
+                        self.flushLargest()
+                else:
+                    self.crossSegments.extend((x1, y1, x2, y2))
+                    self.boundaryKeys.setdefault(fromTileKey, set()).add(fromKey)
+                    self.boundaryKeys.setdefault(toTileKey, set()).add(toKey)
+
+    def flush(self, tileKey):
+        if tileKey not in self.tileFiles:
+            self.tileFiles[tileKey] = os.path.join(self.folder, f'tile_{len(self.tileFiles)}.bin')
+        buffer = self.buffers.pop(tileKey)
+        self.bufferedCount -= len(buffer)
+        with open(self.tileFiles[tileKey], 'ab') as file:
+            buffer.tofile(file)
+
+    def flushLargest(self):
+        """
+        Flushing the largest buffers until a half of the global budget is buffered,
+        so files are appended by large blocks even on a fine tiling
+        """
+        for tileKey in sorted(self.buffers, key=lambda key: len(self.buffers[key]), reverse=True):
+            if self.bufferedCount <= self.maxBufferedCount // 2:
+                break
+            self.flush(tileKey)
+
+    def searchTile(self, tileKey):
+        """
+        Searching local bridges of a tile and contracting its 2-edge-connected parts into nodes
+        """
+        with open(self.tileFiles[tileKey], 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            coords = memoryview(mapped).cast('d')
+            vertexIds = dict()
+            xs = array('d')
+            ys = array('d')
+
+            def getVertexId(x, y):
+                key = self.getVertexKey(x, y)
+                if key not in vertexIds:
+                    vertexIds[key] = len(xs)
+                    xs.append(x)
+                    ys.append(y)
+                return vertexIds[key]
+
+            fromVertices = array('q')
+            toVertices = array('q')
+            try:
+                for idx in range(0, len(coords), 4):
+                    fromVId = getVertexId(coords[idx], coords[idx + 1])
+                    toVId = getVertexId(coords[idx + 2], coords[idx + 3])
+                    if fromVId != toVId:
+                        fromVertices.extend((fromVId, toVId))
+                        toVertices.extend((toVId, fromVId))
+            finally:
+                coords.release()
+        graph = CountRoutesGraph(xs, ys, fromVertices, toVertices)
+        twins = graph.composingTwins()
+        bridges = searchBridges(toVertices, twins, graph.outOffsets, graph.outEdges, range(len(xs)))
+        isBridge = bytearray(len(fromVertices))
+        for eId in bridges:
+            isBridge[eId] = isBridge[twins[eId]] = 1
+        # Labeling 2-edge-connected parts by the search over paired edges except bridges
+        labels = array('q', [-1]) * len(xs)
+        labelCount = 0
+        for rootId in range(len(xs)):
+            if labels[rootId] >= 0:
+                continue
+            labels[rootId] = labelCount
+            size = 1
+            stack = [rootId]
+            while stack:
+                vId = stack.pop()
+                for eId in graph.outgoingEdges(vId):
+                    nextId = toVertices[eId]
+                    if twins[eId] >= 0 and not isBridge[eId] and labels[nextId] < 0:
+                        labels[nextId] = labelCount
+                        size += 1
+                        stack.append(nextId)
+            self.singleNodes.append(1 if size == 1 else 0)
+            labelCount += 1
+        nodeOffset = self.nodeCount
+        self.nodeCount += labelCount
+        for eId in bridges:
+            self.addEdge(
+                nodeOffset + labels[fromVertices[eId]],
+                nodeOffset + labels[toVertices[eId]],
+                graph.edgePoints(eId)
+            )
+        for key in self.boundaryKeys.get(tileKey, ()):
+            if key in vertexIds:
+                self.boundaryNodes[key] = nodeOffset + labels[vertexIds[key]]
+
+    def addEdge(self, fromNodeId, toNodeId, points):
+        self.edgeNodes.extend((fromNodeId, toNodeId))
+        self.edgeCoords.extend((points[0][0], points[0][1], points[1][0], points[1][1]))
+
+    def getBoundaryNode(self, key):
+        if key not in self.boundaryNodes:  # A vertex joining cross-tile segments only
+            self.boundaryNodes[key] = self.nodeCount
+            self.nodeCount += 1
+            self.singleNodes.append(1)
+        return self.boundaryNodes[key]
+
+    def getBottlenecksPoints(self, isBranches=False, feedback=None, feedbackDelta=0):
+        """
+        :return: A list of bottleneck end points [[(x, y), (x, y)],..]
+        """
+        for tileKey in list(self.buffers):
+            self.flush(tileKey)
+        for idx, tileKey in enumerate(self.tileFiles):
+            if feedback is not None:
+                if feedback.isCanceled():
+                    return []
+                feedback.setProgress(feedback.progress() + feedbackDelta / (len(self.tileFiles) + 1))
+            self.searchTile(tileKey)
+        # Cross-tile segments without duplicates
+        passedKeys = set()
+        with self.crossSegments.view() as coords:
+            for idx in range(0, len(coords), 4):
+                fromKey = self.getVertexKey(coords[idx], coords[idx + 1])
+                toKey = self.getVertexKey(coords[idx + 2], coords[idx + 3])
+                pairKey = (min(fromKey, toKey), max(fromKey, toKey))
+                if fromKey == toKey or pairKey in passedKeys:
+                    continue
+                passedKeys.add(pairKey)
+                self.addEdge(
+                    self.getBoundaryNode(fromKey),
+                    self.getBoundaryNode(toKey),
+                    [(coords[idx], coords[idx + 1]), (coords[idx + 2], coords[idx + 3])]
+                )
+        # The boundary graph keeps parallel edges between nodes, so twins are set explicitly
+        edgeCount = len(self.edgeNodes)
+        fromNodes = array('q', (self.edgeNodes[eId ^ 1] for eId in range(edgeCount)))
+        boundaryGraph = CountRoutesGraph(
+            array('d', [0]) * self.nodeCount,
+            array('d', [0]) * self.nodeCount,
+            fromNodes,
+            self.edgeNodes
+        )
+        boundaryGraph.twins = array('q', (eId ^ 1 for eId in range(edgeCount)))
+        bridges = set(eId >> 1 for eId in searchBridges(
+            boundaryGraph.toVertices,
+            boundaryGraph.twins,
+            boundaryGraph.outOffsets,
+            boundaryGraph.outEdges,
+            range(self.nodeCount)
+        ))
+        if not isBranches:
+            bridges.difference_update(self.getBranchEdges(boundaryGraph))
+        if feedback is not None:
+            feedback.setProgress(feedback.progress() + feedbackDelta / (len(self.tileFiles) + 1))
+        with self.edgeCoords.view() as coords:
+            return [
+                [(coords[4 * idx], coords[4 * idx + 1]), (coords[4 * idx + 2], coords[4 * idx + 3])]
+                for idx in bridges
+            ]
+
+    def getBranchEdges(self, boundaryGraph):
+        """
+        Peeling blind pass branches from single vertex nodes with one edge
+        :return: A set of edge indexes of branches
+        """
+        degrees = array('q', (
+            boundaryGraph.outOffsets[nodeId + 1] - boundaryGraph.outOffsets[nodeId]
+            for nodeId in range(self.nodeCount)
+        ))
+        leaves = [nodeId for nodeId in range(self.nodeCount) if degrees[nodeId] == 1 and self.singleNodes[nodeId]]
+        branches = set()
+        while leaves:
+            nodeId = leaves.pop()
+            for eId in boundaryGraph.outgoingEdges(nodeId):
+                if eId >> 1 in branches:
+                    continue
+                branches.add(eId >> 1)
+                nextId = boundaryGraph.toVertices[eId]
+                degrees[nextId] -= 1
+                if degrees[nextId] == 1 and self.singleNodes[nextId]:
+                    leaves.append(nextId)
+        return branches
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    RouteBottlenecksAlgorithm.py
+    -------------------
+
+    Date                 : September 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from itertools import product
+from qgis.PyQt.QtGui import QIcon
+from qgis.PyQt.QtCore import QVariant
+from processing.algs.qgis.QgisAlgorithm import QgisAlgorithm
+from qgis.core import (
+    QgsWkbTypes,
+    QgsFeature,
+    QgsFeatureSink,
+    QgsFeatureRequest,
+    QgsGeometry,
+    QgsPointXY,
+    QgsField,
+    QgsFields,
+    QgsProcessing,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterDefinition,
+)
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+class RouteBottlenecksAlgorithm(QgisAlgorithm):
+
+    INPUT = 'INPUT'
+    ORIGINS = 'ORIGINS'
+    DESTINATIONS = 'DESTINATIONS'
+    IS_MATRIX = 'IS_MATRIX'
+    TOLERANCE = 'TOLERANCE'
+    SNAP_DISTANCE = 'SNAP_DISTANCE'
+    OUTPUT = 'OUTPUT'
+
+    def __init__(self):
+        super().__init__()
+
+    def icon(self):
+        if self.provider():
+            self.iconPath = self.provider().algIconPath
+        else:
+            self.iconPath = ""
+        return QIcon(self.iconPath)
+
+    def name(self):
+        return 'routebottlenecks'
+
+    def displayName(self):
+        return 'Route Bottlenecks'
+
+    def shortHelpString(self):
+        return "<b>General:</b><br>" \
+               "This algorithm finds <b>bottlenecks lying on every route</b> between origins and destinations " \
+               "on a network of road.<br>" \
+               "Parts of the network without bottlenecks inside are condensed into nodes of a bridge tree, " \
+               "so the bottlenecks of all routes between two points are the sections of the tree path " \
+               "between their nodes. Each pair is answered in logarithmic time, " \
+               "so thousands of pairs are processed at once.<br>" \
+               "<b>Parameters:</b>" \
+               "<ul><li><u>A network layer</u> (the topology of the layer should be clean " \
+               "like for Bottleneck Quest),</li>" \
+               "<li><u>An origin layer</u> and <u>a destination layer</u> of points " \
+               "(points are snapped to the nearest network vertices),</li>" \
+               "<li><u>A choice to query all origin and destination pairs</u> " \
+               "(otherwise origins and destinations are paired in order of features),</li>" \
+               "<li><u>A topology tolerance</u> (a distance between endpoints combined in a single vertex),</li>" \
+               "<li><u>A snap distance</u> (pairs with a point farther from the network are skipped and listed " \
+               "in the log, other pairs keep their order; 0 means no limit).</li></ul>" \
+               "<b>Output:</b><br>" \
+               "A layer of bottleneck sections of each pair with origin and destination feature ids " \
+               "and the order of the section along the route from the origin."
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT,
+            'Network Layer',
+            [QgsProcessing.TypeVectorLine]
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.ORIGINS,
+            'Origins',
+            [QgsProcessing.TypeVectorPoint]
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.DESTINATIONS,
+            'Destinations',
+            [QgsProcessing.TypeVectorPoint]
+        ))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.IS_MATRIX,
+            'Query all origin and destination pairs',
+            False
+        ))
+        params = list()
+        params.append(QgsProcessingParameterNumber(
+            self.TOLERANCE,
+            'Topology tolerance',
+            QgsProcessingParameterNumber.Double,
+            0.01, False, 0, 100
+        ))
+        params.append(QgsProcessingParameterNumber(
+            self.SNAP_DISTANCE,
+            'Snap distance',
+            QgsProcessingParameterNumber.Double,
+            0, False, 0
+        ))
+        for p in params:
+            p.setFlags(p.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+            self.addParameter(p)
+
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT,
+            'Route Bottlenecks',
+            QgsProcessing.TypeVectorLine
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        algName = self.displayName()
+        results = {}
+        feedback.pushInfo(f"[{algName}] The Algorithm started.")
+        network = self.parameterAsSource(parameters, self.INPUT, context)  # QgsProcessingFeatureSource
+        origins = self.parameterAsSource(parameters, self.ORIGINS, context)  # QgsProcessingFeatureSource
+        destinations = self.parameterAsSource(parameters, self.DESTINATIONS, context)  # QgsProcessingFeatureSource
+        isMatrix = self.parameterAsBoolean(parameters, self.IS_MATRIX, context)  # boolean
+        tolerance = self.parameterAsDouble(parameters, self.TOLERANCE, context)  # float
+        snapDistance = self.parameterAsDouble(parameters, self.SNAP_DISTANCE, context)  # float
+        crs = network.sourceCrs()
+        feedback.pushInfo(f"[{algName}] Building the graph model...")
+        try:
+            graph = self.provider().methods.composingNativeGraph(network, tolerance)
+        except:
+            feedback.pushInfo(f"[{algName}] The graph model can not be built. "
+                              "Please, test if the selected vector layer is suited to parameters.")
+            return results
+        if feedback.isCanceled():
+            feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+            return results
+        if graph.edgeCount() == 0:
+            feedback.pushInfo(f"[{algName}] The graph model has no edges. "
+                              "The result layer was not built.")
+            return results
+        feedback.setProgress(20)
+        feedback.pushInfo(f"[{algName}] Building the bridge tree...")
+        try:
+            tree = self.provider().methods.composingBridgeTree(graph, feedback, 30)
+        except:
+            feedback.pushInfo(f"[{algName}] The bridge tree can not be built. "
+                              "Some internal error occurs. Please, let me know the issues "
+                              "(https://github.com/loopgraph/countroutes/issues).")
+            return results
+        if feedback.isCanceled():
+            feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+            return results
+        feedback.setProgress(50)
+        feedback.pushInfo(f"[{algName}] Snapping origins and destinations to the network...")
+        originVertices = self.getPointVertices(origins, tree, snapDistance, crs, context)
+        destinationVertices = self.getPointVertices(destinations, tree, snapDistance, crs, context)
+        snappedOrigins = [(originId, vId) for originId, vId in originVertices if vId >= 0]
+        snappedDestinations = [(destinationId, vId) for destinationId, vId in destinationVertices if vId >= 0]
+        if isMatrix:
+            pairs = product(snappedOrigins, snappedDestinations)
+            pairCount = len(snappedOrigins) * len(snappedDestinations)
+        else:
+            # Features are paired in order, so points which are not snapped keep their places
+            pairs = zip(originVertices, destinationVertices)
+            pairCount = min(len(originVertices), len(destinationVertices))
+        feedback.pushInfo(f"[{algName}] {len(snappedOrigins)} of {len(originVertices)} origins "
+                          f"and {len(snappedDestinations)} of {len(destinationVertices)} destinations "
+                          f"were snapped, {pairCount} pairs are queried.")
+        fields = QgsFields()
+        fields.append(QgsField('origin', QVariant.LongLong))
+        fields.append(QgsField('destination', QVariant.LongLong))
+        fields.append(QgsField('order', QVariant.Int))
+        (sink, dest_id) = self.parameterAsSink(
+            parameters,
+            self.OUTPUT,
+            context,
+            fields,
+            QgsWkbTypes.LineString,
+            crs
+        )
+        separatedCount = 0
+        unsnappedPairs = []  # [(originId, destinationId),..] of pairs with a point out of the snap distance
+        try:
+            for idx, ((originId, fromVId), (destinationId, toVId)) in enumerate(pairs):
+                if feedback.isCanceled():
+                    feedback.pushInfo(f"[{algName}] The Algorithm was canceled")
+                    return results
+                if fromVId < 0 or toVId < 0:
+                    unsnappedPairs.append((originId, destinationId))
+                    continue
+                bridges = tree.queryBridges(fromVId, toVId)
+                if bridges is None:
+                    separatedCount += 1
+                    continue
+                features = []
+                for order, eId in enumerate(bridges):
+                    feat = QgsFeature(fields)
+                    feat.setGeometry(QgsGeometry.fromPolylineXY(
+                        [QgsPointXY(x, y) for x, y in graph.edgePoints(eId)]
+                    ))
+                    feat.setAttributes([originId, destinationId, order])
+                    features.append(feat)
+                sink.addFeatures(features, QgsFeatureSink.FastInsert)
+                feedback.setProgress(50 + 50 * (idx + 1) / pairCount)
+        except:
+            feedback.pushInfo(f"[{algName}] Building the result layer is stopped. "
+                              "Some internal error occurs. "
+                              "Please, let me know the issues "
+                              "(https://github.com/loopgraph/countroutes/issues).")
+            return results
+        if separatedCount:
+            feedback.pushInfo(f"[{algName}] {separatedCount} pairs are in separate parts of the network "
+                              "and have no routes.")
+        if unsnappedPairs:
+            shownPairs = ', '.join(f'{originId}-{destinationId}' for originId, destinationId in unsnappedPairs[:20])
+            feedback.pushInfo(f"[{algName}] {len(unsnappedPairs)} pairs were skipped, their origin or destination "
+                              f"is empty or farther than the snap distance (origin-destination ids: {shownPairs}"
+                              f"{',..' if len(unsnappedPairs) > 20 else ''}).")
+        results[self.OUTPUT] = dest_id
+        feedback.setProgress(100)
+        return results
+
+    @staticmethod
+    def getPointVertices(source, tree, snapDistance, crs, context):
+        """
+        Snapping points of the source to vertices of the bridge tree graph
+        :return: [(featureId, vertexId),..] of all features in order,
+            vertexId is -1 if the geometry is empty or farther than the snap distance
+        """
+        request = QgsFeatureRequest().setNoAttributes().setDestinationCrs(crs, context.transformContext())
+        pointVertices = []
+        for feature in source.getFeatures(request):
+            geometry = feature.geometry()
+            if geometry.isNull() or geometry.isEmpty():
+                pointVertices.append((feature.id(), -1))
+                continue
+            if geometry.isMultipart():
+                point = geometry.asMultiPoint()[0]
+            else:
+                point = geometry.asPoint()
+            pointVertices.append((feature.id(), tree.locateVertex(point.x(), point.y(), snapDistance)))
+        return pointVertices
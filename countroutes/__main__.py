@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    __main__.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+The command line of the headless batch engine (run with the Python of a QGIS installation):
+
+    python -m countroutes networks bottlenecks --processes 8 --stats stats.csv
+
+The exit code is 1 if any file failed.
+"""
+
+import sys
+import argparse
+from .CountRoutesHeadless import runBatch
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='countroutes',
+        description='Finding bottlenecks of line layer files of a folder without the QGIS GUI.'
+    )
+    parser.add_argument('input', help='A folder of line layer files')
+    parser.add_argument('output', help='A folder of bottleneck GeoPackages and statistics')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='The number of worker processes (the CPU count by default)')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='The topology tolerance (a distance between endpoints combined in a single vertex)')
+    parser.add_argument('--branches', action='store_true', help='Include blind pass branches')
+    parser.add_argument('--merge-branches', action='store_true', help='Merge blind pass branches into polylines')
+    parser.add_argument('--no-chain', action='store_true',
+                        help='Write each bottleneck edge separately instead of chains of the same feature')
+    parser.add_argument('--fields', nargs='*', default=(), help='Source fields copied to the output')
+    parser.add_argument('--stats', help='The statistics report, CSV if it ends with .csv or JSON otherwise')
+    args = parser.parse_args(argv)
+
+    def printRecord(record):
+        info = f"{record['status']:>7} {record['file']}"
+        if record['status'] == 'ok':
+            info += f": {record['bottlenecks']} bottlenecks, {record['edges']} edges, {record['seconds']:.2f} s"
+        elif record['message']:
+            info += f": {record['message']}"
+        print(info, flush=True)
+
+    stats = runBatch(
+        args.input,
+        args.output,
+        processes=args.processes,
+        statsPath=args.stats,
+        callback=printRecord,
+        tolerance=args.tolerance,
+        isBranches=args.branches,
+        isMergedBranches=args.merge_branches,
+        isChained=not args.no_chain,
+        fieldNames=args.fields,
+    )
+    return 1 if any(record['status'] == 'failed' for record in stats) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    test_bottleneck_index.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of the incremental bottleneck index without QGIS (run with python -m pytest from the repository folder).
+"""
+
+import random
+import pytest
+from countroutes.BottleneckIndex import BottleneckIndex
+from countroutes.CountRoutesGraph import CountRoutesGraph, searchBridges
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def getRandomFeature(rnd, size=6):
+    """
+    A random walk of 1-3 lattice sides, so features share vertices, circles appear and vanish
+    :return: Polylines [[(x, y),..]]
+    """
+    x, y = rnd.randrange(size), rnd.randrange(size)
+    points = [(x, y)]
+    for _ in range(rnd.randint(1, 3)):
+        dx, dy = rnd.choice(((1, 0), (-1, 0), (0, 1), (0, -1)))
+        x = min(max(x + dx, 0), size - 1)
+        y = min(max(y + dy, 0), size - 1)
+        points.append((x, y))
+    return [points]
+
+
+def getPointPair(pointA, pointB):
+    return frozenset((tuple(pointA), tuple(pointB)))
+
+
+def getExpectedBottlenecks(features):
+    """
+    Bridges and branches of the network built from scratch
+    :return: (bridges, branches) as sets of end point pairs
+    """
+    graph = CountRoutesGraph.fromPolylines(
+        (points for polylines in features.values() for points in polylines), 0.01
+    )
+    graph.composingTwins()
+    bridges = {
+        getPointPair(graph.point(graph.fromVertices[eId]), graph.point(graph.toVertices[eId]))
+        for eId in searchBridges(
+            graph.toVertices, graph.twins, graph.outOffsets, graph.outEdges, range(graph.vertexCount())
+        )
+    }
+    # Peeling vertices of the single neighbour from the leaves
+    neighbours = dict()  # {point: set([point,..])}
+    for eId in range(graph.edgeCount()):
+        fromPoint = graph.point(graph.fromVertices[eId])
+        toPoint = graph.point(graph.toVertices[eId])
+        if fromPoint != toPoint:
+            neighbours.setdefault(fromPoint, set()).add(toPoint)
+    branches = set()
+    leaves = [point for point, points in neighbours.items() if len(points) == 1]
+    while leaves:
+        point = leaves.pop()
+        for nextPoint in neighbours.pop(point, ()):
+            branches.add(getPointPair(point, nextPoint))
+            neighbours[nextPoint].discard(point)
+            if len(neighbours[nextPoint]) == 1:
+                leaves.append(nextPoint)
+    return bridges, branches
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_index_follows_inserts_and_deletes(seed):
+    rnd = random.Random(seed)
+    index = BottleneckIndex(0.01)
+    features = dict()  # {featureId: polylines}
+    nextFeatureId = 0
+    for _ in range(60):
+        action = rnd.random()
+        if features and action < 0.3:
+            featureId = rnd.choice(list(features))
+            index.deleteFeature(featureId)
+            del features[featureId]
+        elif features and action < 0.4:
+            featureId = rnd.choice(list(features))  # A changed geometry
+            features[featureId] = getRandomFeature(rnd)
+            index.addFeature(featureId, features[featureId])
+        else:
+            features[nextFeatureId] = getRandomFeature(rnd)
+            index.addFeature(nextFeatureId, features[nextFeatureId])
+            nextFeatureId += 1
+        bridges, branches = getExpectedBottlenecks(features)
+        assert {getPointPair(*points) for points in index.getBottlenecksPoints(True)} == bridges
+        assert {getPointPair(*points) for points in index.getBottlenecksPoints(False)} == bridges - branches
+
+
+def test_deleted_loop_edge_is_checked_locally():
+    index = BottleneckIndex(0.01)
+    size = 20
+    for x in range(size):
+        for y in range(size):
+            if x + 1 < size:
+                index.addFeature((x, y, 0), [[(x, y), (x + 1, y)]])
+            if y + 1 < size:
+                index.addFeature((x, y, 1), [[(x, y), (x, y + 1)]])
+    assert not index.bridges
+    index.splitBlock = None  # A deletion leaving no bridges should not search the block again
+    index.deleteFeature((5, 5, 0))
+    assert not index.bridges
+    del index.splitBlock
+    index.deleteFeature((0, 0, 0))  # The corner vertex is left with a single edge
+    assert {getPointPair(*points) for points in index.getBottlenecksPoints(True)} == {getPointPair((0, 0), (0, 1))}
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    test_bridge_tree.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of the bridge tree without QGIS (run with python -m pytest from the repository folder).
+"""
+
+import random
+import pytest
+from countroutes.CountRoutesGraph import CountRoutesGraph
+from countroutes.BridgeTree import BridgeTree
+from test_countroutes_graph import getRandomPlanarNetwork, getPairKey, getSearchedBridges
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def getReachableVertices(graph, vId, closedKeys=()):
+    """
+    Vertices reachable from the vertex by paired edges without passing closed pairs of opposite edges
+    """
+    passed = {vId}
+    stack = [vId]
+    while stack:
+        vId = stack.pop()
+        for eId in graph.outgoingEdges(vId):
+            if graph.twins[eId] < 0 or getPairKey(graph, eId) in closedKeys:
+                continue
+            nextVId = graph.toVertices[eId]
+            if nextVId not in passed:
+                passed.add(nextVId)
+                stack.append(nextVId)
+    return passed
+
+
+def getBruteForceRouteBridges(graph, fromVId, toVId):
+    """
+    Bottlenecks of every route by closing each pair of opposite edges on a route between the vertices
+    :return: A set of pair keys or None if the vertices are in separate parts of the network
+    """
+    if toVId not in getReachableVertices(graph, fromVId):
+        return None
+    return {
+        getPairKey(graph, eId) for eId in range(graph.edgeCount())
+        if graph.twins[eId] > eId and toVId not in getReachableVertices(graph, fromVId, {eId})
+    }
+
+
+def getTreeNetwork(seed):
+    """
+    The random network with a separate part far away, so some vertices have no route between them
+    """
+    polylines = getRandomPlanarNetwork(seed, 5)
+    polylines.append([(100, 100), (101, 100), (101, 101)])
+    graph = CountRoutesGraph.fromPolylines(polylines, 0.01)
+    graph.composingTwins()
+    return graph
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_route_bridges_match_path_enumeration(seed):
+    graph = getTreeNetwork(seed)
+    bridges = getSearchedBridges(graph)
+    tree = BridgeTree(graph, bridges)
+    rnd = random.Random(seed)
+    vertexPairs = [
+        (rnd.randrange(graph.vertexCount()), rnd.randrange(graph.vertexCount())) for _ in range(40)
+    ]
+    vertexPairs.append((0, 0))
+    isSeparated = False
+    for (fromVId, toVId), routeBridges in zip(vertexPairs, tree.queryBatch(vertexPairs)):
+        assert routeBridges == tree.queryBridges(fromVId, toVId)
+        expected = getBruteForceRouteBridges(graph, fromVId, toVId)
+        if expected is None:
+            assert routeBridges is None
+            isSeparated = True
+            continue
+        assert {getPairKey(graph, eId) for eId in routeBridges} == expected
+        # Bridges are directed and follow each other along the route, so parts between them are passed
+        # without bridges from the first vertex to the second one
+        part = getReachableVertices(graph, fromVId, bridges)
+        for eId in routeBridges:
+            assert graph.fromVertices[eId] in part
+            part = getReachableVertices(graph, graph.toVertices[eId], bridges)
+        assert toVId in part
+    assert isSeparated, 'Some pairs should be in separate parts of the network'
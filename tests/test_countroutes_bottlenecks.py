@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    test_countroutes_bottlenecks.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of passes over bottlenecks without QGIS (run with python -m pytest from the repository folder).
+"""
+
+from collections import deque
+import itertools
+import random
+import pytest
+from countroutes.CountRoutesGraph import CountRoutesGraph
+from countroutes.CountRoutesBottlenecks import (
+    getGraphBranches,
+    getEdgeChains,
+    getBottleneckChains,
+    getTwoEdgeCuts,
+    getChainImpacts,
+)
+from test_countroutes_graph import getRandomPlanarNetwork, getPairKey, getSearchedBridges
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def getBottleneckNetwork(seed):
+    """
+    The random network with a separate tree and a separate loop with a spur,
+    edges keep the index of their polyline as the feature id
+    """
+    polylines = getRandomPlanarNetwork(seed)
+    polylines.append([(100, 100), (101, 100), (101, 101)])
+    polylines.append([(101, 100), (102, 99)])
+    polylines.append([(200, 200), (201, 200), (201, 201), (200, 200)])
+    polylines.append([(201, 201), (202, 202)])
+    graph = CountRoutesGraph.fromFeaturePolylines(enumerate(polylines), 0.01)
+    graph.composingTwins()
+    return graph
+
+
+def getEdgePairs(graph):
+    return {eId: graph.twins[eId] for eId in range(graph.edgeCount()) if graph.twins[eId] >= 0}
+
+
+def getPeeledBranches(graph, edgePairs):
+    """
+    The original peeling of branches from leaves by scanning the remaining paired edges of vertices
+    """
+    leaves = deque(
+        vId for vId in range(graph.vertexCount())
+        if len([eId for eId in graph.outgoingEdges(vId) if eId in edgePairs]) == 1
+    )
+    branches = set()
+    branchVertices = set()
+    while leaves:
+        vId = leaves.pop()
+        branchVertices.add(vId)
+        curEdges = [eId for eId in graph.outgoingEdges(vId) if eId not in branches and eId in edgePairs]
+        if curEdges:
+            singleEdgeId = curEdges[0]
+            branches |= {singleEdgeId, edgePairs[singleEdgeId]}
+            nextVertexId = graph.toVertices[singleEdgeId]
+            if nextVertexId not in branchVertices:
+                edges = [
+                    eId for eId in graph.outgoingEdges(nextVertexId) if eId not in branches and eId in edgePairs
+                ]
+                if len(edges) == 1:
+                    leaves.append(nextVertexId)
+    return branches, branchVertices
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_branches_match_original_peeling(seed):
+    graph = getBottleneckNetwork(seed)
+    edgePairs = getEdgePairs(graph)
+    branches, branchVertices = getGraphBranches(graph, edgePairs)
+    expected, expectedVertices = getPeeledBranches(graph, edgePairs)
+    assert branches
+    assert branches == expected
+    assert branchVertices == expectedVertices
+
+
+def getExpectedChains(graph, edges, isSameFeature=False):
+    """
+    Chains as groups of edge pairs joined at vertices with exactly two paired edges, both of them in the set
+    :return: A set of frozensets of pair keys
+    """
+    keys = {getPairKey(graph, eId) for eId in edges}
+    groups = {key: {key} for key in keys}
+    for vId in range(graph.vertexCount()):
+        pairedEdges = [eId for eId in graph.outgoingEdges(vId) if graph.twins[eId] >= 0]
+        if len(pairedEdges) != 2:
+            continue
+        fromKey, toKey = (getPairKey(graph, eId) for eId in pairedEdges)
+        if fromKey not in keys or toKey not in keys or groups[fromKey] is groups[toKey]:
+            continue
+        if isSameFeature and graph.featureIds[pairedEdges[0]] != graph.featureIds[pairedEdges[1]]:
+            continue
+        group = groups[fromKey] | groups[toKey]
+        for key in group:
+            groups[key] = group
+    return {frozenset(group) for group in groups.values()}
+
+
+def assertChainsContiguous(graph, chains):
+    for chain in chains:
+        for eId, nextId in zip(chain, chain[1:]):
+            assert graph.toVertices[eId] == graph.fromVertices[nextId]
+            assert nextId != graph.twins[eId]
+
+
+def getChainKeys(graph, chains):
+    chainKeys = [frozenset(getPairKey(graph, eId) for eId in chain) for chain in chains]
+    assert sum(len(keys) for keys in chainKeys) == sum(len(chain) for chain in chains), 'An edge is chained twice'
+    return set(chainKeys)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_edge_chains_match_pair_groups(seed):
+    graph = getBottleneckNetwork(seed)
+    rnd = random.Random(seed)
+    pairedIds = [eId for eId in range(graph.edgeCount()) if graph.twins[eId] >= 0]
+    # Both directions of some pairs are given, the chains should not depend on it
+    edges = [eId for eId in pairedIds if rnd.random() < 0.6]
+    for isSameFeature in (False, True):
+        chains = getEdgeChains(graph, edges, isSameFeature)
+        assertChainsContiguous(graph, chains)
+        assert getChainKeys(graph, chains) == getExpectedChains(graph, edges, isSameFeature)
+        if isSameFeature:
+            for chain in chains:
+                assert len({graph.featureIds[eId] for eId in chain}) == 1
+    assert any(len(chain) > 1 for chain in getEdgeChains(graph, pairedIds, True))
+    assert len(getEdgeChains(graph, pairedIds, True)) > len(getEdgeChains(graph, pairedIds))
+
+
+@pytest.mark.parametrize('seed, isBranches, isMergedBranches, isChained', [
+    (seed, *flags) for seed in range(10) for flags in itertools.product((False, True), repeat=3)
+])
+def test_bottleneck_chains_split_branches(seed, isBranches, isMergedBranches, isChained):
+    graph = getBottleneckNetwork(seed)
+    edgePairs = getEdgePairs(graph)
+    edges = getSearchedBridges(graph)
+    branches = getPeeledBranches(graph, edgePairs)[0]
+    chains = getBottleneckChains(graph, edgePairs, edges, isBranches, isMergedBranches, isChained)
+    assertChainsContiguous(graph, chains)
+    if isBranches and not isMergedBranches:
+        coreEdges = edges
+    else:
+        coreEdges = [eId for eId in edges if eId not in branches]
+    if isChained:
+        expected = getExpectedChains(graph, coreEdges, True)
+    else:
+        expected = {frozenset({getPairKey(graph, eId)}) for eId in coreEdges}
+    if isBranches and isMergedBranches:
+        expected |= getExpectedChains(graph, branches)
+    assert getChainKeys(graph, chains) == expected
+
+
+def getPartCount(graph, closedKeys=()):
+    """
+    The number of connected parts of the network by paired edges without closed pairs of opposite edges
+    """
+    passed = set()
+    partCount = 0
+    for rootId in range(graph.vertexCount()):
+        if rootId in passed:
+            continue
+        partCount += 1
+        passed.add(rootId)
+        stack = [rootId]
+        while stack:
+            vId = stack.pop()
+            for eId in graph.outgoingEdges(vId):
+                nextVId = graph.toVertices[eId]
+                if graph.twins[eId] >= 0 and getPairKey(graph, eId) not in closedKeys and nextVId not in passed:
+                    passed.add(nextVId)
+                    stack.append(nextVId)
+    return partCount
+
+
+class CanceledFeedback:
+
+    def __init__(self):
+        self.value = 0
+
+    def progress(self):
+        return self.value
+
+    def setProgress(self, value):
+        self.value = value
+
+    def isCanceled(self):
+        return True
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_two_edge_cuts_match_pair_closures(seed):
+    polylines = getRandomPlanarNetwork(seed, 5)
+    polylines.append([(100, 100), (101, 100), (101, 101), (100, 101), (100, 100)])  # A separate loop
+    graph = CountRoutesGraph.fromPolylines(polylines, 0.01)
+    groups = getTwoEdgeCuts(graph, None)
+    assert groups, 'The random network should have 2-edge cuts'
+    assert 'twins' in graph.composed
+    basePartCount = getPartCount(graph)
+    bridges = getSearchedBridges(graph)
+    keys = [getPairKey(graph, eId) for eId in range(graph.edgeCount()) if graph.twins[eId] > eId]
+    keys = [key for key in keys if key not in bridges]
+    # Sections are chains of the edges through vertices joining two edges, cuts inside a section are trivial
+    sections = dict()
+    for chain in getEdgeChains(graph, keys):
+        section = frozenset(getPairKey(graph, eId) for eId in chain)
+        sections.update((key, section) for key in section)
+    cutGroups = dict()
+    for groupId, group in enumerate(groups):
+        for chain in group:
+            section = frozenset(getPairKey(graph, eId) for eId in chain)
+            assert section == sections[next(iter(section))], 'A cut group section is not a whole chain'
+            cutGroups.update((key, groupId) for key in section)
+    for fromKey, toKey in itertools.combinations(keys, 2):
+        isCut = getPartCount(graph, {fromKey, toKey}) > basePartCount
+        isExpected = sections[fromKey] is sections[toKey] or (
+            fromKey in cutGroups and cutGroups[fromKey] == cutGroups.get(toKey)
+        )
+        assert isCut == isExpected, (fromKey, toKey)
+    assert getTwoEdgeCuts(graph, None, CanceledFeedback(), 100) == []
+
+
+def getBruteForceSideSums(graph, startId, closedKeys):
+    """
+    Sums of the part reached from the vertex after closing pairs of opposite edges
+    :return: [vertexCount, edgeCount, length]
+    """
+    passed = {startId}
+    stack = [startId]
+    keys = set()
+    length = 0.0
+    while stack:
+        vId = stack.pop()
+        for eId in graph.outgoingEdges(vId):
+            key = getPairKey(graph, eId)
+            if graph.twins[eId] < 0 or key in closedKeys:
+                continue
+            if key not in keys:
+                keys.add(key)
+                (x1, y1), (x2, y2) = graph.edgePoints(eId)
+                length += ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5
+            nextVId = graph.toVertices[eId]
+            if nextVId not in passed:
+                passed.add(nextVId)
+                stack.append(nextVId)
+    return [len(passed), len(keys), length]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_chain_impacts_match_part_searches(seed):
+    graph = getBottleneckNetwork(seed)
+    edgePairs = getEdgePairs(graph)
+    edges = getSearchedBridges(graph)
+    chains = getBottleneckChains(graph, edgePairs, edges, True, True, True)
+    impacts = getChainImpacts(graph, edges, chains)
+    assert len(impacts) == len(chains)
+    for chain, impact in zip(chains, impacts):
+        closedKeys = {getPairKey(graph, eId) for eId in chain}
+        expected = min(
+            getBruteForceSideSums(graph, graph.fromVertices[chain[0]], closedKeys),
+            getBruteForceSideSums(graph, graph.toVertices[chain[-1]], closedKeys)
+        )
+        assert impact[:2] == expected[:2]
+        assert impact[2] == pytest.approx(expected[2])
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    test_countroutes_cache.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of the on-disk graph cache without QGIS (run with python -m pytest from the repository folder).
+"""
+
+import os
+from countroutes.CountRoutesCache import GraphCache, GraphMemoryCache, isFilteredDefinition
+from countroutes.CountRoutesGraph import CountRoutesGraph
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def getCachedGraph(folder):
+    graph = CountRoutesGraph.fromPolylines([[(0, 0), (1, 0), (1, 1), (0, 0)], [(1, 1), (2, 2)]], 0.01)
+    graph.composingTwins()
+    cache = GraphCache(folder, 1 << 30)
+    assert cache.save('network', graph)
+    return cache, graph
+
+
+def test_cached_graph_is_loaded(tmp_path):
+    cache, graph = getCachedGraph(str(tmp_path))
+    loaded = cache.load('network')
+    assert loaded.composed == graph.composed
+    assert list(loaded.twins) == list(graph.twins)
+    assert [loaded.point(vId) for vId in range(loaded.vertexCount())] == \
+        [graph.point(vId) for vId in range(graph.vertexCount())]
+    assert cache.load('another network') is None
+
+
+def test_truncated_entries_are_removed(tmp_path):
+    cache, _ = getCachedGraph(str(tmp_path))
+    path = cache.getPath('network')
+    with open(path, 'rb') as file:
+        data = file.read()
+    for size in list(range(0, len(data), 7)) + [len(data) - 1]:
+        with open(path, 'wb') as file:
+            file.write(data[:size])
+        assert cache.load('network') is None
+        assert not os.path.exists(path)
+    with open(path, 'wb') as file:
+        file.write(data[:len(cache.magic)] + b'\xff' * 8 + data[len(cache.magic) + 8:])  # A broken header size
+    assert cache.load('network') is None
+    assert not os.path.exists(path)
+
+
+class SourceDefinition:
+    """
+    The attributes of QgsProcessingFeatureSourceDefinition read by the gate
+    """
+
+    def __init__(self, selectedFeaturesOnly=False, featureLimit=-1, filterExpression=None):
+        self.selectedFeaturesOnly = selectedFeaturesOnly
+        self.featureLimit = featureLimit
+        if filterExpression is not None:  # Since QGIS 3.32
+            self.filterExpression = filterExpression
+
+
+def test_filtered_sources_are_not_cached():
+    assert not isFilteredDefinition('roads_3f2a')  # A layer id
+    assert not isFilteredDefinition(None)
+    assert not isFilteredDefinition(SourceDefinition())
+    assert not isFilteredDefinition(SourceDefinition(filterExpression=''))
+    assert isFilteredDefinition(SourceDefinition(selectedFeaturesOnly=True))
+    assert isFilteredDefinition(SourceDefinition(featureLimit=0))
+    assert isFilteredDefinition(SourceDefinition(featureLimit=100))
+    assert isFilteredDefinition(SourceDefinition(filterExpression='"highway" = \'primary\''))
+
+
+def getSquaresGraph(count):
+    graph = CountRoutesGraph.fromPolylines(
+        [[(x, 0), (x + 1, 0), (x + 1, 1), (x, 1), (x, 0)] for x in range(0, 2 * count, 2)], 0.01
+    )
+    graph.composingTwins()
+    return graph
+
+
+def test_memory_cache_drops_least_recently_used_graphs():
+    graphs = {key: getSquaresGraph(count) for count, key in enumerate(('a', 'b', 'c'), 1)}
+    sizes = {key: GraphMemoryCache.getGraphSize(graph) for key, graph in graphs.items()}
+    assert sizes['a'] < sizes['b'] < sizes['c']
+    cache = GraphMemoryCache(sizes['a'] + sizes['c'])
+    cache.put(('layer1', 'a'), graphs['a'])
+    cache.put(('layer1', 'b'), graphs['b'])
+    assert cache.get(('layer1', 'a')) is graphs['a']  # The graph b becomes the least recently used
+    cache.put(('layer2', 'c'), graphs['c'])
+    assert cache.get(('layer1', 'b')) is None
+    assert list(cache.graphs) == [('layer1', 'a'), ('layer2', 'c')]
+    assert cache.totalBytes == sizes['a'] + sizes['c']
+    # A graph with new composed stages is stored again with its new size, other graphs are dropped to fit
+    graphs['a'].composingSuccessors()
+    graphs['a'].composingFaces()
+    assert GraphMemoryCache.getGraphSize(graphs['a']) > sizes['a']
+    cache.put(('layer1', 'a'), graphs['a'])
+    assert cache.totalBytes == GraphMemoryCache.getGraphSize(graphs['a']) <= cache.maxBytes
+    assert list(cache.graphs) == [('layer1', 'a')]
+    cache.put(('layer1', 'big'), getSquaresGraph(100))  # A graph over the budget is not stored
+    assert cache.get(('layer1', 'big')) is None
+    assert cache.get(('layer1', 'a')) is graphs['a']
+    cache.put(('layer2', 'b'), graphs['b'])
+    cache.dropLayer('layer1')
+    assert list(cache.graphs) == [('layer2', 'b')]
+    assert cache.totalBytes == sizes['b']
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    test_countroutes_graph.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of the compact graph without QGIS (run with python -m pytest from the repository folder).
+"""
+
+import random
+import pytest
+from countroutes.CountRoutesGraph import CountRoutesGraph, FeedbackMeter, searchBridges
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def getRandomPlanarNetwork(seed, size=7):
+    """
+    A jittered lattice with random missing sides, one diagonal of some cells and dangling spurs,
+    so lines meet only at their vertices (the network is planar and noded)
+    :return: Polylines [[(x, y),..],..]
+    """
+    rnd = random.Random(seed)
+    points = {
+        (i, j): (i + rnd.uniform(-0.2, 0.2), j + rnd.uniform(-0.2, 0.2))
+        for i in range(size) for j in range(size)
+    }
+    polylines = []
+    for i in range(size):
+        for j in range(size):
+            if i + 1 < size and rnd.random() < 0.7:
+                polylines.append([points[(i, j)], points[(i + 1, j)]])
+            if j + 1 < size and rnd.random() < 0.7:
+                polylines.append([points[(i, j)], points[(i, j + 1)]])
+            if i + 1 < size and j + 1 < size and rnd.random() < 0.2:
+                # A diagonal polyline with a middle vertex
+                (x1, y1), (x2, y2) = points[(i, j)], points[(i + 1, j + 1)]
+                polylines.append([(x1, y1), ((x1 + x2) / 2, (y1 + y2) / 2), (x2, y2)])
+    for i in range(size):
+        if rnd.random() < 0.5:
+            x, y = points[(i, 0)]
+            polylines.append([(x, y), (x + 0.1, y - 0.5), (x - 0.1, y - 0.9)])
+    return polylines
+
+
+def getPairKey(graph, eId):
+    return min(eId, graph.twins[eId])
+
+
+def getFaceBottlenecks(graph):
+    """
+    Bottlenecks of the circle model: edges lying on the same face as their opposite edges
+    """
+    graph.composingSuccessors()
+    graph.composingFaces()
+    return {
+        getPairKey(graph, eId) for eId in range(graph.edgeCount())
+        if graph.twins[eId] >= 0 and graph.faces[eId] == graph.faces[graph.twins[eId]]
+    }
+
+
+def getSearchedBridges(graph):
+    bridges = searchBridges(
+        graph.toVertices, graph.twins, graph.outOffsets, graph.outEdges, range(graph.vertexCount())
+    )
+    return {getPairKey(graph, eId) for eId in bridges}
+
+
+def getBruteForceBridges(graph):
+    """
+    Bridges by closing each pair of opposite edges and searching a route between its end vertices
+    """
+    bridges = set()
+    for eId in range(graph.edgeCount()):
+        twinId = graph.twins[eId]
+        if twinId < eId:
+            continue
+        targetId = graph.toVertices[eId]
+        passed = {graph.fromVertices[eId]}
+        stack = [graph.fromVertices[eId]]
+        while stack and targetId not in passed:
+            vId = stack.pop()
+            for nextEId in graph.outgoingEdges(vId):
+                if nextEId in (eId, twinId) or graph.twins[nextEId] < 0:
+                    continue
+                nextVId = graph.toVertices[nextEId]
+                if nextVId not in passed:
+                    passed.add(nextVId)
+                    stack.append(nextVId)
+        if targetId not in passed:
+            bridges.add(eId)
+    return bridges
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_bottleneck_engines_agree(seed):
+    graph = CountRoutesGraph.fromPolylines(getRandomPlanarNetwork(seed), 0.01)
+    graph.composingTwins()
+    expected = getBruteForceBridges(graph)
+    pairCount = sum(1 for eId in range(graph.edgeCount()) if graph.twins[eId] > eId)
+    assert 0 < len(expected) < pairCount, 'The random network should have bottlenecks and circles'
+    assert getSearchedBridges(graph) == expected
+    assert getFaceBottlenecks(graph) == expected
+
+
+def assertTwinsPaired(graph):
+    twins = graph.twins
+    pairedIds = [eId for eId in range(graph.edgeCount()) if twins[eId] >= 0]
+    for eId in pairedIds:
+        twinId = twins[eId]
+        assert graph.fromVertices[twinId] == graph.toVertices[eId]
+        assert graph.toVertices[twinId] == graph.fromVertices[eId]
+        assert twins[twinId] == eId
+    assert len({twins[eId] for eId in pairedIds}) == len(pairedIds), 'A twin is shared by two edges'
+
+
+def test_twins_of_parallel_and_duplicate_edges():
+    # Vertices: 0 (0, 0), 1 (1, 0), 2 (0, 1)
+    # Edges 0-3: two pairs of parallel edges 0-1, edge 4: an extra duplicate 0->1 without an opposite edge,
+    # edges 5-6: a pair 1-2, edge 7: 2->0 without an opposite edge
+    graph = CountRoutesGraph(
+        [0, 1, 0], [0, 0, 1],
+        [0, 1, 0, 1, 0, 1, 2, 2],
+        [1, 0, 1, 0, 1, 2, 1, 0]
+    )
+    twins = graph.composingTwins()
+    assertTwinsPaired(graph)
+    # The lowest ids of parallel edges are paired, other duplicates keep -1
+    assert list(twins) == [1, 0, -1, -1, -1, 6, 5, -1]
+
+
+def test_twins_of_duplicate_polylines():
+    # A square drawn twice, a side drawn three times and a loop of two parallel routes between the same ends
+    square = [(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
+    polylines = [square, list(reversed(square)), [(0, 0), (1, 0)], [(1, 1), (2, 1), (2, 2)],
+                 [(1, 1), (1.5, 2), (2, 2)]]
+    graph = CountRoutesGraph.fromPolylines(polylines, 0.01)
+    twins = graph.composingTwins()
+    assertTwinsPaired(graph)
+    pairCount = sum(1 for eId in range(graph.edgeCount()) if twins[eId] > eId)
+    assert pairCount == 8  # Four sides of the square and four edges of parallel routes
+    assert sum(1 for twinId in twins if twinId < 0) == graph.edgeCount() - 2 * pairCount
+    assert not getSearchedBridges(graph)
+    assert getSearchedBridges(graph) == getBruteForceBridges(graph) == getFaceBottlenecks(graph)
+
+
+def getBruteForceCutVertices(graph):
+    """
+    Cut vertices by closing each vertex and counting the parts its neighbours fall into
+    :return: {vertexId: the number of parts}
+    """
+    cutVertices = dict()
+    for closedId in range(graph.vertexCount()):
+        neighbours = {
+            graph.toVertices[eId] for eId in graph.outgoingEdges(closedId)
+            if graph.twins[eId] >= 0 and graph.toVertices[eId] != closedId
+        }
+        passed = {closedId}
+        partCount = 0
+        for startId in neighbours:
+            if startId in passed:
+                continue
+            partCount += 1
+            passed.add(startId)
+            stack = [startId]
+            while stack:
+                vId = stack.pop()
+                for eId in graph.outgoingEdges(vId):
+                    nextVId = graph.toVertices[eId]
+                    if graph.twins[eId] >= 0 and nextVId not in passed:
+                        passed.add(nextVId)
+                        stack.append(nextVId)
+        if partCount > 1:
+            cutVertices[closedId] = partCount
+    return cutVertices
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_cut_vertices_match_vertex_closures(seed):
+    polylines = getRandomPlanarNetwork(seed)
+    polylines.append([(100, 100), (101, 100), (101, 101), (100, 101), (100, 100)])  # A separate loop
+    polylines.append([(101, 101), (102, 102), (103, 101), (101, 101)])  # joined at a single vertex
+    polylines.append([(103, 101), (104, 101)])
+    polylines.append([(101, 101), (100.5, 102)])  # The vertex joins three parts
+    graph = CountRoutesGraph.fromPolylines(polylines, 0.01)
+    graph.composingTwins()
+    cutVertices = dict()
+    bridges = searchBridges(
+        graph.toVertices, graph.twins, graph.outOffsets, graph.outEdges, range(graph.vertexCount()),
+        cutVertices=cutVertices
+    )
+    assert {getPairKey(graph, eId) for eId in bridges} == getBruteForceBridges(graph)
+    expected = getBruteForceCutVertices(graph)
+    assert any(partCount > 2 for partCount in expected.values())
+    assert cutVertices == expected
+
+
+class CancelingFeedback:
+    """
+    Feedback canceling the run at the given poll of isCanceled
+    """
+
+    def __init__(self, cancelPoll):
+        self.cancelPoll = cancelPoll
+        self.polls = 0
+        self.value = 0
+
+    def progress(self):
+        return self.value
+
+    def setProgress(self, value):
+        self.value = value
+
+    def isCanceled(self):
+        self.polls += 1
+        return self.polls >= self.cancelPoll
+
+
+def test_meter_stops_when_run_is_canceled():
+    feedback = CancelingFeedback(3)
+    meter = FeedbackMeter(feedback, 90, 10 * (FeedbackMeter.mask + 1))
+    mask = meter.mask
+    passed = 0
+    for idx in range(meter.total):
+        if not idx & mask and meter.step(idx):
+            break
+        passed += 1
+    assert passed == 2 * (mask + 1)  # Polled at the start and after each block of the mask
+    assert meter.isCanceled
+    assert feedback.progress() == 90 * passed / meter.total
+
+
+@pytest.mark.parametrize('cancelPoll', [1, 2])
+def test_graph_stages_stop_when_run_is_canceled(cancelPoll):
+    size = 150  # A grid of more half-edges than a block of the meter mask
+    polylines = [[(i, j), (i + 1, j)] for i in range(size - 1) for j in range(size)]
+    polylines.extend([(i, j), (i, j + 1)] for i in range(size) for j in range(size - 1))
+    graph = CountRoutesGraph.fromPolylines(polylines, 0.01)
+    graph.composingTwins(CancelingFeedback(cancelPoll), 10)
+    assert 'twins' not in graph.composed
+    graph.composingTwins()
+    feedback = CancelingFeedback(cancelPoll)
+    bridges = searchBridges(
+        graph.toVertices, graph.twins, graph.outOffsets, graph.outEdges, range(graph.vertexCount()),
+        feedback=feedback, feedbackDelta=10
+    )
+    assert bridges == [] and feedback.polls == cancelPoll
+    assert feedback.progress() < 10
+
+
+@pytest.mark.parametrize('isComposed', [False, True])
+def test_faces_of_unit_grid(isComposed):
+    size = 4
+    polylines = [[(i, j), (i + 1, j)] for i in range(size) for j in range(size + 1)]
+    polylines.extend([(i, j), (i, j + 1)] for i in range(size + 1) for j in range(size))
+    polylines.append([(0, 0), (1, 1)])  # The diagonal splits the first cell into two triangles
+    polylines.append([(2.5, 2.5), (3, 3)])  # A blind spur inside a cell does not bound its face
+    graph = CountRoutesGraph.fromPolylines(polylines, 0.01)
+    graph.composingTwins()
+    graph.composingSuccessors()
+    if isComposed:
+        graph.composingFaces()
+    faces = list(graph.iterFaces())
+    assert sorted(eId for face in faces for eId in face) == [
+        eId for eId in range(graph.edgeCount()) if graph.twins[eId] >= 0
+    ]
+    for face in faces:
+        for eId, nextId in zip(face, face[1:] + face[:1]):
+            assert graph.successors[eId] == nextId
+    measures = sorted(
+        (round(area, 9), round(perimeter, 9), edgeCount) for face, area, perimeter, edgeCount
+        in graph.iterBoundedFaces()
+    )
+    triangle = (0.5, round(2 + 2 ** 0.5, 9), 3)
+    assert measures == [triangle, triangle] + [(1.0, 4.0, 4)] * (size * size - 1)
+    assert len(faces) == len(measures) + 1  # The outer face is skipped
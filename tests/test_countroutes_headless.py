@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    test_countroutes_headless.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of the batch pool without QGIS (run with python -m pytest from the repository folder).
+Tasks are analysed by a function of this module instead of QGIS, worker processes import it by name.
+"""
+
+import os
+import time
+import pytest
+from countroutes import CountRoutesHeadless
+from countroutes.CountRoutesHeadless import runTasks, getStatsRecord
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def analyseTestTask(task):
+    """
+    A task of the path 'crash' kills its worker process, a task of the path 'slow' takes half a minute
+    """
+    path, outputFolder, options = task
+    if path == 'crash':
+        os._exit(1)
+    time.sleep(30 if path == 'slow' else 0.2)
+    return getStatsRecord(path, options.get('name'))
+
+
+@pytest.fixture
+def testTasks(monkeypatch):
+    monkeypatch.setattr(CountRoutesHeadless, 'analyseNetworkTask', analyseTestTask)
+
+
+def test_crashed_worker_files_are_failed(testTasks):
+    paths = ['a', 'crash', 'b', 'c']
+    tasks = [(path, 'output', {'name': path.upper()}) for path in paths]
+    records = []
+    result = runTasks(tasks, 2, records.append, pollSeconds=0.1)
+    assert sorted(result) == sorted(paths)
+    assert sorted(record['file'] for record in records) == sorted(paths)
+    assert result['crash']['status'] == 'failed'
+    assert result['crash']['name'] == 'CRASH'
+    assert all(record['status'] in ('ok', 'failed') for record in records)
+
+
+def test_canceled_pool_stops_at_once(testTasks):
+    startTime = time.time()
+    result = runTasks(
+        [('a', 'output', {}), ('slow', 'output', {}), ('b', 'output', {})], 2,
+        isCanceled=lambda: time.time() - startTime > 3, pollSeconds=0.1
+    )
+    assert time.time() - startTime < 15
+    assert 'slow' not in result
+    assert set(result) <= {'a', 'b'}
+
+
+def test_canceled_serial_run_skips_other_files(testTasks):
+    records = []
+    result = runTasks(
+        [('a', 'output', {}), ('b', 'output', {})], 1, records.append, isCanceled=lambda: bool(records)
+    )
+    assert list(result) == ['a'] and len(records) == 1
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    test_countroutes_noding.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of noding polylines without QGIS (run with python -m pytest from the repository folder).
+"""
+
+import random
+import pytest
+from countroutes.CountRoutesNoding import nodePolylines, getSegmentJunctions
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def getBruteForceNoding(featurePolylines, tolerance):
+    """
+    Noding by testing every pair of segments without the spatial hash
+    :return: ([(featureId, [(x, y),..]),..], the number of added junction points)
+    """
+    segments = [
+        (x1, y1, x2, y2)
+        for featureId, points in featurePolylines for (x1, y1), (x2, y2) in zip(points, points[1:])
+    ]
+    extentSum = sum(max(abs(x2 - x1), abs(y2 - y1)) for x1, y1, x2, y2 in segments)
+    snapDistance = tolerance or max(extentSum / len(segments), 2 * tolerance) * 1e-9
+    splits = dict()
+    for pId in range(len(segments)):
+        for qId in range(pId + 1, len(segments)):
+            for x, y, tP, tQ in getSegmentJunctions(*segments[pId], *segments[qId], snapDistance ** 2):
+                if tP is not None:
+                    splits.setdefault(pId, dict())[(x, y)] = tP
+                if tQ is not None:
+                    splits.setdefault(qId, dict())[(x, y)] = tQ
+    nodedPolylines = []
+    junctionPoints = set()
+    sId = 0
+    for featureId, points in featurePolylines:
+        nodedPoints = list(points[:1])
+        for point in points[1:]:
+            segmentSplits = splits.get(sId, dict())
+            junctionPoints.update(segmentSplits)
+            nodedPoints.extend(sorted(segmentSplits, key=segmentSplits.get))
+            nodedPoints.append(point)
+            sId += 1
+        nodedPolylines.append((featureId, nodedPoints))
+    return nodedPolylines, len(junctionPoints)
+
+
+def getRandomPolylines(seed, count=40):
+    """
+    Random polylines of one to three segments, some of them lying on axis lines to make overlaps and T-junctions
+    """
+    rnd = random.Random(seed)
+    polylines = []
+    for featureId in range(count):
+        if rnd.random() < 0.3:
+            y = rnd.randrange(5)
+            x1, x2 = sorted(rnd.sample(range(11), 2))
+            points = [(float(x1), float(y)), (float(x2), float(y))]
+        else:
+            points = [(rnd.uniform(0, 10), rnd.uniform(0, 4)) for _ in range(rnd.randint(2, 4))]
+        polylines.append((featureId, points))
+    return polylines
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('tolerance', [0, 0.001, 0.05])
+def test_noding_matches_pair_tests(seed, tolerance):
+    polylines = getRandomPolylines(seed)
+    nodedPolylines, junctionCount = nodePolylines(polylines, tolerance)
+    expected, expectedCount = getBruteForceNoding(polylines, tolerance)
+    assert junctionCount == expectedCount > 0
+    assert nodedPolylines == expected
+
+
+@pytest.mark.parametrize('polylines, expected, expectedCount', [
+    (  # An X crossing splits both lines
+        [[(0, 0), (2, 2)], [(0, 2), (2, 0)]],
+        [[(0, 0), (1, 1), (2, 2)], [(0, 2), (1, 1), (2, 0)]],
+        1
+    ),
+    (  # A T-junction splits the through line only
+        [[(0, 0), (2, 0)], [(1, 0), (1, 1)]],
+        [[(0, 0), (1, 0), (2, 0)], [(1, 0), (1, 1)]],
+        1
+    ),
+    (  # Overlapping lines are split at the ends of each other
+        [[(0, 0), (2, 0)], [(1, 0), (3, 0)]],
+        [[(0, 0), (1, 0), (2, 0)], [(1, 0), (2, 0), (3, 0)]],
+        2
+    ),
+    (  # Lines meeting at their ends are not changed
+        [[(0, 0), (1, 0)], [(1, 0), (1, 1)], [(1, 1), (0, 0)]],
+        [[(0, 0), (1, 0)], [(1, 0), (1, 1)], [(1, 1), (0, 0)]],
+        0
+    ),
+    (  # An end within the tolerance of a line splits the line at the end point
+        [[(0, 0), (2, 0)], [(1, 0.0005), (1, 1)]],
+        [[(0, 0), (1, 0.0005), (2, 0)], [(1, 0.0005), (1, 1)]],
+        1
+    ),
+])
+def test_noding_of_junction_kinds(polylines, expected, expectedCount):
+    nodedPolylines, junctionCount = nodePolylines(enumerate(polylines), 0.001)
+    assert [points for featureId, points in nodedPolylines] == expected
+    assert junctionCount == expectedCount
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    test_countroutes_parallel.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of the parallel bridge search without QGIS (run with python -m pytest from the repository folder).
+"""
+
+import pytest
+from countroutes import CountRoutesParallel
+from countroutes.CountRoutesGraph import CountRoutesGraph, searchBridges
+from countroutes.CountRoutesParallel import getBridgeEdgesParallel, getComponentChunks
+from test_countroutes_graph import getRandomPlanarNetwork
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+class Feedback:
+
+    def __init__(self):
+        self.value = 0
+
+    def progress(self):
+        return self.value
+
+    def setProgress(self, value):
+        self.value = value
+
+    def isCanceled(self):
+        return False
+
+
+def getSerialBridges(graph):
+    cutVertices = dict()
+    bridges = searchBridges(
+        graph.toVertices, graph.twins, graph.outOffsets, graph.outEdges, range(graph.vertexCount()),
+        cutVertices=cutVertices
+    )
+    return set(bridges), cutVertices
+
+
+def getPartsGraph(seeds):
+    """
+    Random networks side by side as separate connected parts of a single graph
+    """
+    polylines = []
+    for idx, seed in enumerate(seeds):
+        polylines.extend(
+            [(x + 100 * idx, y) for x, y in points] for points in getRandomPlanarNetwork(seed, 5)
+        )
+    graph = CountRoutesGraph.fromPolylines(polylines, 0.01)
+    graph.composingTwins()
+    return graph
+
+
+@pytest.mark.parametrize('processes', [2, 3])
+def test_parallel_bridges_match_serial_search(processes):
+    graph = getPartsGraph(range(10))
+    assert len(getComponentChunks(graph, processes * 4)) > 1
+    expectedBridges, expectedCutVertices = getSerialBridges(graph)
+    feedback = Feedback()
+    assert getBridgeEdgesParallel(graph, processes, feedback, 10) == expectedBridges
+    cutVertices = dict()
+    assert getBridgeEdgesParallel(graph, processes, feedback, 10, cutVertices) == expectedBridges
+    assert cutVertices and cutVertices == expectedCutVertices
+
+
+def test_single_part_is_searched_without_pool(monkeypatch):
+    graph = CountRoutesGraph.fromPolylines(
+        [[(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)], [(1, 1), (2, 2), (3, 2)], [(2, 2), (2, 3)]], 0.01
+    )
+    graph.composingTwins()
+    assert len(getComponentChunks(graph, 8)) == 1
+    monkeypatch.setattr(CountRoutesParallel, 'getProcessContext', None)  # The pool would fail to start
+    expectedBridges, expectedCutVertices = getSerialBridges(graph)
+    cutVertices = dict()
+    feedback = Feedback()
+    assert getBridgeEdgesParallel(graph, 2, feedback, 10, cutVertices) == expectedBridges
+    assert cutVertices == expectedCutVertices
+    assert feedback.progress() == 10
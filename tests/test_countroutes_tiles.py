@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+****************************************************************************
+    test_countroutes_tiles.py
+    -------------------
+
+    Date                 : October 2024
+    Copyright            : (C) 2024 by Pavel Minin
+    Email                : mininpa@gmail.com
+
+****************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of the tiled out-of-core bridge search without QGIS (run with python -m pytest from the repository folder).
+"""
+
+import pytest
+from countroutes.CountRoutesGraph import CountRoutesGraph
+from countroutes.CountRoutesTiles import TiledBridgeSearch
+from test_countroutes_graph import getRandomPlanarNetwork, getSearchedBridges
+
+__license__ = 'GPL version 3'
+__copyright__ = 'Copyright 2024, Pavel Minin'
+__email__ = 'mininpa@gmail.com'
+
+
+def getPointPair(points):
+    return frozenset((round(x, 9), round(y, 9)) for x, y in points)
+
+
+def getExpectedBottlenecks(polylines, tolerance):
+    """
+    Bridges of the whole network and bridges left after peeling blind branches from the leaves
+    :return: (bridges, bridges without branches) as sets of end point pairs
+    """
+    graph = CountRoutesGraph.fromPolylines(polylines, tolerance)
+    graph.composingTwins()
+    bridges = {getPointPair(graph.edgePoints(eId)) for eId in getSearchedBridges(graph)}
+    neighbours = dict()  # {vId: set([vId,..])}
+    for eId in range(graph.edgeCount()):
+        neighbours.setdefault(graph.fromVertices[eId], set()).add(graph.toVertices[eId])
+    leaves = [vId for vId, vertices in neighbours.items() if len(vertices) == 1]
+    branches = set()
+    while leaves:
+        vId = leaves.pop()
+        for nextId in neighbours.pop(vId, ()):
+            branches.add(getPointPair((graph.point(vId), graph.point(nextId))))
+            neighbours[nextId].discard(vId)
+            if len(neighbours[nextId]) == 1:
+                leaves.append(nextId)
+    return bridges, bridges - branches
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('tileSize', [0.4, 1.3, 2.5, 100])
+@pytest.mark.parametrize('bufferLimit, maxBufferedCount', [(1 << 16, 1 << 22), (8, 12)])
+def test_tiled_bridges_agree(seed, tileSize, bufferLimit, maxBufferedCount, monkeypatch):
+    # Lattice sides are about 1, so circles of tiles of 0.4 and 1.3 cross tile borders
+    monkeypatch.setattr(TiledBridgeSearch, 'bufferLimit', bufferLimit)
+    monkeypatch.setattr(TiledBridgeSearch, 'maxBufferedCount', maxBufferedCount)
+    polylines = getRandomPlanarNetwork(seed, 9)
+    bridges, trunkBridges = getExpectedBottlenecks(polylines, 0.001)
+    for isBranches, expected in ((True, bridges), (False, trunkBridges)):
+        with TiledBridgeSearch(tileSize, 0.001) as tiles:
+            tiles.addPolylines(polylines)
+            assert tiles.bufferedCount <= maxBufferedCount
+            assert {getPointPair(points) for points in tiles.getBottlenecksPoints(isBranches)} == expected